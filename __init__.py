@@ -1,6 +1,15 @@
+import _backends
+reload(_backends)
+
+import _graph
+reload(_graph)
+
 import _factories
 reload(_factories)
 
+import profiling
+reload(profiling)
+
 import general
 reload(general)
 
@@ -10,6 +19,30 @@ reload(datatypes)
 import functions
 reload(functions)
 
+import evaluate
+reload(evaluate)
+
+import optimizer
+reload(optimizer)
+
+import simplify
+reload(simplify)
+
+import compiler
+reload(compiler)
+
+import templates
+reload(templates)
+
+import serialize
+reload(serialize)
+
+import cache
+reload(cache)
+
+import analysis
+reload(analysis)
+
 # import functions
 # reload(functions)
 
@@ -0,0 +1,624 @@
+'''
+
+Backends perform the scene edits that operations request: creating nodes, setting and connecting plugs.
+
+PyMelBackend runs every edit straight away through PyMEL.
+ModifierBackend queues the edits on one MDGModifier and runs them at commit(), this avoids a command,
+an undo entry and a PyNode for every edit. Until commit() nodes only exist on the modifier,
+so it hands out Node and Plug handles that mimic the parts of PyMEL the operations use.
+
+'''
+
+import pymel.core as pmc
+import maya.api.OpenMaya as om
+
+
+# The node types of the session, these are only queried once
+_nodeTypes = None
+
+
+class RecordingError(RuntimeError):
+    ''' Raised when a build cannot be recorded, for example because it reads values that do not exist yet. '''
+
+
+class Backend(object):
+
+    def createNode(self, type, name, **kwargs):
+        raise NotImplementedError('%s does not support node creation.' % self.__class__.__name__)
+
+    def connect(self, source, destination):
+        raise NotImplementedError('%s does not support connections.' % self.__class__.__name__)
+
+    def setAttr(self, plug, value):
+        raise NotImplementedError('%s does not support setting values.' % self.__class__.__name__)
+
+    def plug(self, name):
+        ''' Returns the plug for an attribute name. '''
+        raise NotImplementedError('%s does not support plug lookups.' % self.__class__.__name__)
+
+    def deleteNodes(self, names):
+        raise NotImplementedError('%s does not support deleting nodes.' % self.__class__.__name__)
+
+    def hasNodeType(self, type):
+        global _nodeTypes
+        if _nodeTypes is None:
+            _nodeTypes = set(pmc.allNodeTypes())
+        return type in _nodeTypes
+
+    def commit(self):
+        pass
+
+
+class PyMelBackend(Backend):
+
+    def createNode(self, type, name, **kwargs):
+        node = pmc.createNode(type, **kwargs)
+        node.rename(name)
+        return node
+
+    def connect(self, source, destination):
+        _toAttribute(source).connect(_toAttribute(destination))
+
+    def setAttr(self, plug, value):
+        _toAttribute(plug).set(value)
+
+    def plug(self, name):
+        if not pmc.objExists(name):
+            raise TypeError('Attribute: %s does not exist' % str(name))
+        return pmc.PyNode(name)
+
+    def deleteNodes(self, names):
+        pmc.delete(names)
+
+
+def _toAttribute(plug):
+    # Plugs built by a modifier that has already run are edited like any other attribute
+    return pmc.PyNode(plug.name()) if isinstance(plug, Plug) else plug
+
+
+def readValues(plugs):
+    '''
+    Reads the values of many plugs through the api, rather than a PyMEL query for each.
+    Compounds are read as tuples of their children and matrices as flat tuples.
+    '''
+
+    values = [None] * len(plugs)
+
+    # PyMEL attributes are looked up together, plugs listed twice are only selected once
+    selection = None
+    selected = {}
+    indices = []
+    for i, plug in enumerate(plugs):
+        if isinstance(plug, Plug):
+            _assertReadable(plug)
+            values[i] = _readPlug(plug.backend.api, plug.plug())
+            continue
+
+        name = plug.name()
+        if name not in selected:
+            if selection is None:
+                selection = om.MSelectionList()
+            selected[name] = len(selected)
+            selection.add(name)
+        indices.append((i, selected[name]))
+
+    for i, index in indices:
+        values[i] = _readPlug(om, selection.getPlug(index))
+
+    return values
+
+
+def _assertReadable(plug):
+    # Recorded builds are replayed on other inputs, values read while recording would be wrong for them
+    if isinstance(plug.backend, RecordingBackend):
+        raise RecordingError('%s cannot be read while its build is recorded.' % plug.name())
+
+
+def _readPlug(api, mplug):
+    if mplug.isCompound:
+        return tuple(_readPlug(api, mplug.child(i)) for i in range(mplug.numChildren()))
+
+    attribute = mplug.attribute()
+    if attribute.hasFn(api.MFn.kMatrixAttribute) or (attribute.hasFn(api.MFn.kTypedAttribute) and
+                                                     api.MFnTypedAttribute(attribute).attrType() == api.MFnData.kMatrix):
+        return tuple(api.MFnMatrixData(mplug.asMObject()).matrix())
+
+    # Unit attributes are read in ui units, as PyMEL queries them
+    if attribute.hasFn(api.MFn.kUnitAttribute):
+        unitType = api.MFnUnitAttribute(attribute).unitType()
+        if unitType == api.MFnUnitAttribute.kAngle:
+            return mplug.asMAngle().asUnits(api.MAngle.uiUnit())
+        if unitType == api.MFnUnitAttribute.kDistance:
+            return mplug.asMDistance().asUnits(api.MDistance.uiUnit())
+
+    return mplug.asDouble()
+
+
+def getNodeObject(node):
+    ''' Returns the api module and MObject of a node made by a backend. '''
+    if isinstance(node, Node):
+        return node.backend.api, node.obj
+
+    selection = om.MSelectionList()
+    selection.add(node.name())
+    return om, selection.getDependNode(0)
+
+
+class ModifierBackend(Backend):
+    '''
+    Queues scene edits on a single MDGModifier.
+    :param api: The module providing the modifier api, maya.api.OpenMaya by default.
+    '''
+
+    def __init__(self, api=None):
+        self.api = api or om
+        self.modifier = self.api.MDGModifier()
+        self.nodes = []
+        self.committed = False
+        self._nodesByName = {}
+        self._edits = []
+        self._sources = {}
+
+    def createNode(self, type, name, **kwargs):
+        if kwargs:
+            raise NotImplementedError('%s does not support the createNode flags: %s' % (
+                self.__class__.__name__, ', '.join(sorted(kwargs))))
+
+        name = self.uniqueName(name)
+        obj = self.modifier.createNode(type)
+        self.modifier.renameNode(obj, name)
+
+        node = self._makeNode(obj, name, type)
+        self.nodes.append(node)
+        self._nodesByName[name] = node
+        return node
+
+    def _makeNode(self, obj, name, type):
+        return Node(self, obj, name)
+
+    def uniqueName(self, name):
+        '''
+        Returns the name, numbered like Maya numbers nodes if a pending node already has it, so plug names
+        always resolve to the node they were created for.
+        '''
+
+        if name not in self._nodesByName:
+            return name
+
+        base = name.rstrip('0123456789')
+        number = int(name[len(base):] or 0) + 1
+        while '%s%d' % (base, number) in self._nodesByName:
+            number += 1
+        return '%s%d' % (base, number)
+
+    def connect(self, source, destination):
+        self._sources[self.plug(destination)] = source
+        self._edits.append((self._connect, source, destination))
+
+    def setAttr(self, plug, value):
+        self._edits.append((self._setAttr, plug, value))
+
+    def plug(self, name):
+        if isinstance(name, Plug):
+            return name
+        if not isinstance(name, basestring):
+            name = name.name()
+
+        node_name, _, path = name.partition('.')
+        node = self._nodesByName.get(node_name)
+        if node is not None:
+            return node.attr(path)
+
+        selection = self.api.MSelectionList()
+        try:
+            selection.add(node_name)
+        except RuntimeError:
+            raise TypeError('Attribute: %s does not exist' % str(name))
+
+        return Node(self, selection.getDependNode(0)).attr(path)
+
+    def hasNodeType(self, type):
+        # Stand-ins for the api list the node types they know
+        nodeTypes = getattr(self.api, 'NODE_TYPES', None)
+        if nodeTypes is not None:
+            return type in nodeTypes
+        return Backend.hasNodeType(self, type)
+
+    def sources(self, plug):
+        ''' Returns the plugs queued to connect into the plug. '''
+        source = self._sources.get(plug)
+        return [] if source is None else [self.plug(source)]
+
+    def commit(self):
+        '''
+        Runs the queued edits. Nodes and attributes are added first, so the plugs of the
+        connections and values exist when they are resolved.
+        '''
+
+        self.modifier.doIt()
+
+        edits, self._edits = self._edits, []
+        for edit, plug, value in edits:
+            edit(plug, value)
+
+        self.modifier.doIt()
+
+        # Maya may have made the names unique
+        self.committed = True
+        self._nodesByName.clear()
+        self._sources.clear()
+
+    def _connect(self, source, destination):
+        '''
+        Connects the plugs, converting between their units the way Maya does when connecting
+        in the scene, the modifier itself connects them as they are.
+        '''
+
+        source = self.plug(source)
+        destination = self.plug(destination)
+
+        factor = _getConversionFactor(self.api, source, destination)
+        if factor is None:
+            self.modifier.connect(source.plug(), destination.plug())
+            return
+
+        conversion = self.createNode('unitConversion', 'unitConversion')
+        self._setAttr(conversion.conversionFactor, factor)
+        self.modifier.connect(source.plug(), conversion.input.plug())
+        self.modifier.connect(conversion.output.plug(), destination.plug())
+
+    def _setAttr(self, plug, value):
+        api = self.api
+        plug = self.plug(plug)
+        mplug = plug.plug()
+
+        if isinstance(value, list) or isinstance(value, tuple):
+            if plug.type() == 'matrix':
+                data = api.MFnMatrixData().create(api.MMatrix([float(item) for item in value]))
+                self.modifier.newPlugValue(mplug, data)
+            else:
+                for child, item in zip(plug.getChildren(), value):
+                    self._setAttr(child, item)
+            return
+
+        kind = plug.type()
+        if kind == 'doubleAngle':
+            self.modifier.newPlugValueMAngle(mplug, api.MAngle(value, api.MAngle.uiUnit()))
+        elif kind == 'doubleLinear':
+            self.modifier.newPlugValueMDistance(mplug, api.MDistance(value, api.MDistance.uiUnit()))
+        elif kind == 'bool':
+            self.modifier.newPlugValueBool(mplug, bool(value))
+        elif kind in ['byte', 'short', 'long', 'enum']:
+            self.modifier.newPlugValueInt(mplug, int(value))
+        else:
+            self.modifier.newPlugValueDouble(mplug, float(value))
+
+
+def _getUnitFactor(api, plug):
+    ''' Returns the ui units in one internal unit of the plug, or None if it is not numeric. '''
+
+    kind = plug.type()
+    if kind in ['double2', 'double3', 'double4']:
+        kind = plug.getChildren()[0].type()
+
+    if kind == 'doubleAngle':
+        return api.MAngle(1.0, api.MAngle.kRadians).asUnits(api.MAngle.uiUnit())
+    elif kind == 'doubleLinear':
+        return api.MDistance(1.0, api.MDistance.kCentimeters).asUnits(api.MDistance.uiUnit())
+    elif kind in ['double', 'float', 'bool', 'byte', 'short', 'long', 'enum']:
+        return 1.0
+    return None
+
+
+def _getConversionFactor(api, source, destination):
+    ''' Returns the factor of the unitConversion Maya puts between the plugs, or None if it puts none. '''
+
+    source_factor = _getUnitFactor(api, source)
+    destination_factor = _getUnitFactor(api, destination)
+    if source_factor is None or destination_factor is None:
+        return None
+
+    factor = source_factor / destination_factor
+    if abs(factor - 1.0) < 1e-9:
+        return None
+    return factor
+
+
+class Node(object):
+    ''' A handle to a node, which may still be pending on a modifier. '''
+
+    def __init__(self, backend, obj, name=None):
+        self.backend = backend
+        self.obj = obj
+        self._name = name
+        self._attributes = {}
+        self._pending = {}
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.obj == other.obj
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.backend.api.MObjectHandle(self.obj).hashCode()
+
+    def __str__(self):
+        return self.name()
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return self.attr(item)
+
+    def __apimfn__(self):
+        return self.backend.api.MFnDependencyNode(self.obj)
+
+    def name(self):
+        # Names are only applied when the modifier runs
+        if self._name is not None and not self.backend.committed:
+            return self._name
+        return self.__apimfn__().name()
+
+    def attr(self, path):
+        return Plug(self, path.split('.')) if path else self
+
+    def attribute(self, name):
+        ''' Returns the attribute object for a name, including attributes added by addAttr. '''
+        if name in self._attributes:
+            return self._attributes[name]
+        return self.__apimfn__().attribute(name)
+
+    def addAttr(self, name, at='double', parent=None, numberOfChildren=None, multi=False, **kwargs):
+        '''
+        Adds a dynamic attribute like pmc.addAttr. Compound attributes are added once all their children are.
+        '''
+
+        api = self.backend.api
+
+        if at in ['double3', 'compound']:
+            self._pending[name] = (at, numberOfChildren or 3, [], multi)
+            return
+
+        if at == 'matrix':
+            attribute = api.MFnMatrixAttribute().create(name, name)
+        else:
+            numeric_types = {
+                'double': api.MFnNumericData.kDouble,
+                'bool': api.MFnNumericData.kBoolean,
+                'byte': api.MFnNumericData.kByte,
+                'long': api.MFnNumericData.kInt,
+            }
+            attribute = api.MFnNumericAttribute().create(name, name, numeric_types[at], 0)
+
+        if parent is None:
+            api.MFnAttribute(attribute).array = multi
+            self._addAttribute(name, attribute)
+            return
+
+        parent_type, count, children, multi = self._pending[parent]
+        children.append(attribute)
+        self._attributes[name] = attribute
+        if len(children) < count:
+            return
+
+        del self._pending[parent]
+        if parent_type == 'double3':
+            attribute = api.MFnNumericAttribute().create(parent, parent, *children)
+        else:
+            fn = api.MFnCompoundAttribute()
+            attribute = fn.create(parent, parent)
+            for child in children:
+                fn.addChild(child)
+
+        api.MFnAttribute(attribute).array = multi
+        self._addAttribute(parent, attribute)
+
+    def _addAttribute(self, name, attribute):
+        self._attributes[name] = attribute
+        self.backend.modifier.addAttribute(self.obj, attribute)
+
+
+class Plug(object):
+    ''' A handle to a plug, stored as a node and attribute path so it can be resolved once the node exists. '''
+
+    def __init__(self, node, path):
+        self._node = node
+        self._path = list(path)
+
+    @property
+    def backend(self):
+        return self._node.backend
+
+    def __eq__(self, other):
+        return isinstance(other, Plug) and self._node == other._node and self.name() == other.name()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        # Pending nodes can share a name until the modifier runs, so plugs are hashed by their node
+        return hash((self._node, self._path[-1]))
+
+    def __str__(self):
+        return self.name()
+
+    def __repr__(self):
+        return "Plug('%s')" % self.name()
+
+    def __getitem__(self, index):
+        return Plug(self._node, self._path[:-1] + ['%s[%d]' % (self._path[-1].split('[')[0], index)])
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return self.attr(item)
+
+    def attr(self, name):
+        return Plug(self._node, self._path + [name])
+
+    def node(self):
+        return self._node
+
+    def name(self, includeNode=True, fullAttrPath=True):
+        path = '.'.join(self._getFullPath() if fullAttrPath else self._path)
+        return '%s.%s' % (self._node.name(), path) if includeNode else path
+
+    def _getFullPath(self):
+        ''' Children of compounds are named through their parents, the same way Maya names them. '''
+
+        api = self.backend.api
+        path = list(self._path)
+        attribute = self._node.attribute(path[0].split('[')[0])
+
+        while True:
+            parent = api.MFnAttribute(attribute).parent
+            if parent.isNull() or api.MFnAttribute(parent).array:
+                break
+            attribute = parent
+            path.insert(0, api.MFnAttribute(parent).name)
+
+        return path
+
+    def attribute(self):
+        return self._node.attribute(self._path[-1].split('[')[0])
+
+    def plug(self):
+        ''' Returns the api plug, this can only be connected once the modifier has run. '''
+
+        api = self.backend.api
+        mplug = None
+
+        for segment in self._getFullPath():
+            name, _, index = segment.partition('[')
+            attribute = self._node.attribute(name)
+            mplug = api.MPlug(self._node.obj, attribute) if mplug is None else mplug.child(attribute)
+            if index:
+                mplug = mplug.elementByLogicalIndex(int(index.rstrip(']')))
+
+        return mplug
+
+    def type(self):
+        ''' Returns the attribute type the way PyMEL names it. '''
+
+        api = self.backend.api
+        attribute = self.attribute()
+
+        if self._children():
+            return 'double3' if attribute.hasFn(api.MFn.kNumericAttribute) else 'TdataCompound'
+
+        if attribute.hasFn(api.MFn.kNumericAttribute):
+            numeric_type = api.MFnNumericAttribute(attribute).numericType()
+            return {
+                api.MFnNumericData.kBoolean: 'bool',
+                api.MFnNumericData.kByte: 'byte',
+                api.MFnNumericData.kShort: 'short',
+                api.MFnNumericData.kInt: 'long',
+                api.MFnNumericData.kFloat: 'float',
+            }.get(numeric_type, 'double')
+        elif attribute.hasFn(api.MFn.kUnitAttribute):
+            if api.MFnUnitAttribute(attribute).unitType() == api.MFnUnitAttribute.kAngle:
+                return 'doubleAngle'
+            return 'doubleLinear'
+        elif attribute.hasFn(api.MFn.kEnumAttribute):
+            return 'enum'
+        elif attribute.hasFn(api.MFn.kMatrixAttribute):
+            return 'matrix'
+        elif attribute.hasFn(api.MFn.kTypedAttribute):
+            if api.MFnTypedAttribute(attribute).attrType() == api.MFnData.kMatrix:
+                return 'matrix'
+
+        return None
+
+    def _children(self):
+        api = self.backend.api
+        attribute = self.attribute()
+        if not attribute.hasFn(api.MFn.kCompoundAttribute):
+            return []
+
+        fn = api.MFnCompoundAttribute(attribute)
+        return [api.MFnAttribute(fn.child(i)).name for i in range(fn.numChildren())]
+
+    def isCompound(self):
+        return bool(self._children())
+
+    def getChildren(self):
+        return [self.attr(name) for name in self._children()]
+
+    def numChildren(self):
+        return len(self._children())
+
+    def inputs(self, plugs=True):
+        return self.backend.sources(self)
+
+    def set(self, value):
+        self.backend.setAttr(self, value)
+
+    def connect(self, destination):
+        self.backend.connect(self, destination)
+
+    def get(self):
+        ''' Reads the value of the plug, the modifier must have been committed. '''
+
+        _assertReadable(self)
+
+        api = self.backend.api
+        children = self.getChildren()
+        if children:
+            return tuple(child.get() for child in children)
+
+        mplug = self.plug()
+        kind = self.type()
+        if kind == 'matrix':
+            return tuple(api.MFnMatrixData(mplug.asMObject()).matrix())
+        elif kind == 'doubleAngle':
+            return mplug.asMAngle().asUnits(api.MAngle.uiUnit())
+        elif kind == 'doubleLinear':
+            return mplug.asMDistance().asUnits(api.MDistance.uiUnit())
+        elif kind == 'bool':
+            return mplug.asBool()
+        elif kind in ['byte', 'short', 'long', 'enum']:
+            return mplug.asInt()
+        return mplug.asDouble()
+
+
+class RecordingNode(Node):
+    ''' A node of a RecordingBackend, which remembers its type and the attributes added to it. '''
+
+    def __init__(self, backend, obj, name=None, type=None):
+        Node.__init__(self, backend, obj, name)
+        self.nodeType = type
+        self.addedAttributes = []
+
+    def addAttr(self, *args, **kwargs):
+        self.addedAttributes.append((args, kwargs))
+        return Node.addAttr(self, *args, **kwargs)
+
+
+class RecordingBackend(ModifierBackend):
+    '''
+    Records the nodes a build creates and the edits it makes, on a modifier that is never run, so the build
+    can be replayed elsewhere.
+    :param api: The module providing the modifier api, maya.api.OpenMaya by default.
+    '''
+
+    def _makeNode(self, obj, name, type):
+        return RecordingNode(self, obj, name, type)
+
+    def hasNode(self, name):
+        ''' Returns whether a node of the recording has the name. '''
+        return name in self._nodesByName
+
+    def edits(self):
+        ''' Returns the recorded edits in order, as ('connect', destination, source) or ('set', plug, value). '''
+
+        edits = []
+        for edit, plug, value in self._edits:
+            if edit == self._connect:
+                edits.append(('connect', value, plug))
+            else:
+                edits.append(('set', plug, value))
+        return edits
+
+    def commit(self):
+        raise RuntimeError('Recorded builds are replayed, they are never committed.')
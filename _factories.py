@@ -1,5 +1,54 @@
 
 import pymel.core as pmc
+import maya.api.OpenMaya as om
+
+import _backends
+import _graph
+
+
+# Build options, these can be temporarily overridden with general.options()
+# Folding and sharing change what operations return, a constant or an earlier result instead of a new node,
+# so they are only done when asked for
+OPTIONS = {
+    'fold': False,
+    'cse': False,
+    'optimize': True,
+    'fuse': True,
+    'balance': False,
+    'simplify': True,
+
+    # Whether operations built outside deferred() remember the expression they were built from, so they
+    # can be evaluated, analyzed and serialized later
+    'provenance': False,
+
+    # Whether the nodes built by operations are recorded with their owners, so sweep() can delete them
+    'track': False
+}
+
+# Scene callbacks outlive module reloads, so drop the ones registered by a previous load
+if globals().get('_callbackIds'):
+    om.MMessage.removeCallbacks(_callbackIds)
+_callbackIds = []
+
+# The backend performing scene edits, general.batch() swaps it for a ModifierBackend
+_backend = _backends.PyMelBackend()
+
+
+def getBackend():
+    return _backend
+
+
+# The graph recording operations, general.deferred() sets this
+_activeGraph = None
+
+
+def getGraph():
+    return _activeGraph
+
+
+def isPlug(data):
+    ''' Returns whether the data is a plug, either a PyMEL attribute or a backend handle. '''
+    return isinstance(data, pmc.general.Attribute) or isinstance(data, _backends.Plug)
 
 
 def getDgDataType(data):
@@ -9,21 +58,18 @@ def getDgDataType(data):
     from datatypes import Float, Vector, Matrix, Quaternion
 
     if isinstance(data, DgData):
-        return type(data)
+        return data.dataType() or type(data)
 
     if isinstance(data, int) or isinstance(data, float):
         return Float
 
-    # If this is a compound object, just use its data (this way we can determine quaternions)
-    try:
-        if data.getChildren():
-            data = data.getChildren()
-    except (RuntimeError, AttributeError):
-        pass
-
     # If data is a list, check what array type it is
     if isinstance(data, list) or isinstance(data, tuple):
 
+        # Plain numbers are by far the most common contents, so skip resolving them one by one
+        if _isNumberSequence(data):
+            return _getArrayType(len(data))
+
         # Determine types of contents
         content_types = []
         for item in data:
@@ -32,101 +78,885 @@ def getDgDataType(data):
                 content_types.append(item_type)
 
         if len(content_types) == 1 and content_types[0] == Float:
-
-            length = len(data)
-            if length == 3:
-                return Vector
-            elif length == 4:
-                return Quaternion
-            elif length == 16:
-                return Matrix
-            else:
-                return DgArray
+            return _getArrayType(len(data))
 
         elif len(content_types) > 1:
             return DgArray
 
     # If its a string or PyMel object, determine the attribute type
-    if isinstance(data, str) or isinstance(data, pmc.general.Attribute):
+    if isinstance(data, basestring) or isPlug(data):
+        return getPlugType(data)
+
+    raise TypeError('Could not determine dataType for %s' % str(data))
+
+
+def _isNumberSequence(data):
+    for item in data:
+        if not (isinstance(item, float) or isinstance(item, int)):
+            return False
+    return True
+
+
+def _getArrayType(length):
+    from general import DgArray
+    from datatypes import Vector, Matrix, Quaternion
+
+    if length == 3:
+        return Vector
+    elif length == 4:
+        return Quaternion
+    elif length == 16:
+        return Matrix
+    else:
+        return DgArray
+
+
+# Resolved types of plugs, stored per node uuid then attribute path and dropped with the node
+_plugTypes = {}
+
+
+def getPlugType(attribute):
+    '''
+    Determines the type of a plug from its attribute definition.
+    Results are cached per plug until its node is deleted or the scene changes, except for plugs that hold
+    no data and take the type of their source, which changes when they are reconnected.
+    '''
+
+    if isinstance(attribute, basestring):
+        attribute = getBackend().plug(attribute)
+
+    # Outputs of operations carry their type, see setPlugType()
+    known = getattr(attribute, '__dict__', {}).get('_dgDataType')
+    if known is not None:
+        return known
+
+    _ensureSceneCallbacks()
+
+    nodeId, name = getPlugKey(attribute)
+    nodeTypes = _plugTypes.setdefault(nodeId, {})
+
+    if name in nodeTypes:
+        return nodeTypes[name]
 
-        if not pmc.objExists(data):
-            raise TypeError('Attribute: %s does not exist' % str(data))
+    type, connected = _resolvePlugType(attribute)
+    if not connected:
+        nodeTypes[name] = type
+    return type
 
-        data = pmc.PyNode(data)
-        maya_type = data.type()
 
-        if maya_type in ['byte', 'long', 'enum', 'float', 'doubleLinear', 'doubleAngle', 'double', 'bool']:
+def setPlugType(attribute, type):
+    '''
+    Records the known type of a plug, such as the output of an operation, so it is never queried.
+    The type is kept on the plug object itself, other objects for the same plug are still queried.
+    '''
+
+    attribute.__dict__['_dgDataType'] = type
+
+
+def _resolvePlugType(attribute):
+    '''
+    Returns the type of a plug, and whether it was taken from the source the plug is connected to.
+    '''
+
+    from datatypes import Float, Vector, Matrix, Quaternion, Compound
+
+    # Compounds are typed by their children, this way we can determine quaternions
+    if attribute.isCompound():
+        children = attribute.getChildren()
+        if children:
+            return getDgDataType(children), False
+
+    maya_type = attribute.type()
+
+    if maya_type in ['byte', 'long', 'short', 'enum', 'float', 'doubleLinear', 'doubleAngle', 'double', 'bool',
+                     'time']:
+        return Float, False
+    elif maya_type == 'matrix':
+        return Matrix, False
+    elif maya_type in ['double3', 'float3']:
+        return Vector, False
+    elif maya_type == 'TdataCompound':
+        return Compound, False
+    elif maya_type == None:
+        # A connected plug carries whatever its source provides
+        sources = attribute.inputs(plugs=True)
+        if sources:
+            return getPlugType(sources[0]), True
+        return _probePlugType(attribute), False
+
+    raise TypeError('Could not determine dataType for %s' % str(attribute))
+
+
+def _probePlugType(attribute):
+    '''
+    Determines the type of a plug that holds no data yet (generic or empty typed attributes)
+    by inspecting what it accepts, rather than setting values on it.
+    '''
+
+    from datatypes import Float, Vector, Matrix
+
+    if isinstance(attribute, _backends.Plug):
+        api = attribute.backend.api
+        attr = attribute.attribute()
+    else:
+        api = om
+        selection = om.MSelectionList()
+        selection.add(attribute.name())
+        attr = selection.getPlug(0).attribute()
+
+    if attr.hasFn(api.MFn.kTypedAttribute):
+        data_type = api.MFnTypedAttribute(attr).attrType()
+        if data_type == api.MFnData.kMatrix:
+            return Matrix
+        elif data_type in [api.MFnData.kNumeric, api.MFnData.kFloatArray, api.MFnData.kDoubleArray]:
             return Float
-        elif maya_type == 'matrix':
+
+    elif attr.hasFn(api.MFn.kGenericAttribute):
+        fn = api.MFnAttribute(attr)
+        if fn.accepts(api.MFnData.kNumeric):
+            return Float
+        elif fn.accepts(api.MFnData.kMatrix):
             return Matrix
-        elif maya_type in ['double3', 'float3']:
+
+    elif attr.hasFn(api.MFn.kNumericAttribute):
+        numeric_type = api.MFnNumericAttribute(attr).numericType()
+        if numeric_type in [api.MFnNumericData.k3Double, api.MFnNumericData.k3Float]:
             return Vector
-        elif maya_type == 'TdataCompound':
-            return Compound
-        elif maya_type == None:
-            try:
-                data.set(1, type='float')
-                return Num
-            except RuntimeError:
-                pass
-            try:
-                data.set([0, 0, 0], type='float3')
-                return Vector
-            except RuntimeError:
-                pass
-            try:
-                data.set([0, 0, 0, 0], type='TdataCompound')
-                return Quaternion
-            except RuntimeError:
-                pass
-            try:
-                data.set([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], type='matrix')
-                return Matrix
-            except RuntimeError:
-                pass
+        return Float
+
+    raise TypeError('Could not determine dataType for %s' % str(attribute))
+
+
+def isLiteral(data):
+    ''' Determines whether the data is a plain number or a sequence of plain numbers. '''
+
+    from general import DgData
+
+    if isinstance(data, DgData):
+        data = data.data()
+
+    if isinstance(data, int) or isinstance(data, float):
+        return True
+
+    if isinstance(data, list) or isinstance(data, tuple):
+        for item in data:
+            if not isLiteral(item):
+                return False
+        return True
+
+    return False
+
+
+def getLiteral(data):
+    ''' Returns the raw value of literal data, unwrapping any DgData. '''
+
+    from general import DgData
+
+    if isinstance(data, DgData):
+        data = data.data()
+
+    if isinstance(data, list) or isinstance(data, tuple):
+        return tuple(getLiteral(item) for item in data)
+
+    return data
+
+
+def foldOperation(operation, *args, **kwargs):
+    '''
+    Evaluates an operation in python if all of its inputs are literals, see buildOperation().
+
+    Operations opt into this by implementing a "compute" staticmethod taking the same inputs as "create".
+    Only operations built through the function directory are folded, an operation class that is called
+    directly always builds its node.
+    :return: A constant DgData of the operation's datatype, or None if the operation cannot be folded.
+    '''
+
+    if not OPTIONS['fold'] or not hasattr(operation, 'compute'):
+        return None
+
+    # Constants are explicitly requested as nodes, so they are never folded
+    if 'constant' in kwargs:
+        return None
+
+    name = kwargs.pop('name', kwargs.pop('n', operation.__name__))
+
+    for arg in args:
+        if not isLiteral(arg):
+            return None
+    for value in kwargs.values():
+        if value is not None and not isLiteral(value):
+            return None
+
+    args = [getLiteral(arg) for arg in args]
+    kwargs = dict((key, getLiteral(value)) for key, value in kwargs.items())
+
+    try:
+        value = operation.compute(*args, **kwargs)
+    except (ArithmeticError, ValueError):
+        # Leave undefined results (division by zero etc) for the nodes to handle
+        return None
+
+    if isinstance(value, complex):
+        return None
+
+    return operation.dataType()(value, name=name)
+
+
+def getPlugKey(attribute):
+    ''' Returns a key for a plug that stays valid when its node is renamed. '''
+
+    node = attribute.node().__apimfn__()
+    return (node.uuid().asString(), attribute.name(includeNode=False, fullAttrPath=True))
+
+
+def getInputKey(data):
+    '''
+    Returns a hashable key describing the input data, plugs are identified by node uuid.
+    Raises a TypeError if the data cannot be keyed.
+    '''
+
+    from general import DgData
+
+    if isinstance(data, DgData):
+        data = data.data()
+
+    if data is None or isinstance(data, int) or isinstance(data, float):
+        return data
+
+    if isinstance(data, basestring):
+        data = getBackend().plug(data)
+
+    if isPlug(data):
+        return getPlugKey(data)
+
+    if isinstance(data, list) or isinstance(data, tuple):
+        return tuple(getInputKey(item) for item in data)
+
+    raise TypeError('Could not create a key for %s' % str(data))
+
+
+def _getNodeIds(key):
+    ''' Yields the node uuids referenced by an input key. '''
+
+    if isinstance(key, tuple):
+        if len(key) == 2 and isinstance(key[0], basestring) and isinstance(key[1], basestring):
+            yield key[0]
+        else:
+            for item in key:
+                for nodeId in _getNodeIds(item):
+                    yield nodeId
+
+
+class MemoTable(object):
+    '''
+    Maps operation keys to the DgData they built, so identical requests can share nodes.
+    Entries are indexed by the uuids of the nodes they involve so deleting a node drops them.
+    '''
+
+    def __init__(self):
+        self._results = {}
+        self._keysByNode = {}
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        return self._results.get(key)
+
+    def add(self, key, result):
+        try:
+            resultKey = getInputKey(result)
+        except TypeError:
+            return
+
+        self._results[key] = result
+        for nodeId in set(_getNodeIds((key[1:], resultKey))):
+            self._keysByNode.setdefault(nodeId, set()).add(key)
+
+    def discardNode(self, nodeId):
+        for key in self._keysByNode.pop(nodeId, ()):
+            self._results.pop(key, None)
+
+    def clear(self):
+        self._results.clear()
+        self._keysByNode.clear()
+
+
+# The innermost table is used for lookups, see general.memoScope()
+_memoTables = [MemoTable()]
+
+
+def getMemoTable():
+    _ensureSceneCallbacks()
+    return _memoTables[-1]
+
+
+def getMemoKey(operation, args, kwargs):
+    '''
+    Returns a key identifying an operation by its class, resolved inputs and settings.
+    Returns None if any input cannot be keyed, in which case the operation is not shared.
+    '''
+
+    try:
+        inputs = tuple(getInputKey(arg) for arg in args)
+        settings = tuple(sorted((key, getInputKey(value)) for key, value in kwargs.items()
+                                if key not in ('name', 'n')))
+    except TypeError:
+        return None
+
+    return (operation, inputs, settings)
+
+
+def forgetNode(nodeId):
+    ''' Drops everything cached about a node. '''
+    _plugTypes.pop(nodeId, None)
+    _ownedNodes.pop(nodeId, None)
+    for table in _memoTables:
+        table.discardNode(nodeId)
+
+
+def _onNodeRemoved(node, *args):
+    forgetNode(om.MFnDependencyNode(node).uuid().asString())
+
+
+def _onSceneChanged(*args):
+    _plugTypes.clear()
+    _ownedNodes.clear()
+    for table in _memoTables:
+        table.clear()
+
+
+def _ensureSceneCallbacks():
+    if _callbackIds:
+        return
+    _callbackIds.append(om.MDGMessage.addNodeRemovedCallback(_onNodeRemoved, 'dependNode'))
+    _callbackIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeNew, _onSceneChanged))
+    _callbackIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeOpen, _onSceneChanged))
+
+
+# The nodes created by operations, as the node and the names of the operations owning it by node uuid
+_ownedNodes = {}
 
-    raise TypeError('Could not determine dataType for %s' % str(data))
 
+def trackNode(node, owner):
+    ''' Records that an operation owns a node, see sweepNodes(). '''
+    _ensureSceneCallbacks()
+    nodeId = node.__apimfn__().uuid().asString()
+    _ownedNodes.setdefault(nodeId, (node, set()))[1].add(owner)
+
+
+def getOwners(node):
+    ''' Returns the names of the operations owning a node, which is empty for nodes not built by dgMath. '''
+    entry = _ownedNodes.get(node.__apimfn__().uuid().asString())
+    return sorted(entry[1]) if entry is not None else []
+
+
+def sweepNodes(keep=()):
+    '''
+    Deletes the nodes owned by operations whose outputs are not connected to anything outside of them.
+    :param keep: Nodes to keep even if their outputs are not used.
+    :return: The names of the deleted nodes.
+    '''
+
+    if isinstance(_backend, _backends.ModifierBackend):
+        raise RuntimeError('Nodes cannot be swept inside batch(), they do not exist yet.')
+
+    objects = {}
+    for nodeId, (node, owners) in list(_ownedNodes.items()):
+        try:
+            api, obj = _backends.getNodeObject(node)
+        except RuntimeError:
+            obj = None
+        if obj is None or not api.MObjectHandle(obj).isValid():
+            forgetNode(nodeId)
+        else:
+            objects[nodeId] = (api, obj)
+
+    # A node is used if it connects to a node outside of the operations, or to a node that is used
+    used = set(node.__apimfn__().uuid().asString() for node in keep)
+    inputs = {}
+    for nodeId, (api, obj) in objects.items():
+        for plug in api.MFnDependencyNode(obj).getConnections():
+            if not plug.isSource:
+                continue
+            for destination in plug.destinations():
+                destinationId = api.MFnDependencyNode(destination.node()).uuid().asString()
+                if destinationId not in objects:
+                    used.add(nodeId)
+                elif destinationId != nodeId:
+                    inputs.setdefault(destinationId, set()).add(nodeId)
+
+    pending = list(used)
+    while pending:
+        for nodeId in inputs.get(pending.pop(), ()):
+            if nodeId not in used:
+                used.add(nodeId)
+                pending.append(nodeId)
+
+    # Scene nodes are deleted by the backend, so the sweep can be undone, stand-in scenes have no undo queue
+    deleted = []
+    names = []
+    modifiers = {}
+    for nodeId, (api, obj) in objects.items():
+        if nodeId in used:
+            continue
+        name = api.MFnDependencyNode(obj).name()
+        deleted.append(name)
+        if api is om:
+            names.append(name)
+        else:
+            modifiers.setdefault(api, api.MDGModifier()).deleteNode(obj)
+        forgetNode(nodeId)
+
+    if names:
+        _backend.deleteNodes(names)
+    for modifier in modifiers.values():
+        modifier.doIt()
+
+    return sorted(deleted)
+
+
+# The scalar channels available on nodes that can be shared between operations
+CHANNELS = {
+    'multiplyDivide': ['X', 'Y', 'Z'],
+    'plusMinusAverage': ['1D', 'x', 'y', 'z']
+}
+
+
+class ChannelAllocator(object):
+    '''
+    Packs independent scalar operations onto the free channels of shared nodes.
+
+    Operations are only packed together when they sit at the same depth of the graph,
+    so an operation can never depend on a node it shares.
+    '''
+
+    def __init__(self):
+        self._nodes = {}
+        self._depths = {}
+        self.nodeCount = 0
+        self.channelCount = 0
+
+    def getDepth(self, data):
+        ''' Returns how many operations built in this scope lie upstream of the data. '''
+
+        from general import DgData
+
+        if isinstance(data, DgData):
+            if '_depth' in data.__dict__:
+                return data._depth
+            data = data.data()
+
+        if isinstance(data, list) or isinstance(data, tuple):
+            return max([self.getDepth(item) for item in data] or [0])
+
+        if isPlug(data):
+            return self._depths.get(getPlugKey(data), 0)
+
+        return 0
+
+    def addOutput(self, data, depth):
+        data = data if isinstance(data, list) else [data]
+        for item in data:
+            if isPlug(item):
+                self._depths[getPlugKey(item)] = depth
+
+    def allocate(self, owner, type, operation, depth, size=None):
+        '''
+        Returns a node of the given type and operation with a free channel, creating one if needed.
+        :param owner: The DgData that creates the node when none is free.
+        :param size: The number of inputs, for operations whose result depends on it.
+        :return: The node and the name of its free channel.
+        '''
+
+        key = (type, operation, depth, size)
+        channels = CHANNELS[type]
+
+        entry = self._nodes.get(key)
+        if entry is None or entry[1] == len(channels):
+            node = owner.createNode(type)
+            if operation != 1:
+                node.operation.set(operation)
+            entry = self._nodes[key] = [node, 0]
+            self.nodeCount += 1
+        else:
+            owner.ownNode(entry[0])
+
+        channel = channels[entry[1]]
+        entry[1] += 1
+        self.channelCount += 1
+
+        return entry[0], channel
+
+
+# Set while a general.packing() block is active
+_allocator = None
+
+
+def getChannelAllocator():
+    return _allocator
+
+
+class ConstantPool(object):
+    '''
+    Stores constants as the elements of one multi attribute per datatype, instead of a node each.
+    :param share: Whether constants with equal values share one element.
+    '''
+
+    def __init__(self, share=False):
+        self.share = share
+        self._storage = {}
+        self._elements = {}
+        self.nodeCount = 0
+        self.constantCount = 0
+
+    def allocate(self, owner, value=None):
+        '''
+        Returns a free element for a constant, creating the storage node of its datatype if needed.
+        :param owner: The constant DgData being built.
+        :param value: The value to set the element to.
+        '''
+
+        datatype = owner.dataType() or type(owner)
+        literal = isLiteral(value) if value is not None else False
+
+        key = None
+        if self.share and literal:
+            key = (datatype, getLiteral(value))
+            element = self._elements.get(key)
+            if element is not None:
+                owner.ownNode(element.node())
+                return element
+
+        storage = self._storage.get(datatype)
+        if storage is None:
+            storage = self._storage[datatype] = [owner.createConstant(multi=True), 0]
+            self.nodeCount += 1
+        else:
+            owner.ownNode(storage[0].node())
+
+        element = storage[0][storage[1]]
+        storage[1] += 1
+        self.constantCount += 1
+
+        if literal:
+            getBackend().setAttr(element, getLiteral(value))
+        if key is not None:
+            self._elements[key] = element
+
+        return element
+
+
+# Set while a general.pooling() block is active
+_constantPool = None
+
+
+def getConstantPool():
+    return _constantPool
+
+
+class Dispatcher(object):
+    '''
+    Resolves an operation name and its inputs to the class that builds it.
+
+    Signatures are the type names an operation handles, in the order its class expects them.
+    Every resolved call is cached along with the order its arguments have to be passed in,
+    so each combination of input types is only worked out once.
+    '''
+
+    def __init__(self, registry=None):
+        self._generic = {}
+        self._signatures = {}
+        self._cache = {}
+
+        for name, value in (registry or {}).items():
+            if isinstance(value, dict):
+                for signature, operation in value.items():
+                    self.register(name, operation, signature)
+            else:
+                self.register(name, value)
+
+    def register(self, name, operation, signature=None):
+        '''
+        Adds an operation to the table.
+        :param signature: A type name or tuple of type names, None accepts any inputs.
+        '''
+
+        if signature is None:
+            self._generic[name] = operation
+            self._signatures.pop(name, None)
+        else:
+            signature = signature if isinstance(signature, tuple) else (signature,)
+            self._signatures.setdefault(name, {})[signature] = operation
+            self._generic.pop(name, None)
+
+        for key in [key for key in self._cache if key[0] == name]:
+            del self._cache[key]
+
+    def operations(self):
+        return sorted(set(self._generic) | set(self._signatures))
+
+    def resolve(self, name, args):
+        '''
+        :return: The operation class, and the order to pass the arguments in or None if they are in order.
+        '''
+
+        if name in self._generic:
+            return self._generic[name], None
+
+        types = tuple(getDgDataType(arg).type() for arg in args)
+
+        try:
+            return self._cache[(name, types)]
+        except KeyError:
+            pass
+
+        if name not in self._signatures:
+            raise ValueError('Operations "%s" not found.' % name)
+
+        result = self._cache[(name, types)] = self._compile(name, types)
+        return result
+
+    def _compile(self, name, types):
+        signatures = self._signatures[name]
+
+        unique = []
+        for dataType in types:
+            if dataType not in unique:
+                unique.append(dataType)
+        unique = tuple(unique)
+
+        if unique in signatures:
+            return signatures[unique], None
+
+        # Commutative orderings, reorder the arguments to match the signature
+        for signature, operation in signatures.items():
+            if len(signature) == len(unique) and set(signature) == set(unique):
+                order = sorted(range(len(types)), key=lambda i: signature.index(types[i]))
+                return operation, tuple(order)
+
+        raise TypeError('%s does not support input dataType "%s".' % (name, unique))
+
+
+# Compiled from functions.__functions__ on first use, see getDispatcher()
+_dispatcher = None
+
+
+def getDispatcher():
+    global _dispatcher
+
+    if _dispatcher is None:
+        import functions
+        _dispatcher = Dispatcher(functions.__functions__)
+
+    return _dispatcher
+
+
+# Cheaper patterns by operation class, see optimizer.registerPattern()
+_patterns = {}
+
+
+def getCreate(data, args, kwargs):
+    '''
+    Returns the function that builds the DgData, its create method or the cheapest pattern for the inputs.
+    '''
+
+    patterns = _patterns.get(type(data)) if OPTIONS['optimize'] else None
+    if patterns:
+        backend = getBackend()
+        for pattern in patterns:
+            if pattern.accepts(backend, args, kwargs):
+                return lambda *args, **kwargs: pattern.apply(data, args, kwargs)
+
+    return data.create
+
+
+# Rewrites by operation class, see simplify.registerSimplification()
+_simplifications = {}
+
+
+class Identity(object):
+    ''' Returned by a simplification when an operation results in one of its inputs. '''
+
+    def __init__(self, value):
+        self.value = value
+
+
+def simplifyOperation(operation, args):
+    '''
+    Applies the simplifications of an operation to its inputs until none of them apply.
+    :return: The simplified inputs, or an Identity if the operation is not needed.
+    '''
+
+    changed = True
+    while changed:
+        changed = False
+        for simplification in _simplifications.get(operation, ()):
+            result = simplification(tuple(args))
+            if isinstance(result, Identity):
+                return result
+            if result is not None:
+                args = result
+                changed = True
+
+    return args
+
+
+def getData(value):
+    ''' Returns the DgData for an input, this is the pending DgData for a recorded expression. '''
+
+    from general import DgData
+
+    if isinstance(value, DgData):
+        return value
+    if isinstance(value, _graph.Expression):
+        return _graph.createProxy(value)
+    return DgData(value)
+
+
+def _isLiteralRequest(args, kwargs):
+    values = [value for key, value in kwargs.items() if key not in ['name', 'n']]
+    for arg in list(args) + values:
+        if arg is not None and not isLiteral(arg):
+            return False
+    return True
 
 
 def getOperation(operation_name, *args, **kwargs):
-    import functions
 
-    operation = None
-    reversed = False
+    operation, order = getDispatcher().resolve(operation_name, args)
+
+    if order is not None:
+        args = tuple(args[i] for i in order)
 
-    if operation_name not in functions.__functions__:
-        raise ValueError('Operations "%s" not found.' % operation_name)
+    return buildOperation(operation, args, kwargs)
 
-    value = functions.__functions__[operation_name]
-    if not isinstance(value, dict):
-        operation = value
 
-    if operation == None:
+def getBatchOperation(operation_name, *args, **kwargs):
+    '''
+    Builds an operation for each item of the sequences in the inputs, see functions.Batch.
+    The operation is resolved once from the first item, so all items must have the same input types.
+    :return: A list with the result of each item.
+    '''
+
+    items = getBatchItems(args, kwargs)
+    if not items:
+        return []
+
+    operation, order = getDispatcher().resolve(operation_name, items[0][0])
+
+    # Plugs are typed from the first item, so their attributes are not queried for every item
+    first_args, first_kwargs = items[0]
+    arg_types = [_getBatchType(arg) for arg in first_args]
+    kwarg_types = dict((key, _getBatchType(value)) for key, value in first_kwargs.items())
+
+    results = []
+    for item_args, item_kwargs in items:
+        item_args = [_typedInput(arg, type) for arg, type in zip(item_args, arg_types)]
+        item_kwargs = dict((key, _typedInput(value, kwarg_types[key])) for key, value in item_kwargs.items())
+        if order is not None:
+            item_args = [item_args[i] for i in order]
+        results.append(buildOperation(operation, tuple(item_args), item_kwargs))
+
+    return results
+
+
+def _getBatchType(data):
+    if isinstance(data, basestring) or isPlug(data):
+        return getDgDataType(data)
+    return None
+
+
+def _typedInput(data, type):
+    ''' Wraps a plug as DgData of a type that is already known, so it is not resolved again. '''
+
+    if type is None or not (isinstance(data, basestring) or isPlug(data)):
+        return data
+
+    wrapped = object.__new__(type)
+    wrapped._name = type.__name__
+    wrapped._data = data
+    return wrapped
+
+
+def getBatchItems(args, kwargs):
+    '''
+    Splits batch inputs into the inputs of each item. Lists, tuples and arrays hold one input per item,
+    anything else (DgData, plugs, numbers, strings) is shared by every item.
+    :return: A list of args and kwargs for each item.
+    '''
+
+    count = None
+    inputs = []
+    for key, value in [(None, arg) for arg in args] + sorted(kwargs.items()):
+
+        # Arrays of vectors and matrices, by row. Matrices may be N x 16 or N x 4 x 4
+        if hasattr(value, 'tolist') and hasattr(value, 'reshape'):
+            value = (value.reshape(len(value), -1) if value.ndim > 2 else value).tolist()
 
-        dataTypes = []
-        for arg in args:
-            dataType = getDgDataType(arg).type()
-            if dataType not in dataTypes:
-                dataTypes.append(dataType)
+        if isinstance(value, list) or isinstance(value, tuple):
+            if count is None:
+                count = len(value)
+            elif len(value) != count:
+                raise ValueError('Batched inputs must have the same length, got %d and %d.' % (count, len(value)))
 
-        dataTypes = tuple(dataTypes) if len(dataTypes) > 1 else dataTypes[0]
+        inputs.append((key, value))
 
-        if dataTypes in value:
-            operation = value[dataTypes]
+    if count is None:
+        raise ValueError('Batched operations take at least one list of inputs.')
 
-        if operation == None:
+    items = []
+    for i in range(count):
+        item_args = []
+        item_kwargs = {}
+        for key, value in inputs:
+            if isinstance(value, list) or isinstance(value, tuple):
+                value = value[i]
+            if key is None:
+                item_args.append(value)
+            else:
+                item_kwargs[key] = value
+        items.append((tuple(item_args), item_kwargs))
+
+    return items
+
+
+def buildOperation(operation, args, kwargs):
+    '''
+    Builds an operation class with the inputs, folding literal requests and sharing the result of an
+    identical request when those options are set.
+    '''
+
+    # Operations on plain numbers are evaluated in python instead of building nodes
+    if OPTIONS['fold']:
+        folded = foldOperation(operation, *args, **kwargs)
+        if folded is not None:
+            return folded
+
+    # Operations on inputs that cancel out, or with inputs that have no effect, are removed before building.
+    # Literal requests are left for folding
+    if (OPTIONS['simplify'] and operation in _simplifications and not _isLiteralRequest(args, {})
+            and not [key for key in kwargs if key not in ['name', 'n']]):
+        args = simplifyOperation(operation, args)
+        if isinstance(args, Identity):
+            return getData(args.value)
 
-            dataTypes = dataTypes[::-1]
+    # Identical requests share the result that was already built, literal requests are folded instead.
+    # Recorded operations are shared when the graph is committed.
+    key = None
+    if OPTIONS['cse'] and _activeGraph is None and not (OPTIONS['fold'] and _isLiteralRequest(args, kwargs)):
+        key = getMemoKey(operation, args, kwargs)
+    if key is not None:
+        result = getMemoTable().get(key)
+        if result is not None:
+            return result
 
-            if dataTypes in value:
-                operation = value[dataTypes]
-                reversed = True
+    result = operation(*args, **kwargs)
 
-    if operation == None:
-        raise TypeError('%s does not support input dataType "%s".' % (operation, dataTypes))
+    if key is not None and not isLiteral(result):
+        getMemoTable().add(key, result)
 
-    return operation(*args[::-1], **kwargs) if reversed else operation(*args, **kwargs)
+    return result
 
 
 def addConnection(source, destination):
@@ -134,6 +964,21 @@ def addConnection(source, destination):
     This allows for a variety of inputs to be connected to a destination plug.
     '''
 
+    backend = getBackend()
+    for edit, plug, value in planConnection(source, destination):
+        if edit == 'connect':
+            backend.connect(value, plug)
+        else:
+            backend.setAttr(plug, value)
+
+
+def planConnection(source, destination):
+    '''
+    Resolves the shapes of a source and destination once and returns the fewest edits that connect them.
+    Matching plugs are connected at the parent and values are set whole, only mixed inputs are split per child.
+    :return: A list of ('connect', destination, source) and ('set', destination, value) edits.
+    '''
+
     from general import DgData
     from datatypes import Matrix
 
@@ -147,42 +992,48 @@ def addConnection(source, destination):
     source = source.data() if isinstance(source, DgData) else source
     destination = destination.data() if isinstance(destination, DgData) else destination
 
-    # Convert strings to PyNodes
-    source = pmc.PyNode(source) if isinstance(source, basestring) else source
-    destination = pmc.PyNode(destination) if isinstance(destination, basestring) else destination
+    # Convert strings to plugs
+    backend = getBackend()
+    source = backend.plug(source) if isinstance(source, basestring) else source
+    destination = backend.plug(destination) if isinstance(destination, basestring) else destination
 
-    if sourceType.isArray():
-        if sourceType == Matrix and isinstance(destination, list):
-            raise TypeError('Matrix sources must be set with attributes not lists.')
+    if not sourceType.isArray():
+        return [_planChild(source, destination)]
 
-        if isinstance(source, list) and isinstance(destination, list):
-            for i in range(len(source)):
-                addConnection(source[i], destination[i])
+    if sourceType == Matrix and isinstance(destination, list):
+        raise TypeError('Matrix sources must be set with attributes not lists.')
 
-        elif isinstance(source, pmc.general.Attribute) and isinstance(destination, pmc.general.Attribute):
-            source.connect(destination)
+    if isPlug(source) and isPlug(destination):
+        return [('connect', destination, source)]
 
-        elif isinstance(source, pmc.general.Attribute):
-            for i, child in enumerate(source.getChildren()):
-                addConnection(child, destination[i])
+    # Plain values are set in one edit, rather than child by child
+    if isPlug(destination) and isLiteral(source):
+        return [('set', destination, list(getLiteral(source)))]
 
-        elif isinstance(source, list):
-            for i, child in enumerate(destination.getChildren()):
-                addConnection(source[i], child)
+    sources = source.getChildren() if isPlug(source) else source
+    destinations = destination.getChildren() if isPlug(destination) else destination
+    if not isinstance(sources, list) and not isinstance(sources, tuple) or len(sources) != len(destinations):
+        raise TypeError('Could not add connection for %s and %s' % (source, destination))
 
+    edits = []
+    for source, destination in zip(sources, destinations):
+        if isinstance(source, list) or isinstance(source, tuple) or (isinstance(source, DgData) and source.isArray()):
+            edits.extend(planConnection(source, destination))
         else:
-            raise TypeError('Could not add connection for %s and %s' % (source, destination))
+            edits.append(_planChild(source, destination))
+    return edits
 
-    else:
 
-        # The source however can be many types, so we need to determine whether it is an attribute or value
-        source = source.data() if isinstance(source, DgData) else source
-        if isinstance(source, basestring):
-            pmc.PyNode(source).connect(destination)
-        elif isinstance(source, pmc.general.Attribute):
-            source.connect(destination)
-        else:
-            destination.set(source)
+def _planChild(source, destination):
+    from general import DgData
+
+    # The source however can be many types, so we need to determine whether it is an attribute or value
+    source = source.data() if isinstance(source, DgData) else source
+    if isinstance(source, basestring):
+        return ('connect', destination, getBackend().plug(source))
+    elif isPlug(source):
+        return ('connect', destination, source)
+    return ('set', destination, source)
 
 
 
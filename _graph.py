@@ -0,0 +1,358 @@
+'''
+
+The expression graph recorded by general.deferred().
+
+While a Graph is active, operations record an Expression instead of creating nodes and hand back a
+pending DgData (a proxy) of the operation's class. Expressions refer to their inputs as expressions,
+so a proxy that is no longer referenced by the build script, and is not used by another expression,
+is dropped at commit without ever creating nodes.
+
+commit() builds the live expressions in the order they were recorded, which is always an order in which
+inputs are built first. Each proxy then takes on the data of the DgData that was built for it.
+
+'''
+
+import weakref
+
+
+class Expression(object):
+    '''
+    A recorded operation.
+    :param operation: The DgData subclass that builds the operation.
+    :param args: The inputs, where pending DgData are replaced by their expressions.
+    '''
+
+    def __init__(self, operation, args, kwargs, name=None, constant=False):
+        self.operation = operation
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs)
+        self.name = name
+        self.constant = constant
+        self.result = None
+        self._proxy = None
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.name or self.operation.__name__)
+
+    def inputs(self):
+        ''' Yields the expressions this expression takes as inputs. '''
+        for value in list(self.args) + list(self.kwargs.values()):
+            for expression in _getExpressions(value):
+                yield expression
+
+    def proxy(self):
+        ''' Returns the pending DgData for this expression, or None if it is no longer referenced. '''
+        return self._proxy() if self._proxy is not None else None
+
+    def setProxy(self, proxy):
+        self._proxy = weakref.ref(proxy)
+
+    def build(self):
+        import _factories
+
+        args = [_resolve(arg) for arg in self.args]
+        kwargs = dict((key, _resolve(value)) for key, value in self.kwargs.items())
+        kwargs['name'] = self.name
+
+        # Constants are separate nodes to edit, so they are not shared
+        if self.constant:
+            return self.operation(*args, constant=True, **kwargs)
+
+        return _factories.buildOperation(self.operation, args, kwargs)
+
+
+class OutputExpression(Expression):
+    ''' One of several outputs of an expression, for example the translate of a DecomposeMatrix. '''
+
+    def __init__(self, parent, attribute, type):
+        Expression.__init__(self, type, [parent], {}, name='%s.%s' % (parent.name, attribute))
+        self.attribute = attribute
+
+    def build(self):
+        from general import DgData
+
+        output = getattr(self.args[0].result, self.attribute)
+        return output if isinstance(output, DgData) else DgData(output)
+
+
+class InputExpression(Expression):
+    ''' A named input that is provided when evaluating, see evaluate.variable(). '''
+
+    def __init__(self, name, type):
+        Expression.__init__(self, type, [], {}, name=name)
+
+    def build(self):
+        raise RuntimeError('Input "%s" can only be evaluated, it cannot be built.' % self.name)
+
+
+class Graph(object):
+    '''
+    Records the operations built while it is active, see general.deferred().
+    '''
+
+    def __init__(self):
+        self.expressions = []
+        self.connections = []
+
+    def __len__(self):
+        return len(self.expressions)
+
+    def add(self, expression, proxy):
+        expression.setProxy(proxy)
+        self.expressions.append(expression)
+        return expression
+
+    def connect(self, source, destination):
+        ''' Records a connection to make once the graph has been built. '''
+        self.connections.append((source, destination))
+
+    def discard(self):
+        ''' Forgets the recorded operations, so nothing is built. '''
+        self.expressions = []
+        self.connections = []
+
+    def liveExpressions(self):
+        ''' Returns the expressions still needed, in recording order. '''
+
+        live = set()
+        pending = [expression for expression in self.expressions if expression.proxy() is not None]
+        for source, destination in self.connections:
+            pending.extend(_getExpressions(source))
+            pending.extend(_getExpressions(destination))
+
+        while pending:
+            expression = pending.pop()
+            if expression not in live:
+                live.add(expression)
+                pending.extend(expression.inputs())
+
+        return [expression for expression in self.expressions if expression in live]
+
+    def commit(self):
+        '''
+        Builds the recorded operations, making their nodes.
+        :return: The number of expressions that were built.
+        '''
+
+        import _factories
+
+        expressions = self.liveExpressions()
+        connections = self.connections
+
+        if _factories.OPTIONS['fuse']:
+            expressions = fuse(expressions, connections)
+        if _factories.OPTIONS['balance']:
+            expressions = balance(expressions, connections)
+        self.expressions = []
+        self.connections = []
+
+        # Build for real, rather than recording again
+        previous = _factories._activeGraph
+        _factories._activeGraph = None
+        try:
+            for expression in expressions:
+                expression.result = expression.build()
+
+                proxy = expression.proxy()
+                if proxy is not None:
+                    proxy.__class__ = expression.result.__class__
+                    proxy.__dict__.clear()
+                    proxy.__dict__.update(expression.result.__dict__)
+
+            for source, destination in connections:
+                _factories.addConnection(_resolve(source), _resolve(destination))
+        finally:
+            _factories._activeGraph = previous
+
+        return len(expressions)
+
+
+#### PASSES ####
+
+def countUses(expressions, connections):
+    ''' Returns how many times each expression is used as an input or in a connection. '''
+
+    uses = {}
+    for expression in expressions:
+        for input in expression.inputs():
+            uses[input] = uses.get(input, 0) + 1
+
+    for source, destination in connections:
+        for expression in _getExpressions(source) + _getExpressions(destination):
+            uses[expression] = uses.get(expression, 0) + 1
+
+    return uses
+
+
+def fuse(expressions, connections):
+    '''
+    Merges chains of an operation that takes any number of inputs into one expression, so a + b + c
+    builds one plusMinusAverage rather than two. An input is only merged when nothing else uses it,
+    see DgData._fusion for the operations this applies to.
+    :return: The expressions that are left to build.
+    '''
+
+    uses = countUses(expressions, connections)
+    fused = set()
+
+    # Inputs come first, so they have already taken in their own inputs when they are merged
+    for expression in expressions:
+        mode = expression.operation._fusion
+        if not mode or type(expression) is not Expression or expression.constant:
+            continue
+
+        args = []
+        for index, arg in enumerate(expression.args):
+            if (type(arg) is Expression and arg.operation is expression.operation
+                    and not arg.constant and not arg.kwargs and arg.proxy() is None and uses.get(arg) == 1
+                    and (mode == 'all' or index == 0)):
+                args.extend(arg.args)
+                fused.add(arg)
+            else:
+                args.append(arg)
+
+        expression.args = tuple(args)
+
+    return [expression for expression in expressions if expression not in fused]
+
+
+def balance(expressions, connections):
+    '''
+    Rebuilds chains of an associative operation with two inputs, like a * b * c * d, as balanced trees
+    like (a * b) * (c * d), so Maya can evaluate their branches in parallel. The order of the inputs is kept.
+    Only inputs that nothing else uses are restructured, see DgData._associative.
+    :return: The expressions to build, in an order where inputs come first.
+    '''
+
+    uses = countUses(expressions, connections)
+
+    def isLink(arg, operation):
+        return (type(arg) is Expression and arg.operation is operation and len(arg.args) == 2
+                and not arg.kwargs and not arg.constant and arg.proxy() is None and uses.get(arg) == 1)
+
+    # Find the inputs of each chain from its last operation, these are visited last
+    links = set()
+    chains = {}
+    for expression in reversed(expressions):
+        operation = expression.operation
+        if (expression in links or type(expression) is not Expression or not operation._associative
+                or len(expression.args) != 2 or expression.kwargs):
+            continue
+
+        leaves = []
+        pending = [expression.args[1], expression.args[0]]
+        while pending:
+            arg = pending.pop()
+            if isLink(arg, operation):
+                links.add(arg)
+                pending.extend([arg.args[1], arg.args[0]])
+            else:
+                leaves.append(arg)
+
+        # Three inputs are as deep as a tree of them
+        if len(leaves) > 3:
+            chains[expression] = leaves
+
+    result = []
+    for expression in expressions:
+        if expression in links:
+            continue
+
+        leaves = chains.get(expression)
+        if leaves is not None:
+            middle = len(leaves) // 2
+            expression.args = (_buildTree(expression, leaves[:middle], result),
+                               _buildTree(expression, leaves[middle:], result))
+
+        result.append(expression)
+
+    return result
+
+
+def _buildTree(root, leaves, result):
+    ''' Returns a balanced tree of the root's operation over the leaves, adding its expressions to the result. '''
+
+    if len(leaves) == 1:
+        return leaves[0]
+
+    middle = len(leaves) // 2
+    left = _buildTree(root, leaves[:middle], result)
+    right = _buildTree(root, leaves[middle:], result)
+
+    expression = Expression(root.operation, [left, right], {}, name=root.name)
+    result.append(expression)
+    return expression
+
+
+def getSource(data):
+    ''' Returns the expression that pending or built DgData came from, or None. '''
+
+    from general import DgData
+
+    if isinstance(data, DgData):
+        return getExpression(data) or data.__dict__.get('_expression')
+    return data if isinstance(data, Expression) else None
+
+
+def getExpression(data):
+    ''' Returns the expression of pending DgData, or None. '''
+
+    from general import DgData
+
+    if isinstance(data, DgData):
+        data = data.__dict__.get('_data')
+    return data if isinstance(data, Expression) else None
+
+
+def createProxy(expression):
+    ''' Returns the pending DgData for an expression, creating one if it is no longer referenced. '''
+
+    proxy = expression.proxy()
+    if proxy is None:
+        proxy = object.__new__(expression.operation)
+        proxy._name = expression.name
+        proxy._data = expression
+        expression.setProxy(proxy)
+    return proxy
+
+
+def record(value):
+    ''' Replaces pending DgData within an input by their expressions. '''
+
+    expression = getExpression(value)
+    if expression is not None:
+        return expression
+
+    if isinstance(value, list) or isinstance(value, tuple):
+        return type(value)(record(item) for item in value)
+
+    return value
+
+
+def _getExpressions(value):
+    expression = getExpression(value)
+    if expression is not None:
+        return [expression]
+
+    if isinstance(value, list) or isinstance(value, tuple):
+        expressions = []
+        for item in value:
+            expressions.extend(_getExpressions(item))
+        return expressions
+
+    return []
+
+
+def _resolve(value):
+    ''' Replaces expressions within an input by the DgData built for them. '''
+
+    expression = getExpression(value)
+    if expression is not None:
+        if expression.result is None:
+            raise RuntimeError('%s was discarded before it was built.' % expression.name)
+        return expression.result
+
+    if isinstance(value, list) or isinstance(value, tuple):
+        return type(value)(_resolve(item) for item in value)
+
+    return value
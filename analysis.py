@@ -0,0 +1,125 @@
+'''
+
+This module measures the shape of dgMath graphs, to find the long chains that keep Maya's parallel
+evaluation from using more than one core.
+
+report = analyze([leftArm, rightArm])
+print(report)
+
+Graphs are analyzed from the operations their DgData was built by, so pending (deferred) DgData can be
+analyzed, and built DgData when it was built with options(provenance=True). The level of an operation is one more than the deepest of its inputs, the depth
+of a graph is its deepest level and its width the most operations on one level.
+Chains of associative operations can be rebalanced with options(balance=True) in deferred().
+
+'''
+
+import _graph
+
+
+class Analysis(object):
+    ''' The shape of a graph of operations. '''
+
+    def __init__(self, levels, criticalPath):
+        self.levels = levels
+        self.criticalPath = criticalPath
+
+    @property
+    def depth(self):
+        ''' The length of the longest chain of operations, the critical path. '''
+        return len(self.levels)
+
+    @property
+    def width(self):
+        ''' The most operations that can evaluate at the same time. '''
+        return max(self.levels or [0])
+
+    @property
+    def operations(self):
+        return sum(self.levels)
+
+    def parallelism(self):
+        ''' The average number of operations per level. '''
+        return self.operations / float(self.depth) if self.depth else 0.0
+
+    def __str__(self):
+        lines = ['%d operations, depth %d, width %d, parallelism %.2f' % (
+            self.operations, self.depth, self.width, self.parallelism())]
+        lines.append('Critical path: %s' % ' > '.join(expression.name or expression.operation.__name__
+                                                      for expression in self.criticalPath))
+        return '\n'.join(lines)
+
+
+def analyze(data):
+    '''
+    Returns the Analysis of the operations that DgData, or a list of DgData, is built from.
+    '''
+
+    outputs = data if isinstance(data, list) or isinstance(data, tuple) else [data]
+    roots = [source for source in [_graph.getSource(output) for output in outputs] if source is not None]
+
+    # Visit inputs before the operations using them, without recursing through long chains
+    order = []
+    inputs = {}
+    pending = [(root, False) for root in roots]
+    while pending:
+        expression, ready = pending.pop()
+        if ready:
+            order.append(expression)
+            continue
+        if expression in inputs:
+            continue
+
+        inputs[expression] = _getInputs(expression)
+        pending.append((expression, True))
+        pending.extend((input, False) for input in inputs[expression] if input not in inputs)
+
+    levels = {}
+    deepest = {}
+    for expression in order:
+        if expression in levels:
+            continue
+
+        level = 0
+        for input in inputs[expression]:
+            if levels[input] > level:
+                level = levels[input]
+                deepest[expression] = input
+
+        if _isOperation(expression):
+            level += 1
+        levels[expression] = level
+
+    counts = [0] * max(levels.values() or [0])
+    for expression, level in levels.items():
+        if _isOperation(expression):
+            counts[level - 1] += 1
+
+    # Walk back from the deepest output along the inputs that made it deep
+    path = []
+    expression = max(roots, key=lambda root: levels[root]) if roots else None
+    while expression is not None:
+        if _isOperation(expression):
+            path.append(expression)
+        expression = deepest.get(expression)
+    path.reverse()
+
+    return Analysis(counts, path)
+
+
+def _isOperation(expression):
+    return not (expression.constant or isinstance(expression, _graph.OutputExpression) or
+                isinstance(expression, _graph.InputExpression))
+
+
+def _getInputs(expression):
+    sources = []
+    pending = list(expression.args) + list(expression.kwargs.values())
+    while pending:
+        item = pending.pop()
+        source = _graph.getSource(item)
+        if source is not None:
+            if source not in sources:
+                sources.append(source)
+        elif isinstance(item, list) or isinstance(item, tuple):
+            pending.extend(item)
+    return sources
@@ -0,0 +1,387 @@
+'''
+
+This module benchmarks building and evaluating large synthetic graphs.
+
+Graphs are built against the standin module rather than a scene, so results only depend on
+dgMath itself and can be compared between changes to _factories and general:
+
+import dgMath.benchmarks as benchmarks
+results = benchmarks.run(sizes=[1000, 10000])
+benchmarks.save(results, 'after.json')
+benchmarks.compare(benchmarks.load('before.json'), results)
+
+or from a shell:
+
+mayapy -m dgMath.benchmarks --sizes 1000 10000 --output after.json --compare before.json
+
+Maya is not needed, without it the standin module plays maya.api.OpenMaya and pymel.core is replaced by a
+stub, so the benchmarks also run from the dgMath directory in plain python:
+
+python -m benchmarks --sizes 1000 --no-evaluate
+
+Every graph is generated from a fixed seed, so the same sizes and datatypes always build the same
+operations. Each result records the build time, the peak python memory, and the nodes and
+connections that were made. Peak memory is traced with tracemalloc where it is available, otherwise
+it is the peak resident size of the process.
+
+'''
+
+import gc
+import json
+import math
+import random
+import sys
+import types
+import platform
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import standin
+
+
+def _installStandins():
+    '''
+    Stands in for the Maya modules that cannot be imported. The standin module plays maya.api.OpenMaya,
+    and pymel.core only provides the attribute class that plugs are checked against.
+    '''
+
+    try:
+        import maya.api.OpenMaya
+    except ImportError:
+        maya = types.ModuleType('maya')
+        maya.api = types.ModuleType('maya.api')
+        maya.api.OpenMaya = standin
+        sys.modules.update({'maya': maya, 'maya.api': maya.api, 'maya.api.OpenMaya': standin})
+
+    try:
+        import pymel.core
+    except ImportError:
+        pymel = types.ModuleType('pymel')
+        pymel.core = types.ModuleType('pymel.core')
+        pymel.core.general = types.ModuleType('pymel.core.general')
+        pymel.core.general.Attribute = type('Attribute', (object,), {})
+        sys.modules.update({'pymel': pymel, 'pymel.core': pymel.core, 'pymel.core.general': pymel.core.general})
+
+
+_installStandins()
+
+import evaluate
+from general import options, memoScope, batch, deferred
+from datatypes import Float, Vector, Matrix, Quaternion
+from functions import *
+
+
+SIZES = [1000, 10000, 100000]
+DATATYPES = ['float', 'vector', 'matrix', 'quaternion']
+
+# Operations take one of the last few results, so graphs are both wide and deep
+WINDOW = 8
+
+SEED = 1
+
+
+#### GRAPHS ####
+
+def _randomFloat(rng):
+    return rng.uniform(-10.0, 10.0)
+
+
+def _randomVector(rng):
+    return [rng.uniform(-10.0, 10.0) for i in range(3)]
+
+
+def _randomQuaternion(rng):
+    values = [rng.uniform(-1.0, 1.0) for i in range(4)]
+    length = math.sqrt(sum(value * value for value in values)) or 1.0
+    return [value / length for value in values]
+
+
+def _randomMatrix(rng):
+    # Rotations stay well conditioned however deep the products and inverses of them get
+    x, y, z, w = _randomQuaternion(rng)
+    return [1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w), 0,
+            2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w), 0,
+            2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y), 0,
+            0, 0, 0, 1]
+
+
+# The operations each graph is made of, as functions taking a picker for one of the last results and one for
+# one of the graph's inputs. Combining a result with an input, rather than two results, keeps the values and their
+# rounding errors from growing exponentially with the depth of the graph.
+GRAPHS = {
+    'float': {
+        'type': Float,
+        'literal': _randomFloat,
+        'operations': [
+            lambda pick, source: Add(pick(), source()),
+            lambda pick, source: Subtract(pick(), source()),
+            lambda pick, source: Multiply(pick(), source()),
+            lambda pick, source: Sin(pick()),
+            lambda pick, source: Abs(pick())
+        ]
+    },
+    'vector': {
+        'type': Vector,
+        'literal': _randomVector,
+        'operations': [
+            lambda pick, source: Add(pick(), source()),
+            lambda pick, source: Subtract(pick(), source()),
+            lambda pick, source: Operation('cross', pick(), source()),
+            lambda pick, source: Normalize(pick())
+        ]
+    },
+    'matrix': {
+        'type': Matrix,
+        'literal': _randomMatrix,
+        'operations': [
+            lambda pick, source: Multiply(pick(), source()),
+            lambda pick, source: Multiply(source(), pick(), source()),
+            lambda pick, source: Inverse(pick())
+        ]
+    },
+    'quaternion': {
+        'type': Quaternion,
+        'literal': _randomQuaternion,
+        'operations': [
+            lambda pick, source: Multiply(pick(), source()),
+            lambda pick, source: Add(pick(), source()),
+            lambda pick, source: Normalize(pick()),
+            lambda pick, source: Operation('conjugate', pick())
+        ]
+    }
+}
+
+
+def buildGraph(datatype, count, inputs, seed=SEED):
+    '''
+    Builds a synthetic graph of operations on one datatype.
+    :param inputs: The DgData the first operations take as inputs.
+    :return: Every result, in the order they were built.
+    '''
+
+    graph = GRAPHS[datatype]
+    operations = graph['operations']
+    rng = random.Random(seed)
+
+    inputs = list(inputs)
+    window = list(inputs)
+    results = []
+
+    def pick():
+        return window[rng.randrange(len(window))]
+
+    def source():
+        return inputs[rng.randrange(len(inputs))]
+
+    for i in range(count):
+        result = operations[rng.randrange(len(operations))](pick, source)
+        results.append(result)
+
+        window.append(result)
+        if len(window) > WINDOW:
+            window.pop(0)
+
+    return results
+
+
+def _constants(datatype, seed):
+    rng = random.Random(seed)
+    return [Constant(GRAPHS[datatype]['literal'](rng)) for i in range(WINDOW)]
+
+
+def _samples(datatype, count, seed):
+    rng = random.Random(seed)
+    return [GRAPHS[datatype]['literal'](rng) for i in range(count)]
+
+
+#### MEASURING ####
+
+def _measure(function, repeat):
+    '''
+    Runs the function repeat times and once more to trace its memory.
+    :return: The fastest time, the peak memory in bytes and the result of the last run.
+    '''
+
+    seconds = None
+    for i in range(repeat):
+        gc.collect()
+        start = default_timer()
+        function()
+        elapsed = default_timer() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            result = function()
+            memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    else:
+        result = function()
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else None
+
+    return seconds, memory, result
+
+
+def benchmarkBuild(datatype, count, repeat=1, seed=SEED):
+    ''' Builds a graph on the standin and returns its measurements. '''
+
+    def build():
+        standin.reset()
+        with options(fold=False), memoScope(), batch(api=standin):
+            buildGraph(datatype, count, _constants(datatype, seed), seed)
+        return standin.scene.nodeTypes(), standin.scene.connectionCount()
+
+    seconds, memory, (nodes, connections) = _measure(build, repeat)
+    standin.reset()
+
+    return {
+        'name': 'build.%s.%d' % (datatype, count),
+        'mode': 'build',
+        'datatype': datatype,
+        'operations': count,
+        'seconds': seconds,
+        'peakMemory': memory,
+        'nodes': sum(nodes.values()),
+        'nodeTypes': nodes,
+        'connections': connections
+    }
+
+
+def benchmarkEvaluate(datatype, count, samples=8, repeat=1, seed=SEED):
+    ''' Records a graph and evaluates every result for a number of samples, returns its measurements. '''
+
+    values = _samples(datatype, samples, seed)
+
+    def run():
+        with deferred() as graph:
+            inputs = [evaluate.variable('input', GRAPHS[datatype]['type'])] + _constants(datatype, seed)[1:]
+            results = buildGraph(datatype, count, inputs, seed)
+            evaluate.evaluate(results, {'input': values})
+            graph.discard()
+
+    seconds, memory, result = _measure(run, repeat)
+
+    return {
+        'name': 'evaluate.%s.%d' % (datatype, count),
+        'mode': 'evaluate',
+        'datatype': datatype,
+        'operations': count,
+        'samples': samples,
+        'seconds': seconds,
+        'peakMemory': memory
+    }
+
+
+def run(sizes=None, datatypes=None, evaluation=True, samples=8, repeat=1, seed=SEED):
+    '''
+    Runs the benchmarks for every size and datatype.
+    :param evaluation: Whether to also benchmark evaluating the graphs, this requires numpy.
+    :return: The environment and the results, see save().
+    '''
+
+    results = []
+    for datatype in datatypes or DATATYPES:
+        for count in sizes or SIZES:
+            results.append(benchmarkBuild(datatype, count, repeat, seed))
+            if evaluation and evaluate.numpy is not None:
+                results.append(benchmarkEvaluate(datatype, count, samples, repeat, seed))
+
+    return {
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': evaluate.numpy.__version__ if evaluate.numpy is not None else None,
+            'memory': 'tracemalloc' if tracemalloc is not None else 'maxrss',
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+#### RESULTS ####
+
+def save(results, path):
+    with open(path, 'w') as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def compare(before, after):
+    '''
+    Returns a report of how the results changed, ratios below 1.0 are improvements.
+    '''
+
+    previous = dict((result['name'], result) for result in before['results'])
+
+    lines = ['%-28s %10s %10s %8s %8s %8s' % ('Benchmark', 'Before', 'After', 'Time', 'Memory', 'Nodes')]
+    for result in after['results']:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+
+        lines.append('%-28s %10.4f %10.4f %8s %8s %8s' % (
+            result['name'], old['seconds'], result['seconds'],
+            _ratio(old['seconds'], result['seconds']),
+            _ratio(old.get('peakMemory'), result.get('peakMemory')),
+            _ratio(old.get('nodes'), result.get('nodes'))))
+
+    return '\n'.join(lines)
+
+
+def _ratio(before, after):
+    if not before or after is None:
+        return '-'
+    return '%.2fx' % (float(after) / before)
+
+
+def formatResults(results):
+    lines = ['%-28s %10s %12s %8s %12s' % ('Benchmark', 'Seconds', 'Peak memory', 'Nodes', 'Connections')]
+    for result in results['results']:
+        lines.append('%-28s %10.4f %12s %8s %12s' % (
+            result['name'], result['seconds'], result['peakMemory'], result.get('nodes', '-'),
+            result.get('connections', '-')))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks building and evaluating dgMath graphs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--datatypes', nargs='+', choices=DATATYPES, default=DATATYPES)
+    parser.add_argument('--samples', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--no-evaluate', dest='evaluation', action='store_false')
+    parser.add_argument('--output', help='A json file to write the results to.')
+    parser.add_argument('--compare', help='A json file of earlier results to compare with.')
+    args = parser.parse_args(args)
+
+    results = run(args.sizes, args.datatypes, args.evaluation, args.samples, args.repeat, args.seed)
+    print(formatResults(results))
+
+    if args.output:
+        save(results, args.output)
+    if args.compare:
+        print('')
+        print(compare(load(args.compare), results))
+
+
+if __name__ == '__main__':
+    main()
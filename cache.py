@@ -0,0 +1,428 @@
+'''
+
+This module keeps the graphs that build functions make on disk, so later builds load them instead of
+running the functions again:
+
+@cached
+def spine(hips, chest, count=5):
+    ...
+    return joints
+
+spine(hips.worldMatrix[0], chest.worldMatrix[0])
+
+A graph is found by a hash of the function's code, the types of its inputs, its literal inputs and keyword
+arguments, and the dgMath modules that build graphs. On a miss the function is recorded inside deferred()
+with variables for its inputs, and the graph is written with serialize.dumps(), with the connections the
+function made. Either way the graph is then loaded with the inputs, see serialize.load(). Functions that
+read values, or build operations that cannot be written, are called as they are.
+
+THE HASH ONLY SEES CODE THROUGH THE NAMES IT USES. The code of the functions a cached function calls by a
+global name or from its closure is hashed, as are the literals it uses from either, followed through the
+functions they call in turn. Anything else it depends on is not: methods, classes, functions reached
+through attributes of other modules, and state that changes between calls. Clear the cache when they
+change, or pass them in as keyword arguments.
+
+Entries are written to a temporary file and renamed, so processes sharing a cache never read a partial
+entry. Each hit touches its entry, and once the cache is larger than its size the least recently used
+entries are removed by the one process holding the lock file.
+
+cache = getCache()
+print(cache.hits, cache.misses, cache.hitRate())
+
+'''
+
+import errno
+import hashlib
+import inspect
+import os
+import sys
+import tempfile
+import time
+import types
+from functools import wraps
+
+import _factories
+import general
+import serialize
+from _backends import RecordingError
+
+
+# The default location of the cache, and the most bytes it keeps
+PATH = os.environ.get('DGMATH_CACHE', os.path.join(tempfile.gettempdir(), 'dgmath_cache'))
+SIZE = 256 * 1024 * 1024
+
+# Seconds after which the lock of a process that died is taken over
+LOCK_TIMEOUT = 60.0
+
+# The modules that determine which graph a function builds, entries are only shared while they are the same
+GRAPH_MODULES = ['_backends', '_factories', '_graph', 'compiler', 'datatypes', 'functions', 'general',
+                 'optimizer', 'serialize', 'simplify', 'templates']
+
+
+class Cache(object):
+    '''
+    Graphs on disk by their hash.
+    :param path: The directory of the cache, it is shared by every cache using it.
+    :param size: The most bytes the entries take up before the least recently used ones are removed.
+    '''
+
+    def __init__(self, path=PATH, size=SIZE):
+        self.path = path
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return '<Cache %s, %d hits, %d misses>' % (self.path, self.hits, self.misses)
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def asDict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'hitRate': self.hitRate()
+        }
+
+    def getPath(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        ''' Returns the graph with the key, or None. '''
+
+        path = self.getPath(key)
+        try:
+            with open(path, 'rb') as stream:
+                text = stream.read()
+
+            # Reading is what makes an entry recent
+            os.utime(path, None)
+
+        # Another process may have removed the entry
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return text
+
+    def put(self, key, text):
+        ''' Writes a graph under the key, removing the least recently used entries if the cache is full. '''
+
+        path = self.getPath(key)
+        _makeDirectories(os.path.dirname(path))
+
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'wb') as stream:
+            stream.write(text)
+
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # Windows does not replace files, the entry written by another process is the same
+            os.remove(temporary)
+
+        self.writes += 1
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits its size.
+        :return: The number of entries that were removed.
+        '''
+
+        entries = self.entries()
+        total = sum(size for path, size, used in entries)
+        if total <= self.size:
+            return 0
+
+        # Another process is already removing entries
+        if not self._lock():
+            return 0
+
+        removed = 0
+        try:
+            for path, size, used in sorted(self.entries(), key=lambda entry: entry[2]):
+                if total <= self.size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        finally:
+            self._unlock()
+
+        self.evictions += removed
+        return removed
+
+    def entries(self):
+        ''' Returns the path, size and last use of every entry. '''
+
+        entries = []
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.tmp') or name == 'lock':
+                    continue
+
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def clear(self):
+        ''' Removes every entry. '''
+
+        for path, size, used in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _lock(self):
+        ''' Takes the lock file, returning False if another process holds it. '''
+
+        _makeDirectories(self.path)
+        path = os.path.join(self.path, 'lock')
+        for attempt in range(2):
+            try:
+                handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+                # The lock of a process that died is removed, and taken once more
+                try:
+                    if attempt or time.time() - os.stat(path).st_mtime < LOCK_TIMEOUT:
+                        return False
+                    os.remove(path)
+                except OSError:
+                    return False
+                continue
+
+            os.write(handle, str(os.getpid()).encode())
+            os.close(handle)
+            return True
+
+        return False
+
+    def _unlock(self):
+        try:
+            os.remove(os.path.join(self.path, 'lock'))
+        except OSError:
+            pass
+
+
+def _makeDirectories(path):
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+_cache = None
+
+
+def getCache():
+    ''' Returns the cache used by cached functions, at PATH unless another has been set. '''
+
+    global _cache
+    if _cache is None:
+        _cache = Cache()
+    return _cache
+
+
+def setCache(cache):
+    global _cache
+    _cache = cache
+
+
+_version = None
+
+
+def getVersion():
+    '''
+    Returns a hash of the files of the GRAPH_MODULES.
+    Sources are hashed where they are installed, compiled modules otherwise.
+    '''
+
+    global _version
+    if _version is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        names = set(os.listdir(directory))
+
+        digest = hashlib.sha1()
+        for module in GRAPH_MODULES:
+            for extension in ['.py', '.pyc', '.pyo']:
+                name = module + extension
+                if name in names:
+                    with open(os.path.join(directory, name), 'rb') as stream:
+                        digest.update(name.encode('utf-8'))
+                        digest.update(stream.read())
+                    break
+        _version = digest.hexdigest()
+    return _version
+
+
+def getKey(function, args, kwargs):
+    '''
+    Returns the hash of a call, or None if an input cannot be hashed.
+    Plugs and DgData are inputs of the graph, only their types are part of the hash. Keyword arguments
+    are settings, they must be literal or strings. The code of the function includes the helpers it
+    calls by name, see the module documentation for what it leaves out.
+    '''
+
+    inputs = []
+    for arg in args:
+        if _isLiteral(arg):
+            inputs.append(repr(arg))
+        else:
+            inputs.append(_factories.getDgDataType(arg).__name__)
+
+    for key, value in sorted(kwargs.items()):
+        if not _isLiteral(value) and not isinstance(value, basestring):
+            return None
+        inputs.append('%s=%r' % (key, value))
+
+    items = [getVersion(), '%d.%d' % sys.version_info[:2], function.__module__, function.__name__]
+    items.extend(_getCode(function))
+
+    digest = hashlib.sha1()
+    for item in items + inputs:
+        # Sources read by python 2 are already bytes, in whatever encoding the file has
+        if not isinstance(item, bytes):
+            item = item.encode('utf-8')
+        digest.update(item)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _getCode(function):
+    '''
+    Returns the sources of a function and of the functions it calls by their global names or from its
+    closure, with the literals they use from either. Functions of the GRAPH_MODULES are part of getVersion().
+    '''
+
+    items = []
+    visited = set()
+    pending = [function]
+    while pending:
+        helper = pending.pop()
+        if helper in visited:
+            continue
+        visited.add(helper)
+
+        try:
+            items.append(inspect.getsource(helper))
+        except (IOError, TypeError):
+            items.append(helper.__code__.co_code)
+
+        # Closures are looked up before the globals
+        namespace = dict(helper.__globals__)
+        namespace.update(_getClosure(helper))
+        for name in sorted(_getNames(helper.__code__) | set(helper.__code__.co_freevars)):
+            if name not in namespace:
+                continue
+
+            value = namespace[name]
+            if isinstance(value, types.FunctionType):
+                if not _isGraphFunction(value):
+                    pending.append(value)
+            elif _isLiteral(value) or isinstance(value, basestring):
+                items.append('%s=%r' % (name, value))
+
+    return items
+
+
+def _getClosure(function):
+    values = {}
+    for name, cell in zip(function.__code__.co_freevars, function.__closure__ or []):
+        try:
+            values[name] = cell.cell_contents
+        except ValueError:
+            # The cell is not assigned yet
+            pass
+    return values
+
+
+def _isGraphFunction(function):
+    module = sys.modules.get(function.__module__)
+    return (module is not None and function.__module__.rpartition('.')[2] in GRAPH_MODULES and
+            getattr(module, function.__name__, None) is function)
+
+
+def _getNames(code):
+    ''' Returns the global names used by code, including that of the functions and classes defined in it. '''
+
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names.update(_getNames(constant))
+    return names
+
+
+def _isLiteral(value):
+    if isinstance(value, list) or isinstance(value, tuple):
+        return all(_isLiteral(item) for item in value)
+    return value is None or isinstance(value, bool) or isinstance(value, int) or isinstance(value, float)
+
+
+def record(function, args, kwargs):
+    '''
+    Records the graph a function builds, with variables for its inputs that are not literal.
+    :return: The graph written by serialize.dumps(), or None if the function cannot be recorded.
+    '''
+
+    from evaluate import variable
+
+    inputs = [arg if _isLiteral(arg) else variable('input%d' % index, _factories.getDgDataType(arg))
+              for index, arg in enumerate(args)]
+
+    # Connections the function makes are part of the entry, functions that cannot be recorded are not
+    # cached, any other error is raised
+    with general.deferred() as graph:
+        try:
+            return serialize.dumps(function(*inputs, **kwargs), binary=True, graph=graph)
+        except RecordingError:
+            return None
+        finally:
+            # The variables cannot be built, the graph is loaded with the inputs instead
+            graph.discard()
+
+
+def cached(function):
+    '''
+    Keeps the graph a function builds in the cache, see the module documentation.
+    '''
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        cache = getCache()
+
+        key = getKey(function, args, kwargs)
+        if key is None:
+            return function(*args, **kwargs)
+
+        text = cache.get(key)
+        if text is None:
+            text = record(function, args, kwargs)
+            if text is None:
+                return function(*args, **kwargs)
+            cache.put(key, text)
+
+        inputs = dict(('input%d' % index, arg) for index, arg in enumerate(args) if not _isLiteral(arg))
+        return serialize.loads(text, inputs)
+
+    return wrapper
@@ -0,0 +1,256 @@
+'''
+
+This module compiles infix math expressions over plugs into dgMath operations, so the expression nodes of
+legacy rigs can be replaced by native nodes that Maya evaluates in parallel:
+
+result = compileExpression('sin(arm.rx) * 2 + arm.ty')
+result.connect(hand.tz)
+
+compileStatements('hand.tz = sin(arm.rx) * 2 + arm.ty; hand.ty = -arm.tx;')
+
+Expressions support + - * / and ** (power), ^ (cross product), unary minus, parentheses, numbers, vectors
+written as <<x, y, z>> and the functions in FUNCTIONS. Any other name is a plug, unless it is given as a
+keyword. As in Maya expressions, multiplying two vectors is their dot product.
+
+Types are inferred from the inputs with getDgDataType and every operator is dispatched like the functions
+of the functions module, so "arm.t * 2" scales a vector. Expressions are compiled inside deferred(), so
+simplification, rewrites and fusion apply, as do folding, sharing and balancing when their options are set.
+
+'''
+
+import re
+
+import _factories
+from general import DgData, deferred
+from functions import *
+
+
+# Functions by the name used in expressions, as the name of a dispatched operation or an operation class
+FUNCTIONS = {
+    'sin': Sin,
+    'cos': Cos,
+    'tan': Tan,
+    'abs': 'abs',
+    'sqrt': 'sqrt',
+    'pow': 'pow',
+    'floor': 'floor',
+    'ceil': 'ceil',
+    'round': 'round',
+    'deg_to_rad': 'radians',
+    'rad_to_deg': 'degrees',
+    'radians': 'radians',
+    'degrees': 'degrees',
+    'mag': 'length',
+    'length': 'length',
+    'unit': 'normalize',
+    'normalize': 'normalize',
+    'dot': 'dot',
+    'cross': 'cross',
+    'distance': 'distance',
+    'inverse': 'inverse',
+    'transpose': 'transpose'
+}
+
+# Binary operators by precedence, lowest first
+_OPERATORS = [
+    {'+': 'add', '-': 'subtract'},
+    {'*': 'multiply', '/': 'divide', '^': 'cross'},
+]
+
+_TOKENS = re.compile(r'''
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+        (?P<name>[A-Za-z_|:][\w|:]*(?:\[\d+\])?(?:\.[A-Za-z_]\w*(?:\[\d+\])?)*) |
+        (?P<operator>\*\*|<<|>>|[-+*/^(),=;])
+    )''', re.VERBOSE)
+
+
+def tokenize(source):
+    '''
+    Splits an expression into (kind, text) tokens, kinds are number, name and operator.
+    '''
+
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKENS.match(source, position)
+        if match is None:
+            raise ValueError('Unexpected "%s" at %d in "%s"' % (source[position:].strip()[:1], position, source))
+
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+
+    return tokens
+
+
+class Parser(object):
+    '''
+    Builds the operations of an expression while parsing it.
+    :param variables: Values for names, instead of reading them as plugs.
+    '''
+
+    def __init__(self, source, variables=None):
+        self.source = source
+        self.tokens = tokenize(source)
+        self.position = 0
+        self.variables = dict(variables or {})
+        self._plugs = {}
+
+    def peek(self):
+        return self.tokens[self.position][1] if self.position < len(self.tokens) else None
+
+    def take(self, expected=None):
+        if self.position >= len(self.tokens):
+            raise ValueError('Unexpected end of "%s"' % self.source)
+
+        kind, text = self.tokens[self.position]
+        if expected is not None and text != expected:
+            raise ValueError('Expected "%s" but found "%s" in "%s"' % (expected, text, self.source))
+
+        self.position += 1
+        return kind, text
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    def parseExpression(self, level=0):
+        if level == len(_OPERATORS):
+            return self.parseUnary()
+
+        result = self.parseExpression(level + 1)
+        while self.peek() in _OPERATORS[level]:
+            operation = _OPERATORS[level][self.take()[1]]
+            result = _factories.getOperation(operation, result, self.parseExpression(level + 1))
+
+        return result
+
+    def parseUnary(self):
+        if self.peek() == '-':
+            self.take()
+            value = self.parseUnary()
+            return -value if _isNumber(value) else Negate(value)
+
+        if self.peek() == '+':
+            self.take()
+            return self.parseUnary()
+
+        return self.parsePower()
+
+    def parsePower(self):
+        result = self.parseAtom()
+
+        # Powers bind to the right, so 2 ** 3 ** 2 is 2 ** 9
+        if self.peek() == '**':
+            self.take()
+            result = _factories.getOperation('pow', result, self.parseUnary())
+
+        return result
+
+    def parseAtom(self):
+        kind, text = self.take()
+
+        if kind == 'number':
+            return float(text)
+
+        if text == '(':
+            result = self.parseExpression()
+            self.take(')')
+            return result
+
+        if text == '<<':
+            return self.parseArguments('>>')
+
+        if kind == 'name' and self.peek() == '(':
+            self.take()
+            return self.call(text, self.parseArguments(')'))
+
+        if kind == 'name':
+            return self.getName(text)
+
+        raise ValueError('Unexpected "%s" in "%s"' % (text, self.source))
+
+    def parseArguments(self, closing):
+        arguments = []
+        while self.peek() != closing:
+            if arguments:
+                self.take(',')
+            arguments.append(self.parseExpression())
+        self.take(closing)
+        return arguments
+
+    def call(self, name, arguments):
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise ValueError('Unknown function "%s" in "%s"' % (name, self.source))
+
+        if isinstance(function, basestring):
+            return _factories.getOperation(function, *arguments)
+        return _factories.buildOperation(function, arguments, {})
+
+    def getName(self, name):
+        if name in self.variables:
+            return self.variables[name]
+
+        # Every use of a plug shares one DgData, so its type is only resolved once
+        if name not in self._plugs:
+            self._plugs[name] = DgData(name)
+        return self._plugs[name]
+
+
+def _isNumber(value):
+    return isinstance(value, int) or isinstance(value, float)
+
+
+def compileExpression(source, **variables):
+    '''
+    Builds the operations of an infix math expression, for example:
+
+    compileExpression('(a.tx + b.tx) / 2')
+    compileExpression('offset * 2', offset=Constant(1.0))
+
+    :param variables: Values for names in the expression, instead of reading them as plugs.
+    :return: The DgData of the result, with options(fold=True) expressions of literals are constants.
+    '''
+
+    with deferred():
+        parser = Parser(source, variables)
+        result = parser.parseExpression()
+        if not parser.done():
+            raise ValueError('Unexpected "%s" in "%s"' % (parser.peek(), source))
+
+    return DgData(result)
+
+
+def compileStatements(source, **variables):
+    '''
+    Builds and connects assignments like those of an expression node, for example:
+
+    compileStatements(pmc.PyNode('arm_expression').getString())
+
+    :param variables: Values for names in the expressions, instead of reading them as plugs.
+    :return: The result of each assignment by the plug it was connected to.
+    '''
+
+    results = {}
+    with deferred():
+        parser = Parser(source, variables)
+        while not parser.done():
+            if parser.peek() == ';':
+                parser.take()
+                continue
+
+            kind, destination = parser.take()
+            if kind != 'name':
+                raise ValueError('Expected a plug to assign to but found "%s" in "%s"' % (destination, source))
+            parser.take('=')
+
+            result = parser.parseExpression()
+            DgData(result).connect(destination)
+            results[destination] = result
+
+            if not parser.done():
+                parser.take(';')
+
+    return results
@@ -6,9 +6,9 @@ class Float(DgData):
     _type = 'float'
     _defaultInputs = 0
 
-    def createConstant(self):
+    def createConstant(self, multi=False):
         node = self.createNode('network')
-        node.addAttr('constant')
+        node.addAttr('constant', multi=multi)
         return node.constant
 
     def multiply(self, *args, **kwargs):
@@ -67,9 +67,9 @@ class Vector(DgArray):
     _type = 'vector'
     _defaultInputs = [[0,0,0]]
 
-    def createConstant(self):
+    def createConstant(self, multi=False):
         node = self.createNode('network')
-        node.addAttr('constant', at='double3')
+        node.addAttr('constant', at='double3', multi=multi)
         node.addAttr('constantX', at='double', parent='constant')
         node.addAttr('constantY', at='double', parent='constant')
         node.addAttr('constantZ', at='double', parent='constant')
@@ -147,9 +147,9 @@ class Matrix(DgArray):
         else:
             return DgArray.__new__(cls, *args, **kwargs)
 
-    def createConstant(self):
+    def createConstant(self, multi=False):
         node = self.createNode('network')
-        node.addAttr('constant', at='matrix')
+        node.addAttr('constant', at='matrix', multi=multi)
         return node.constant
 
     def multiply(self, *args, **kwargs):
@@ -199,9 +199,9 @@ class Quaternion(DgArray):
     _type = 'quaternion'
     _defaultInputs = [[0,0,0,0]]
 
-    def createConstant(self):
+    def createConstant(self, multi=False):
         node = self.createNode('network')
-        node.addAttr('constant', at='compound', numberOfChildren=4)
+        node.addAttr('constant', at='compound', numberOfChildren=4, multi=multi)
         node.addAttr('constantX', at='double', parent='constant')
         node.addAttr('constantY', at='double', parent='constant')
         node.addAttr('constantZ', at='double', parent='constant')
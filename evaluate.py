@@ -0,0 +1,652 @@
+'''
+
+This module evaluates dgMath operations with NumPy, without creating or reading nodes.
+
+Every operation in functions.py has a kernel here that mirrors what its nodes compute,
+including the exact constants and node chains they use, over arrays of samples:
+floats have the shape (N,), vectors (N, 3), quaternions (N, 4) and matrices (N, 4, 4).
+
+with deferred() as graph:
+    angle = variable('angle')
+    offset = Multiply(Sin(angle, degrees=True), [0.0, 1.0, 0.0])
+    samples = evaluate(offset, {'angle': numpy.linspace(0.0, 360.0, 1000)})
+    graph.discard()
+
+Inputs are variables, or the plugs of the graph given by name. Plugs without a value are read
+from the scene once and used for every sample. Angles are in degrees, like the node attributes.
+
+NumPy is optional for dgMath, it is only imported when evaluating.
+
+'''
+
+import _graph
+from general import DgData
+from datatypes import Float, Vector, Matrix, Quaternion
+from functions import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Kernels by operation class, see registerKernel()
+KERNELS = {}
+
+# Rotate orders by the value of rotateOrder attributes
+ROTATE_ORDERS = [(0, 1, 2), (1, 2, 0), (2, 0, 1), (0, 2, 1), (1, 0, 2), (2, 1, 0)]
+
+_IDENTITY = (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+
+
+def registerKernel(operation, kernel):
+    '''
+    Adds the kernel that evaluates an operation, for example:
+
+    registerKernel(LerpFloat, lambda input1, input2, weight: input1 + (input2 - input1) * weight)
+
+    :param operation: The DgData subclass that builds the operation, subclasses use it too.
+    :param kernel: A function taking the same inputs as the operation as arrays.
+    '''
+    KERNELS[operation] = kernel
+
+
+def _kernel(operation):
+    def register(function):
+        registerKernel(operation, function)
+        return function
+    return register
+
+
+def variable(name, type=Float):
+    '''
+    Returns an input for expressions that are only evaluated, its values are given to evaluate() by name.
+    :param type: The datatype of the input, Float by default.
+    '''
+
+    data = object.__new__(type)
+    data._name = name
+    data._data = _graph.InputExpression(name, type)
+    return data
+
+
+def evaluate(data, inputs=None):
+    '''
+    Evaluates DgData, or a list of it, for all the samples of the inputs.
+    :param inputs: Arrays of samples by variable or plug name.
+    :return: An array of values, or a dictionary of arrays for operations with several outputs.
+    '''
+
+    if numpy is None:
+        raise ImportError('Evaluating requires numpy.')
+
+    evaluator = Evaluator(inputs)
+
+    if isinstance(data, list):
+        return [evaluator.value(item) for item in data]
+    return evaluator.value(data)
+
+
+class Evaluator(object):
+    ''' Evaluates expressions, sharing the values of expressions used more than once. '''
+
+    def __init__(self, inputs=None):
+        self.inputs = {}
+        self._values = {}
+
+        for key, value in (inputs or {}).items():
+            self.inputs[_getInputName(key)] = _toArray(value)
+
+    def value(self, data):
+        ''' Returns the value of an input, computing the expressions it depends on first. '''
+
+        name = _getInputName(data, strict=False)
+        if name is not None and name in self.inputs:
+            return self.inputs[name]
+
+        expression = _graph.getSource(data)
+        if expression is not None:
+            self._evaluate(expression)
+            return self._values[expression]
+
+        if isinstance(data, DgData):
+            data = data.data()
+
+        if isinstance(data, list) or isinstance(data, tuple):
+            return _stack([self.value(item) for item in data])
+
+        if _isPlug(data):
+            self.inputs[name] = _toArray(data.get())
+            return self.inputs[name]
+
+        return _toArray(data)
+
+    def _evaluate(self, root):
+        # Depth first without recursion, dgMath graphs can be deeper than the recursion limit
+        stack = [root]
+        while stack:
+            expression = stack[-1]
+            if expression in self._values:
+                stack.pop()
+                continue
+
+            missing = [item for item in self._dependencies(expression) if item not in self._values]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+            self._values[expression] = self._compute(expression)
+
+    def _dependencies(self, expression):
+        dependencies = []
+        pending = list(expression.args) + list(expression.kwargs.values())
+        while pending:
+            item = pending.pop()
+            name = _getInputName(item, strict=False)
+            if name is not None and name in self.inputs:
+                continue
+            source = _graph.getSource(item)
+            if source is not None:
+                dependencies.append(source)
+            elif isinstance(item, list) or isinstance(item, tuple):
+                pending.extend(item)
+        return dependencies
+
+    def _compute(self, expression):
+        if isinstance(expression, _graph.InputExpression):
+            if expression.name not in self.inputs:
+                raise KeyError('No values were given for input "%s".' % expression.name)
+            return self.inputs[expression.name]
+
+        if isinstance(expression, _graph.OutputExpression):
+            return self._values[expression.args[0]][expression.attribute]
+
+        args = [self.value(arg) for arg in expression.args]
+        kwargs = dict((key, self.value(value)) for key, value in expression.kwargs.items())
+
+        if expression.constant:
+            return args[0]
+
+        for operation in expression.operation.__mro__:
+            if operation in KERNELS:
+                return KERNELS[operation](*args, **kwargs)
+
+        raise TypeError('%s cannot be evaluated, register a kernel for it.' % expression.operation.__name__)
+
+
+def _isPlug(data):
+    import _factories
+    return _factories.isPlug(data)
+
+
+def _getInputName(data, strict=True):
+    ''' Returns the name inputs are given by for a variable or plug. '''
+
+    if isinstance(data, basestring):
+        return data
+
+    expression = _graph.getExpression(data)
+    if isinstance(expression, _graph.InputExpression):
+        return expression.name
+
+    if isinstance(data, DgData) and expression is None and data.isAttr():
+        data = data.data()
+
+    if _isPlug(data):
+        return data.name()
+
+    if strict:
+        raise TypeError('%s is neither a variable nor a plug.' % str(data))
+    return None
+
+
+#### Arrays ####
+
+def _toArray(value):
+    if value is None or isinstance(value, bool):
+        return value
+
+    array = numpy.asarray(value, dtype=float)
+    if array.shape and array.shape[-1] == 16:
+        array = array.reshape(array.shape[:-1] + (4, 4))
+    return array
+
+
+def _stack(values):
+    ''' Combines the values of the items of a list, like [Float, Float, 1.0] for a vector. '''
+    values = numpy.broadcast_arrays(*values)
+    array = numpy.stack(values, axis=-1)
+    if array.shape[-1] == 16:
+        array = array.reshape(array.shape[:-1] + (4, 4))
+    return array
+
+
+def _dot(vector1, vector2):
+    return (vector1 * vector2).sum(axis=-1)
+
+
+def _length(vector):
+    return numpy.sqrt(_dot(vector, vector))
+
+
+def _normal(vector):
+    ''' Normalizes vectors, zero vectors stay zero like they do on vectorProduct. '''
+    length = _length(vector)[..., None]
+    return numpy.where(length > 0.0, vector / numpy.where(length > 0.0, length, 1.0), 0.0)
+
+
+def _toInteger(value):
+    return numpy.copysign(numpy.floor(numpy.abs(value) + 0.5), value)
+
+
+def _rotateOrder(rotateOrder):
+    orders = numpy.unique(numpy.asarray(rotateOrder, dtype=int))
+    if len(orders) != 1:
+        raise ValueError('Rotate orders must be the same for every sample.')
+    return ROTATE_ORDERS[orders[0]]
+
+
+def _axisRotation(axis, angle):
+    ''' Returns row vector rotation matrices around an axis, for angles in degrees. '''
+
+    angle = numpy.radians(angle)
+    cos, sin = numpy.cos(angle), numpy.sin(angle)
+    j, k = [(1, 2), (2, 0), (0, 1)][axis]
+
+    matrix = numpy.zeros(numpy.shape(angle) + (3, 3))
+    matrix[..., axis, axis] = 1.0
+    matrix[..., j, j] = cos
+    matrix[..., k, k] = cos
+    matrix[..., j, k] = sin
+    matrix[..., k, j] = -sin
+    return matrix
+
+
+def _eulerToMatrix(rotate, rotateOrder=0):
+    matrix = numpy.eye(3)
+    for axis in _rotateOrder(rotateOrder):
+        matrix = numpy.matmul(matrix, _axisRotation(axis, rotate[..., axis]))
+    return matrix
+
+
+def _matrixToEuler(matrix, rotateOrder=0):
+    ''' Extracts euler rotations in degrees from row vector rotation matrices. '''
+
+    i, j, k = _rotateOrder(rotateOrder)
+    sign = 1.0 if (j - i) % 3 == 1 else -1.0
+
+    rotate = numpy.zeros(matrix.shape[:-2] + (3,))
+    rotate[..., j] = numpy.arcsin(numpy.clip(-sign * matrix[..., i, k], -1.0, 1.0))
+    rotate[..., i] = numpy.arctan2(sign * matrix[..., j, k], matrix[..., k, k])
+    rotate[..., k] = numpy.arctan2(sign * matrix[..., i, j], matrix[..., i, i])
+    return numpy.degrees(rotate)
+
+
+def _quaternionProduct(quat1, quat2):
+    ''' Multiplies quaternions in Maya's order, so quat1's rotation is applied first. '''
+    x1, y1, z1, w1 = [quat2[..., i] for i in range(4)]
+    x2, y2, z2, w2 = [quat1[..., i] for i in range(4)]
+    return numpy.stack([w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+                        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2], axis=-1)
+
+
+def _axisQuaternion(axis, angle):
+    half = numpy.radians(angle) / 2.0
+    quat = numpy.zeros(numpy.shape(angle) + (4,))
+    quat[..., axis] = numpy.sin(half)
+    quat[..., 3] = numpy.cos(half)
+    return quat
+
+
+def _quaternionToMatrix(quat):
+    x, y, z, w = [quat[..., i] for i in range(4)]
+    return numpy.stack([
+        numpy.stack([1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y + z * w), 2.0 * (x * z - y * w)], axis=-1),
+        numpy.stack([2.0 * (x * y - z * w), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z + x * w)], axis=-1),
+        numpy.stack([2.0 * (x * z + y * w), 2.0 * (y * z - x * w), 1.0 - 2.0 * (x * x + y * y)], axis=-1),
+    ], axis=-2)
+
+
+def _matrixToQuaternion(matrix):
+    ''' Converts row vector rotation matrices to quaternions with a positive w. '''
+
+    m = matrix
+    trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+
+    # Each candidate divides by the largest component, use the one that is stable per sample
+    candidates = []
+    for index, diagonal in enumerate([trace, m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]]):
+        if index == 0:
+            s = numpy.sqrt(numpy.maximum(1.0 + trace, 1e-12)) * 2.0
+            quat = [(m[..., 1, 2] - m[..., 2, 1]) / s, (m[..., 2, 0] - m[..., 0, 2]) / s,
+                    (m[..., 0, 1] - m[..., 1, 0]) / s, 0.25 * s]
+        else:
+            a = index - 1
+            b, c = (a + 1) % 3, (a + 2) % 3
+            s = numpy.sqrt(numpy.maximum(1.0 + 2.0 * diagonal - trace, 1e-12)) * 2.0
+            quat = [None] * 4
+            quat[a] = 0.25 * s
+            quat[b] = (m[..., a, b] + m[..., b, a]) / s
+            quat[c] = (m[..., a, c] + m[..., c, a]) / s
+            quat[3] = (m[..., b, c] - m[..., c, b]) / s
+        candidates.append(numpy.stack(quat, axis=-1))
+
+    choice = numpy.argmax(numpy.stack([trace, m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]], axis=-1), axis=-1)
+    quat = numpy.choose(choice[..., None], candidates)
+    return numpy.where(quat[..., 3:] < 0.0, -quat, quat)
+
+
+#### Float ####
+
+@_kernel(AddFloat)
+def _add(*args, **kwargs):
+    return sum(args[1:], args[0])
+
+
+@_kernel(SubtractFloat)
+def _subtract(*args, **kwargs):
+    return args[0] - sum(args[2:], args[1]) if len(args) > 1 else args[0]
+
+
+@_kernel(MultiplyFloat)
+def _multiply(input1=0.0, input2=1.0, **kwargs):
+    return input1 * input2
+
+
+@_kernel(DivideFloat)
+def _divide(input1=0.0, input2=1.0, **kwargs):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return input1 / input2
+
+
+@_kernel(Pow)
+def _pow(input=1.0, power=2.0, **kwargs):
+    with numpy.errstate(invalid='ignore'):
+        return numpy.power(input, power)
+
+
+@_kernel(Sqrt)
+def _sqrt(input=1.0, **kwargs):
+    with numpy.errstate(invalid='ignore'):
+        return numpy.power(input, 0.5)
+
+
+@_kernel(Abs)
+def _abs(input=-1.0, **kwargs):
+    # Squared then square rooted, like the node chain
+    return numpy.power(numpy.power(input, 2.0), 0.5)
+
+
+@_kernel(NegateFloat)
+def _negateFloat(input):
+    return input * -1.0
+
+
+@_kernel(FloatAverage)
+def _average(*args):
+    return sum(args[1:], args[0]) / float(len(args))
+
+
+@_kernel(Degrees)
+def _degrees(input):
+    return input * 57.2958
+
+
+@_kernel(Radians)
+def _radians(input):
+    return input * 0.0174533
+
+
+@_kernel(OneMinus)
+def _oneMinus(input):
+    return 1.0 - input
+
+
+@_kernel(Round)
+def _round(input):
+    return _toInteger(input)
+
+
+@_kernel(Floor)
+def _floor(input):
+    return _toInteger(input - 0.5)
+
+
+@_kernel(Ceil)
+def _ceil(input):
+    return _toInteger(input + 0.5)
+
+
+#### Trigonometry ####
+
+def _halfAngleQuaternion(input=0.0, degrees=False):
+    # The input is doubled into the x rotation of an eulerToQuat, whose x and w are then sin and cos
+    rotate = input * 2.0 if degrees else input * (2.0 * 57.2958)
+    return _axisQuaternion(0, rotate)
+
+
+@_kernel(Sin)
+def _sin(input=0.0, degrees=False):
+    return _halfAngleQuaternion(input, degrees)[..., 0]
+
+
+@_kernel(Cos)
+def _cos(input=0.0, degrees=False):
+    return _halfAngleQuaternion(input, degrees)[..., 3]
+
+
+@_kernel(Tan)
+def _tan(input=0.0, degrees=False):
+    quat = _halfAngleQuaternion(input, degrees)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return quat[..., 0] / quat[..., 3]
+
+
+KERNELS[HalfAngleQuaternion] = _halfAngleQuaternion
+
+
+@_kernel(SinCos)
+def _sinCos(input=0.0, degrees=False):
+    ''' Returns the outputs of a SinCos by attribute name. '''
+    quat = _halfAngleQuaternion(input, degrees)
+    return {'sin': quat[..., 0], 'cos': quat[..., 3]}
+
+
+#### Vector ####
+
+KERNELS[AddVector] = _add
+KERNELS[SubtractVector] = _subtract
+KERNELS[VectorAverage] = _average
+
+
+@_kernel(MultiplyFloatVector)
+def _multiplyFloatVector(inputFloat=2.0, inputVector=(1, 0, 0)):
+    return numpy.asarray(inputFloat)[..., None] * inputVector
+
+
+@_kernel(Dot)
+def _dotProduct(input1=(0, 1, 0), input2=(1, 0, 0)):
+    return _dot(numpy.asarray(input1), numpy.asarray(input2))
+
+
+@_kernel(Cross)
+def _cross(input1=(0, 1, 0), input2=(1, 0, 0), normalize=True):
+    cross = numpy.cross(input1, input2)
+    return _normal(cross) if normalize else cross
+
+
+@_kernel(VectorDistance)
+def _vectorDistance(input1=(0, 1, 0), input2=(0, 0, 0)):
+    return _length(numpy.asarray(input1) - input2)
+
+
+@_kernel(VectorNormalize)
+def _vectorNormalize(input=(0, 2, 0)):
+    return _normal(numpy.asarray(input))
+
+
+@_kernel(VectorNegate)
+def _vectorNegate(input):
+    return numpy.asarray(input) * -1.0
+
+
+@_kernel(Length)
+def _vectorLength(input=(1, 0, 0)):
+    return _length(numpy.asarray(input))
+
+
+#### Matrix ####
+
+@_kernel(ComposeMatrix)
+def _compose(translate=None, rotate=None, scale=None, quaternion=None, shear=None, rotateOrder=0,
+             useEulerRotation=True):
+
+    translate = numpy.zeros(3) if translate is None else numpy.asarray(translate)
+    scale = numpy.ones(3) if scale is None else numpy.asarray(scale)
+    shear = numpy.zeros(3) if shear is None else numpy.asarray(shear)
+
+    if useEulerRotation:
+        rotation = _eulerToMatrix(numpy.zeros(3) if rotate is None else numpy.asarray(rotate), rotateOrder)
+    else:
+        rotation = _quaternionToMatrix(numpy.array([0.0, 0.0, 0.0, 1.0]) if quaternion is None
+                                       else _normal(numpy.asarray(quaternion)))
+
+    scale, shear = numpy.broadcast_arrays(scale, shear)
+    scale_shear = numpy.zeros(scale.shape[:-1] + (3, 3))
+    scale_shear[..., 0, 0] = scale[..., 0]
+    scale_shear[..., 1, 0] = scale[..., 1] * shear[..., 0]
+    scale_shear[..., 1, 1] = scale[..., 1]
+    scale_shear[..., 2, 0] = scale[..., 2] * shear[..., 1]
+    scale_shear[..., 2, 1] = scale[..., 2] * shear[..., 2]
+    scale_shear[..., 2, 2] = scale[..., 2]
+
+    upper = numpy.matmul(scale_shear, rotation)
+
+    matrix = numpy.zeros(numpy.broadcast(translate[..., 0], upper[..., 0, 0]).shape + (4, 4))
+    matrix[..., :3, :3] = upper
+    matrix[..., 3, :3] = translate
+    matrix[..., 3, 3] = 1.0
+    return matrix
+
+
+@_kernel(DecomposeMatrix)
+def _decompose(input, rotateOrder=0):
+    ''' Returns the outputs of a decomposeMatrix by attribute name. '''
+
+    input = numpy.asarray(input)
+    rows = [input[..., i, :3] for i in range(3)]
+
+    scale_x = _length(rows[0])
+    axis_x = rows[0] / scale_x[..., None]
+
+    shear_xy = _dot(rows[1], axis_x)
+    row_y = rows[1] - shear_xy[..., None] * axis_x
+    scale_y = _length(row_y)
+    axis_y = row_y / scale_y[..., None]
+
+    shear_xz = _dot(rows[2], axis_x)
+    shear_yz = _dot(rows[2], axis_y)
+    row_z = rows[2] - shear_xz[..., None] * axis_x - shear_yz[..., None] * axis_y
+    scale_z = _length(row_z)
+    axis_z = row_z / scale_z[..., None]
+
+    scale = numpy.stack([scale_x, scale_y, scale_z], axis=-1)
+    rotation = numpy.stack([axis_x, axis_y, axis_z], axis=-2)
+
+    # Mirrored matrices are decomposed with a negative scale
+    flip = numpy.where(numpy.linalg.det(rotation) < 0.0, -1.0, 1.0)
+    scale = scale * flip[..., None]
+    rotation = rotation * flip[..., None, None]
+
+    return {
+        'translate': input[..., 3, :3],
+        'rotate': _matrixToEuler(rotation, rotateOrder),
+        'scale': scale,
+        'shear': numpy.stack([shear_xy / scale_y, shear_xz / scale_z, shear_yz / scale_z], axis=-1),
+        'quaternion': _matrixToQuaternion(rotation),
+        'rotateOrder': rotateOrder
+    }
+
+
+@_kernel(MultiplyMatrix)
+def _multiplyMatrix(*args, **kwargs):
+    matrix = args[0]
+    for arg in args[1:]:
+        matrix = numpy.matmul(matrix, arg)
+    return matrix
+
+
+KERNELS[AddMatrix] = _add
+
+
+@_kernel(MatrixDistance)
+def _matrixDistance(input1=_IDENTITY, input2=_IDENTITY):
+    return _length(_toArray(input1)[..., 3, :3] - _toArray(input2)[..., 3, :3])
+
+
+@_kernel(MultiplyVectorMatrix)
+def _multiplyVectorMatrix(inputVector=(1, 0, 0), inputMatrix=_IDENTITY):
+    vector = numpy.asarray(inputVector, dtype=float)[..., None, :]
+    return numpy.matmul(vector, _toArray(inputMatrix)[..., :3, :3])[..., 0, :]
+
+
+@_kernel(InverseMatrix)
+def _inverseMatrix(input):
+    return numpy.linalg.inv(input)
+
+
+@_kernel(Transpose)
+def _transpose(input):
+    return numpy.swapaxes(input, -1, -2)
+
+
+@_kernel(Matrix4x4)
+def _matrix4x4(*args):
+    return _stack(list(args))
+
+
+#### Quaternion ####
+
+KERNELS[AddQuaternion] = _add
+
+
+@_kernel(MultiplyQuaternion)
+def _multiplyQuaternion(input1, input2):
+    return _quaternionProduct(numpy.asarray(input1), numpy.asarray(input2))
+
+
+@_kernel(Conjugate)
+def _conjugate(input):
+    return numpy.asarray(input) * [-1.0, -1.0, -1.0, 1.0]
+
+
+@_kernel(InverseQuaternion)
+def _inverseQuaternion(input):
+    return _conjugate(input) / _dot(numpy.asarray(input), input)[..., None]
+
+
+@_kernel(QuaternionNegate)
+def _quaternionNegate(input):
+    return numpy.asarray(input) * -1.0
+
+
+@_kernel(QuaternionNormalize)
+def _quaternionNormalize(input):
+    return _normal(numpy.asarray(input))
+
+
+@_kernel(EulerToQuaternion)
+def _eulerToQuaternion(input, rotateOrder=0):
+    input = numpy.asarray(input)
+    quat = numpy.array([0.0, 0.0, 0.0, 1.0])
+    for axis in _rotateOrder(rotateOrder):
+        quat = _quaternionProduct(quat, _axisQuaternion(axis, input[..., axis]))
+    return quat
+
+
+@_kernel(QuaternionToEuler)
+def _quaternionToEuler(input, rotateOrder=0):
+    return _matrixToEuler(_quaternionToMatrix(_normal(numpy.asarray(input))), rotateOrder)
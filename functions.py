@@ -18,12 +18,15 @@ Challenges:
 # Log?
 
 
+import math
 import unittest
+from contextlib import contextmanager
 import pymel.core as pmc
 
 from general import *
 from datatypes import *
 import _factories
+import _backends
 
 #### OPERATIONS ####
 
@@ -63,74 +66,193 @@ class Inverse(object):
     def __new__(cls, *args, **kwargs):
         return _factories.getOperation('inverse', *args, **kwargs)
 
+class Operation(object):
+    ''' Runs any registered operation by name, see registerOperation(). '''
+    def __new__(cls, name, *args, **kwargs):
+        return _factories.getOperation(name, *args, **kwargs)
+
+class Batch(object):
+    '''
+    Runs a registered operation for each item of its inputs, returning a list of the results, for example:
+
+    twists = Batch('multiply', [joint.rx for joint in joints], weights)
+    matrices = Batch('compose', translate=numpy.zeros((200, 3)), rotate=rotations)
+
+    Lists, tuples and arrays hold one input per item, other inputs are shared by every item.
+    To share a literal vector or matrix, wrap it in DgData. The operation is resolved once for all items,
+    and outside batch() or deferred() the nodes are created together on one MDGModifier.
+    '''
+    def __new__(cls, name, *args, **kwargs):
+        if _factories.getGraph() is None and isinstance(_factories.getBackend(), _backends.PyMelBackend):
+            with batch():
+                return _factories.getBatchOperation(name, *args, **kwargs)
+        return _factories.getBatchOperation(name, *args, **kwargs)
+
+
+#### Literal Helpers ####
+# These mirror the node computations so operations on plain numbers can be folded in python.
+
+def _toInteger(value):
+    ''' Converts a float to an integer the way Maya does for integer attributes. '''
+    return int(math.copysign(math.floor(abs(value) + 0.5), value))
+
+def _vectorSum(vectors):
+    return tuple(sum(components) for components in zip(*vectors))
+
+def _vectorScale(vector, scale):
+    return tuple(component * scale for component in vector)
+
+def _vectorDot(vector1, vector2):
+    return sum(a * b for a, b in zip(vector1, vector2))
+
+def _vectorLength(vector):
+    return math.sqrt(_vectorDot(vector, vector))
+
+def _vectorNormal(vector):
+    return _vectorScale(vector, 1.0 / _vectorLength(vector))
+
+def _matrixProduct(matrix1, matrix2):
+    return tuple(sum(matrix1[row * 4 + i] * matrix2[i * 4 + column] for i in range(4))
+                 for row in range(4) for column in range(4))
+
+def _matrixTranspose(matrix):
+    return tuple(matrix[column * 4 + row] for row in range(4) for column in range(4))
+
+def _matrixInverse(matrix):
+    ''' Inverts a 4x4 matrix with Gauss-Jordan elimination. '''
+
+    rows = [[float(value) for value in matrix[i * 4:i * 4 + 4]] + [1.0 if i == j else 0.0 for j in range(4)]
+            for i in range(4)]
+
+    for column in range(4):
+        pivot = max(range(column, 4), key=lambda row: abs(rows[row][column]))
+        if rows[pivot][column] == 0.0:
+            raise ZeroDivisionError('Matrix is singular.')
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+
+        scale = rows[column][column]
+        rows[column] = [value / scale for value in rows[column]]
+
+        for row in range(4):
+            if row != column:
+                factor = rows[row][column]
+                rows[row] = [value - factor * pivot_value for value, pivot_value in zip(rows[row], rows[column])]
+
+    return tuple(value for row in rows for value in row[4:])
+
+def _quaternionProduct(quat1, quat2):
+    ''' Multiplies quaternions in Maya's order, so quat1's rotation is applied first. '''
+    x1, y1, z1, w1 = quat2
+    x2, y2, z2, w2 = quat1
+    return (w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2)
+
 
 #### Float ####
 
+def _channelInput(node, channel, index):
+    ''' Returns the input plug of a plusMinusAverage channel. '''
+    if channel == '1D':
+        return node.input1D[index]
+    return node.input3D[index].attr('input3D' + channel)
+
+def _channelOutput(node, channel):
+    ''' Returns the output plug of a plusMinusAverage channel. '''
+    if channel == '1D':
+        return node.output1D
+    return node.attr('output3D' + channel)
+
 class AddFloat(Float):
+    _fusion = 'all'
+
     def create(self, *args, **kwargs):
-        node = self.createNode('plusMinusAverage')
+        node, channel = self.createChannelNode('plusMinusAverage')
 
         for i, arg in enumerate(args):
-            self.connectInput(arg, node.input1D[i])
+            self.connectInput(arg, _channelInput(node, channel, i))
 
         input_attr = args if isinstance(args, list) else args[0]
         self.addAttribute('input', input_attr)
 
-        return node.output1D
+        return _channelOutput(node, channel)
+
+    @staticmethod
+    def compute(*args, **kwargs):
+        return float(sum(args))
 
 class SubtractFloat(Float):
+    _fusion = 'first'
 
     def create(self, *args, **kwargs):
-        node = self.createNode('plusMinusAverage')
-        node.operation.set(2)
+        node, channel = self.createChannelNode('plusMinusAverage', operation=2)
 
         for i, arg in enumerate(args):
-            self.connectInput(arg, node.input1D[i])
+            self.connectInput(arg, _channelInput(node, channel, i))
 
         input_attr = args if isinstance(args, list) else args[0]
         self.addAttribute('input', input_attr)
 
-        return node.output1D
+        return _channelOutput(node, channel)
+
+    @staticmethod
+    def compute(*args, **kwargs):
+        return float(args[0] - sum(args[1:]))
 
 class MultiplyFloat(Float):
+    _associative = True
 
     def create(self, input1=0.0, input2=1.0, **kwargs):
-        node = self.createNode('multiplyDivide')
+        node, axis = self.createChannelNode('multiplyDivide')
 
-        self.addAttribute('input1', node.input1X, input=input1)
-        self.addAttribute('input2', node.input2X, input=input2)
+        self.addAttribute('input1', node.attr('input1' + axis), input=input1)
+        self.addAttribute('input2', node.attr('input2' + axis), input=input2)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input1=0.0, input2=1.0, **kwargs):
+        return float(input1 * input2)
 
 class DivideFloat(Float):
     def create(self, input1=0.0, input2=1.0, **kwargs):
-        node = self.createNode('multiplyDivide')
-        node.operation.set(2)
+        node, axis = self.createChannelNode('multiplyDivide', operation=2)
 
-        self.addAttribute('input1', node.input1X, input=input1)
-        self.addAttribute('input2', node.input2X, input=input2)
+        self.addAttribute('input1', node.attr('input1' + axis), input=input1)
+        self.addAttribute('input2', node.attr('input2' + axis), input=input2)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input1=0.0, input2=1.0, **kwargs):
+        return float(input1) / input2
 
 class Pow(Float):
     def create(self, input=1, power=2.0, **kwargs):
-        node = self.createNode('multiplyDivide')
-        node.operation.set(3)
+        node, axis = self.createChannelNode('multiplyDivide', operation=3)
 
-        self.addAttribute('input', node.input1X, input=input)
-        self.addAttribute('power', node.input2X, input=power)
+        self.addAttribute('input', node.attr('input1' + axis), input=input)
+        self.addAttribute('power', node.attr('input2' + axis), input=power)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input=1, power=2.0, **kwargs):
+        return float(input) ** power
 
 class Sqrt(Float):
     def create(self, input=1, **kwargs):
-        node = self.createNode('multiplyDivide')
-        node.operation.set(3)
-        node.input2X.set(0.5)
+        node, axis = self.createChannelNode('multiplyDivide', operation=3)
+        node.attr('input2' + axis).set(0.5)
 
-        self.addAttribute('input', node.input1X, input=input)
+        self.addAttribute('input', node.attr('input1' + axis), input=input)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input=1, **kwargs):
+        return float(input) ** 0.5
 
 class Abs(Float):
     def create(self, input=-1, **kwargs):
@@ -148,60 +270,83 @@ class Abs(Float):
 
         return sqrt.outputX
 
+    @staticmethod
+    def compute(input=-1, **kwargs):
+        return float(abs(input))
+
 class NegateFloat(Float):
 
     def create(self, input):
-        node = self.createNode('multiplyDivide')
-        node.input2X.set(-1)
+        node, axis = self.createChannelNode('multiplyDivide')
+        node.attr('input2' + axis).set(-1)
 
-        self.addAttribute('input', node.input1X, input=input)
+        self.addAttribute('input', node.attr('input1' + axis), input=input)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input):
+        return float(-input)
 
 class FloatAverage(Float):
 
     def create(self, *args):
-        node = self.createNode('plusMinusAverage')
-        node.operation.set(3)
+        # Averages divide by the number of inputs, so only equally sized averages can share a node
+        node, channel = self.createChannelNode('plusMinusAverage', operation=3, size=len(args))
 
         for i, arg in enumerate(args):
-            self.connectInput(arg, node.input1D[i])
+            self.connectInput(arg, _channelInput(node, channel, i))
 
         input_attr = args if isinstance(args, list) else args[0]
         self.addAttribute('input', input_attr)
 
-        return node.output1D
+        return _channelOutput(node, channel)
+
+    @staticmethod
+    def compute(*args):
+        return float(sum(args)) / len(args)
 
 class Degrees(Float):
 
     def create(self, input):
-        node = self.createNode('multiplyDivide')
-        node.input2X.set(57.2958)
+        node, axis = self.createChannelNode('multiplyDivide')
+        node.attr('input2' + axis).set(57.2958)
 
-        self.addAttribute('input', node.input1X, input=input)
+        self.addAttribute('input', node.attr('input1' + axis), input=input)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input):
+        return input * 57.2958
 
 class Radians(Float):
     def create(self, input):
-        node = self.createNode('multiplyDivide')
-        node.input2X.set(0.0174533)
+        node, axis = self.createChannelNode('multiplyDivide')
+        node.attr('input2' + axis).set(0.0174533)
 
-        self.addAttribute('input', node.input1X, input=input)
+        self.addAttribute('input', node.attr('input1' + axis), input=input)
 
-        return node.outputX
+        return node.attr('output' + axis)
+
+    @staticmethod
+    def compute(input):
+        return input * 0.0174533
 
 class OneMinus(Float):
     def create(self, input):
-        node = self.createNode('plusMinusAverage')
-        node.operation.set(2)
-        node.input1D[0].set(1.0)
+        node, channel = self.createChannelNode('plusMinusAverage', operation=2)
+        _channelInput(node, channel, 0).set(1.0)
 
-        self.connectInput(input, node.input1D[1])
+        self.connectInput(input, _channelInput(node, channel, 1))
 
         self.addAttribute('input', input)
 
-        return node.output1D
+        return _channelOutput(node, channel)
+
+    @staticmethod
+    def compute(input):
+        return 1.0 - input
 
 class Round(Float):
     def create(self, input):
@@ -211,6 +356,10 @@ class Round(Float):
         self.addAttribute('input', node.integer, input)
         return node.integer
 
+    @staticmethod
+    def compute(input):
+        return float(_toInteger(input))
+
 class Floor(Float):
     def create(self, input):
         add = self.createNode('plusMinusAverage')
@@ -223,6 +372,10 @@ class Floor(Float):
 
         return node.integer
 
+    @staticmethod
+    def compute(input):
+        return float(_toInteger(input - 0.5))
+
 class Ceil(Float):
     def create(self, input):
         add = self.createNode('plusMinusAverage')
@@ -235,10 +388,19 @@ class Ceil(Float):
 
         return node.integer
 
+    @staticmethod
+    def compute(input):
+        return float(_toInteger(input + 0.5))
+
 
 #### TRIGONOMETRY ####
 
-class Sin(Float):
+class HalfAngleQuaternion(Quaternion):
+    '''
+    The rotation around x by twice the input angle, its x and w are the sine and cosine of the input.
+    With options(cse=True), Sin, Cos, Tan and SinCos of the same angle share one of these, see
+    _getHalfAngleQuaternion().
+    '''
 
     def create(self, input=0.0, degrees=False):
 
@@ -255,55 +417,77 @@ class Sin(Float):
         quat_node = self.createNode('eulerToQuat')
         mult_node.outputX.connect(quat_node.inputRotateX)
 
-        return quat_node.outputQuatX
+        return quat_node.outputQuat
 
-class Cos(Float):
+    @staticmethod
+    def compute(input=0.0, degrees=False):
+        return (Sin.compute(input, degrees), 0.0, 0.0, Cos.compute(input, degrees))
 
-    def create(self, input=0.0, degrees=False):
 
-        mult_node = self.createNode('multiplyDivide')
+def _getHalfAngleQuaternion(owner, input, degrees):
+    ''' Returns the HalfAngleQuaternion for the input angle, shared through the memo table with options(cse=True). '''
+    return _factories.buildOperation(HalfAngleQuaternion, [input], {'degrees': bool(degrees), 'name': owner.name()})
 
-        if degrees:
-            mult_node.input1X.set(2.0)
-        else:
-            mult_node.input1X.set(2.0 * 57.2958)
+class Sin(Float):
 
-        self.connectInput(input, mult_node.input2X)
+    def create(self, input=0.0, degrees=False):
+        quaternion = _getHalfAngleQuaternion(self, input, degrees)
         self.addAttribute('input', input)
+        return quaternion[0]
 
-        quat_node = self.createNode('eulerToQuat')
-        mult_node.outputX.connect(quat_node.inputRotateX)
-
-        return quat_node.outputQuatW
+    @staticmethod
+    def compute(input=0.0, degrees=False):
+        return math.sin(math.radians(input if degrees else input * 57.2958))
 
-class Tan(Float):
+class Cos(Float):
 
     def create(self, input=0.0, degrees=False):
+        quaternion = _getHalfAngleQuaternion(self, input, degrees)
+        self.addAttribute('input', input)
+        return quaternion[3]
 
-        mult_node = self.createNode('multiplyDivide')
+    @staticmethod
+    def compute(input=0.0, degrees=False):
+        return math.cos(math.radians(input if degrees else input * 57.2958))
 
-        if degrees:
-            mult_node.input1X.set(2.0)
-        else:
-            mult_node.input1X.set(2.0 * 57.2958)
+class Tan(Float):
 
-        self.connectInput(input, mult_node.input2X)
+    def create(self, input=0.0, degrees=False):
+        quaternion = _getHalfAngleQuaternion(self, input, degrees)
         self.addAttribute('input', input)
 
-        quat_node = self.createNode('eulerToQuat')
-        mult_node.outputX.connect(quat_node.inputRotateX)
-
         divide_node = self.createNode('multiplyDivide')
         divide_node.operation.set(2)
-        quat_node.outputQuatX.connect(divide_node.input1X)
-        quat_node.outputQuatW.connect(divide_node.input2X)
+        quaternion[0].connect(divide_node.input1X)
+        quaternion[3].connect(divide_node.input2X)
 
         return divide_node.outputX
 
+    @staticmethod
+    def compute(input=0.0, degrees=False):
+        return Sin.compute(input, degrees) / Cos.compute(input, degrees)
+
+class SinCos(DgArray):
+    _outputs = {
+        'sin': Float,
+        'cos': Float
+    }
+
+    def create(self, input=0.0, degrees=False):
+        quaternion = _getHalfAngleQuaternion(self, input, degrees)
+        self.addAttribute('input', input)
+
+        self.addAttribute('sin', quaternion[0])
+        self.addAttribute('cos', quaternion[3])
+
+        return [quaternion[0], quaternion[3]]
+
 
 #### VECTOR MATH ####
 
 class AddVector(Vector):
+    _fusion = 'all'
+
     def create(self, *args, **kwargs):
         node = self.createNode('plusMinusAverage')
 
@@ -315,7 +499,13 @@ class AddVector(Vector):
 
         return node.output3D
 
+    @staticmethod
+    def compute(*args, **kwargs):
+        return _vectorSum(args)
+
 class SubtractVector(Vector):
+    _fusion = 'first'
+
     def create(self, *args, **kwargs):
         node = self.createNode('plusMinusAverage')
         node.operation.set(2)
@@ -328,6 +518,10 @@ class SubtractVector(Vector):
 
         return node.output3D
 
+    @staticmethod
+    def compute(*args, **kwargs):
+        return _vectorSum([args[0]] + [_vectorScale(arg, -1.0) for arg in args[1:]])
+
 class MultiplyFloatVector(Vector):
 
     def create(self, inputFloat=2.0, inputVector=(1,0,0)):
@@ -338,6 +532,10 @@ class MultiplyFloatVector(Vector):
 
         return node.output
 
+    @staticmethod
+    def compute(inputFloat=2.0, inputVector=(1,0,0)):
+        return _vectorScale(inputVector, inputFloat)
+
 class Dot(Float):
 
     def create(self, input1=(0,1,0), input2=(1,0,0)):
@@ -349,6 +547,10 @@ class Dot(Float):
 
         return node.outputX
 
+    @staticmethod
+    def compute(input1=(0,1,0), input2=(1,0,0)):
+        return float(_vectorDot(input1, input2))
+
 class Cross(Vector):
     def create(self, input1=(0,1,0), input2=(1,0,0), normalize=True):
         node = self.createNode('vectorProduct')
@@ -360,6 +562,13 @@ class Cross(Vector):
 
         return node.output
 
+    @staticmethod
+    def compute(input1=(0,1,0), input2=(1,0,0), normalize=True):
+        x1, y1, z1 = input1
+        x2, y2, z2 = input2
+        cross = (y1 * z2 - z1 * y2, z1 * x2 - x1 * z2, x1 * y2 - y1 * x2)
+        return _vectorNormal(cross) if normalize else cross
+
 class VectorDistance(Float):
 
     def create(self, input1=(0,1,0), input2=(0,0,0)):
@@ -370,6 +579,10 @@ class VectorDistance(Float):
 
         return node.distance
 
+    @staticmethod
+    def compute(input1=(0,1,0), input2=(0,0,0)):
+        return _vectorLength(_vectorSum([input1, _vectorScale(input2, -1.0)]))
+
 class VectorAverage(Vector):
 
     def create(self, *args):
@@ -384,6 +597,10 @@ class VectorAverage(Vector):
 
         return node.output3D
 
+    @staticmethod
+    def compute(*args):
+        return _vectorScale(_vectorSum(args), 1.0 / len(args))
+
 class VectorNormalize(Vector):
     def create(self, input=(0,2,0)):
         node = self.createNode('vectorProduct')
@@ -394,6 +611,10 @@ class VectorNormalize(Vector):
 
         return node.output
 
+    @staticmethod
+    def compute(input=(0,2,0)):
+        return _vectorNormal(input)
+
 class VectorNegate(Vector):
 
     def create(self, input):
@@ -403,6 +624,10 @@ class VectorNegate(Vector):
 
         return node.output
 
+    @staticmethod
+    def compute(input):
+        return _vectorScale(input, -1.0)
+
 class Length(Float):
     def create(self, input=(1,0,0)):
         node = self.createNode('distanceBetween')
@@ -412,6 +637,10 @@ class Length(Float):
 
         return node.distance
 
+    @staticmethod
+    def compute(input=(1,0,0)):
+        return _vectorLength(input)
+
 
 #### MATRIX MATH ####
 
@@ -439,6 +668,7 @@ class ComposeMatrix(Matrix):
         return node.outputMatrix
 
 class MultiplyMatrix(Matrix):
+    _fusion = 'all'
 
     def create(self, *args, **kwargs):
         node = self.createNode('multMatrix')
@@ -450,7 +680,13 @@ class MultiplyMatrix(Matrix):
 
         return node.matrixSum
 
+    @staticmethod
+    def compute(*args, **kwargs):
+        return reduce(_matrixProduct, args)
+
 class AddMatrix(Matrix):
+    _fusion = 'all'
+
     def create(self, *args, **kwargs):
         node = self.createNode('addMatrix')
 
@@ -461,6 +697,10 @@ class AddMatrix(Matrix):
 
         return node.matrixSum
 
+    @staticmethod
+    def compute(*args, **kwargs):
+        return _vectorSum(args)
+
 class MatrixDistance(Float):
 
     def create(self, input1=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1),
@@ -472,7 +712,20 @@ class MatrixDistance(Float):
 
         return node.distance
 
+    @staticmethod
+    def compute(input1=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1),
+                input2=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1)):
+        return VectorDistance.compute(input1[12:15], input2[12:15])
+
 class DecomposeMatrix(Vector):
+    _outputs = {
+        'translate': Vector,
+        'rotate': Vector,
+        'scale': Vector,
+        'quaternion': Quaternion,
+        'shear': Vector,
+        'rotateOrder': Float
+    }
 
     def create(self, input, rotateOrder=0):
 
@@ -484,7 +737,7 @@ class DecomposeMatrix(Vector):
         self.addAttribute('scale', node.outputScale)
         self.addAttribute('quaternion', node.outputQuat)
         self.addAttribute('shear', node.outputShear)
-        self.addAttribute('rotateOrder', node.inputRotateOrder)
+        self.addAttribute('rotateOrder', node.inputRotateOrder, rotateOrder)
 
         return [node.outputTranslate, node.outputRotate, node.outputScale]
 
@@ -498,18 +751,30 @@ class MultiplyVectorMatrix(Vector):
 
         return node.output
 
+    @staticmethod
+    def compute(inputVector=(1,0,0), inputMatrix=(1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1)):
+        return tuple(sum(inputVector[i] * inputMatrix[i * 4 + column] for i in range(3)) for column in range(3))
+
 class InverseMatrix(Matrix):
     def create(self, input):
         node = self.createNode('inverseMatrix')
         self.addAttribute('input', node.inputMatrix, input)
         return node.outputMatrix
 
+    @staticmethod
+    def compute(input):
+        return _matrixInverse(input)
+
 class Transpose(Matrix):
     def create(self, input):
         node = self.createNode('transposeMatrix')
         self.addAttribute('input', node.inputMatrix, input)
         return node.outputMatrix
 
+    @staticmethod
+    def compute(input):
+        return _matrixTranspose(input)
+
 class Matrix4x4(Matrix):
 
     def create(self, *args):
@@ -528,47 +793,82 @@ class Matrix4x4(Matrix):
 
         return node.output
 
+    @staticmethod
+    def compute(*args):
+        if len(args) != 16:
+            raise ValueError('Matrix4x4 requires exactly 16 float inputs')
+        return tuple(float(arg) for arg in args)
+
 
 #### Quaternion MATH ####
 
 class AddQuaternion(Quaternion):
+    _associative = True
+
     def create(self, input1, input2):
         node = self.createNode('quatAdd')
         self.addAttribute('input1', node.input1Quat, input1)
         self.addAttribute('input2', node.input2Quat, input2)
         return node.outputQuat
 
+    @staticmethod
+    def compute(input1, input2):
+        return _vectorSum([input1, input2])
+
 class MultiplyQuaternion(Quaternion):
+    _associative = True
+
     def create(self, input1, input2):
         node = self.createNode('quatProd')
         self.addAttribute('input1', node.input1Quat, input1)
         self.addAttribute('input2', node.input2Quat, input2)
         return node.outputQuat
 
+    @staticmethod
+    def compute(input1, input2):
+        return _quaternionProduct(input1, input2)
+
 class InverseQuaternion(Quaternion):
     def create(self, input):
         node = self.createNode('quatInvert')
         self.addAttribute('input1', node.inputQuat, input)
         return node.outputQuat
 
+    @staticmethod
+    def compute(input):
+        return _vectorScale(Conjugate.compute(input), 1.0 / _vectorDot(input, input))
+
 class Conjugate(Quaternion):
     def create(self, input):
         node = self.createNode('quatConjugate')
         self.addAttribute('input1', node.inputQuat, input)
         return node.outputQuat
 
+    @staticmethod
+    def compute(input):
+        x, y, z, w = input
+        return (-x, -y, -z, w)
+
 class QuaternionNegate(Quaternion):
     def create(self, input):
         node = self.createNode('quatNegate')
         self.addAttribute('input1', node.inputQuat, input)
         return node.outputQuat
 
+    @staticmethod
+    def compute(input):
+        return _vectorScale(input, -1.0)
+
 class QuaternionNormalize(Quaternion):
     def create(self, input):
         node = self.createNode('quatNormalize')
         self.addAttribute('input1', node.inputQuat, input)
         return node.outputQuat
 
+    @staticmethod
+    def compute(input):
+        return _vectorNormal(input)
+
 class EulerToQuaternion(Quaternion):
     def create(self, input, rotateOrder=0):
         node = self.createNode('eulerToQuat')
@@ -651,6 +951,28 @@ __functions__ = {
 }
 
 
+def registerOperation(name, operation, signature=None):
+    '''
+    Adds an operation to the function directory, for example:
+
+    registerOperation('lerp', LerpFloat, 'float')
+    Operation('lerp', 0.0, 10.0, 0.5)
+
+    :param name: The name the operation is dispatched by.
+    :param operation: The DgData subclass that builds the operation.
+    :param signature: The type name, or tuple of type names, it handles. None handles any input.
+    '''
+
+    if signature is None:
+        __functions__[name] = operation
+    else:
+        if not isinstance(__functions__.get(name), dict):
+            __functions__[name] = {}
+        __functions__[name][signature] = operation
+
+    _factories.getDispatcher().register(name, operation, signature)
+
+
 #### TESTS ####
 
 class DataTypeTests(unittest.TestCase):
@@ -742,6 +1064,153 @@ class DataTypeTests(unittest.TestCase):
         self.assertEquals(Floor(0.5).get(), 0.0)
         self.assertEquals(Ceil(0.5).get(), 1.0)
 
+    def test_types(self):
+        loc = pmc.spaceLocator()
+        self.assertIs(_factories.getDgDataType(loc.translate), Vector)
+        self.assertIs(_factories.getDgDataType(loc.worldMatrix), Matrix)
+        self.assertIs(_factories.getDgDataType([0.0, 1.0, 0.0, 1.0]), Quaternion)
+
+        name = loc.translate.name()
+        pmc.delete(loc)
+        self.assertRaises(TypeError, _factories.getDgDataType, name)
+
+    def test_dispatch(self):
+        with options(fold=True):
+            self.assertEquals(Multiply(2.0, [1.0, 0.0, 0.0]).get(), (2.0, 0.0, 0.0))
+            self.assertEquals(Multiply([1.0, 0.0, 0.0], 2.0).get(), (2.0, 0.0, 0.0))
+
+        import copy
+        previous = copy.deepcopy(__functions__)
+        try:
+            registerOperation('oneMinus', OneMinus)
+            with options(fold=True):
+                self.assertEquals(Operation('oneMinus', 0.25).get(), 0.75)
+        finally:
+            __functions__.clear()
+            __functions__.update(previous)
+            _factories._dispatcher = None
+
+        self.assertRaises(ValueError, Operation, 'oneMinus', 0.25)
+
+    def test_fold(self):
+        with options(fold=True):
+            self.assertEquals(Add(1.0, 2.0).data(), 3.0)
+            self.assertEquals(Operation('radians', Operation('degrees', 1.0)).isAttr(), False)
+            self.assertEquals(Add(Constant(1.0), 2.0).isAttr(), True)
+
+        self.assertEquals(Add(1.0, 2.0).isAttr(), True)
+
+    def test_foldValues(self):
+        with options(fold=True):
+            self.assertEquals(Add(1.0, 2.0, -1.0, 4.0).get(), 6.0)
+            self.assertEquals(Subtract([0.0,1.0,0.0], [1.0,0.0,1.0]).get(), (-1.0,1.0,-1.0))
+            self.assertEquals(Multiply([1, 0, 0], [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]).get(), (1, 0, 0))
+            self.assertEquals(Divide(2.0, 4.0).get(), 0.5)
+            self.assertEquals(Operation('pow', 2.0).get(), 4.0)
+            self.assertEquals(Negate([1.0, 1.0, 1.0]).get(), (-1.0,-1.0,-1.0))
+            self.assertEquals(Average([0,1,0], [1,0,1]).get(), (0.5,0.5,0.5))
+            self.assertAlmostEquals(Operation('radians', 90.0).get(), 1.5708, places=3)
+            self.assertEquals(Operation('cross', [0.0,1.0,0.0], [1.0,0.0,0.0]).get(), (0.0,0.0,-1.0))
+            self.assertEquals(Normalize([0, 5, 0]).get(), (0, 1, 0))
+            self.assertEquals(Operation('ceil', 0.5).get(), 1.0)
+
+            for result in [Add(1.0, 2.0), Operation('cross', [0.0,1.0,0.0], [1.0,0.0,0.0]), Operation('round', 0.5)]:
+                self.assertEquals(result.isAttr(), False)
+
+        # Operation classes always build their node
+        self.assertEquals(Round(0.5).isAttr(), True)
+
+    def test_memo(self):
+        loc1 = pmc.spaceLocator()
+        loc2 = pmc.spaceLocator()
+
+        with options(cse=True):
+            distance = Distance(loc1.translate, loc2.translate)
+            self.assertIs(Distance(loc1.translate, loc2.translate), distance)
+
+            with memoScope():
+                self.assertIsNot(Distance(loc1.translate, loc2.translate), distance)
+
+            pmc.delete(distance.data().node())
+            self.assertIsNot(Distance(loc1.translate, loc2.translate), distance)
+
+        self.assertIsNot(Distance(loc1.translate, loc2.translate), Distance(loc1.translate, loc2.translate))
+
+    def test_packing(self):
+        loc = pmc.spaceLocator()
+        loc.rotate.set([90.0, 180.0, 270.0])
+
+        with packing() as allocator:
+            x = Radians(loc.rx)
+            y = Radians(loc.ry)
+            z = Radians(loc.rz)
+            doubled = Multiply(x, 2.0)
+
+        self.assertEquals(x.data().node(), z.data().node())
+        self.assertNotEquals(x.data().node(), doubled.data().node())
+        self.assertEquals(allocator.nodeCount, 2)
+        self.assertAlmostEquals(y.get(), 3.14159, places=3)
+
+    def test_benchmarks(self):
+        import benchmarks
+
+        first = benchmarks.run(sizes=[20], datatypes=['vector'], evaluation=False)['results'][0]
+        second = benchmarks.run(sizes=[20], datatypes=['vector'], evaluation=False)['results'][0]
+
+        self.assertEquals(first['name'], 'build.vector.20')
+        self.assertGreater(first['nodes'], 20)
+        self.assertEquals(first['nodeTypes'], second['nodeTypes'])
+        self.assertEquals(first['connections'], second['connections'])
+
+    def test_deferred(self):
+        with deferred() as graph:
+            angle = Radians(Add(1.0, 2.0))
+            Degrees(angle)
+            translate = Constant([1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1]).translate()
+
+            self.assertTrue(angle.isPending())
+            self.assertRaises(RuntimeError, angle.get)
+            self.assertEquals(len(graph.liveExpressions()), 5)
+
+        self.assertFalse(angle.isPending())
+        self.assertIsInstance(angle, Float)
+        self.assertAlmostEquals(angle.get(), 0.05236, places=4)
+        self.assertEquals(translate.get(), (0, 0, 0))
+
+    def test_batchUnits(self):
+        # Batched connections convert angles and distances like the connections made in the scene
+        loc = pmc.spaceLocator()
+        loc.rotate.set([30.0, 0.0, 0.0])
+        loc.translate.set([2.0, 0.0, 0.0])
+
+        values = []
+        for build in [memoScope, batch]:
+            with build():
+                angle = Add(loc.rx, 1.0)
+                product = Multiply(loc.rx, loc.tx)
+                vector = Add(loc.rotate, loc.translate)
+            values.append((angle.get(), product.get(), vector.get()))
+
+        self.assertAlmostEquals(values[0][0], 31.0, places=4)
+        self.assertAlmostEquals(values[1][0], values[0][0], places=4)
+        self.assertAlmostEquals(values[1][1], values[0][1], places=4)
+        for batched, built in zip(values[1][2], values[0][2]):
+            self.assertAlmostEquals(batched, built, places=4)
+
+    def test_evaluate(self):
+        import evaluate
+        if evaluate.numpy is None:
+            self.skipTest('numpy is not available')
+
+        with deferred() as graph:
+            angle = evaluate.variable('angle')
+            height = Multiply(Sin(angle, degrees=True), 2.0)
+            values = evaluate.evaluate(height, {'angle': [0.0, 30.0, 90.0]})
+            graph.discard()
+
+        self.assertEquals(values.shape, (3,))
+        self.assertAlmostEquals(values[1], 1.0, places=5)
+        self.assertTrue(height.isPending())
 
     def test_decompose(self):
         loc = pmc.spaceLocator()
@@ -753,5 +1222,527 @@ class DataTypeTests(unittest.TestCase):
         self.assertEquals(Decompose(loc.worldMatrix).rotate.get(), (90,90,90))
         self.assertEquals(Decompose(loc.worldMatrix).scale.get(), (1,2,3))
 
+
+class StandinTests(unittest.TestCase):
+    ''' Builds on the scene of the standin module, these tests do not need Maya. '''
+
+    def setUp(self):
+        import standin
+        self.standin = standin
+        self.standin.reset()
+
+    @contextmanager
+    def build(self, **kwargs):
+        ''' Builds on the stand-in with the options, sharing operations only within the block. '''
+        with options(**kwargs), memoScope(), batch(api=self.standin) as backend:
+            yield backend
+
+    def test_genericPlugTypes(self):
+        # Generic plugs take the type of their current source
+        with self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            conversion = backend.createNode('unitConversion', 'conversion')
+            backend.connect(arm.translate, conversion.input)
+            self.assertIs(_factories.getDgDataType(conversion.input), Vector)
+            backend.connect(arm.translateX, conversion.input)
+            self.assertIs(_factories.getDgDataType(conversion.input), Float)
+
+    def test_balance(self):
+        import analysis
+
+        with self.build(balance=True, provenance=True), deferred():
+            product = Constant(1.0)
+            for i in range(7):
+                product = product * Constant(i + 2.0)
+            self.assertEquals(analysis.analyze(product).depth, 7)
+
+        self.assertEquals(self.standin.scene.nodeTypes()['multiplyDivide'], 7)
+        self.assertEquals(analysis.analyze(product).depth, 3)
+        self.assertEquals(analysis.analyze(product).width, 4)
+
+    def test_simplify(self):
+        import simplify
+
+        with self.build():
+            value = Add(1.0, 2.0)
+            self.assertIs(Multiply(value, 1.0), value)
+            self.assertIs(Subtract(value, 0.0), value)
+            self.assertIs(Add(0.0, value), value)
+
+        self.assertEquals(len(self.standin.scene.nodes), 1)
+        self.standin.reset()
+
+        matrix = [0, 1, 0, 0, -1, 0, 0, 0, 0, 0, 1, 0, 1, 2, 3, 1]
+        with self.build(), deferred():
+            value = Add(1.0, 2.0)
+            point = Constant((1.0, 2.0, 3.0))
+            transform = Constant(matrix)
+            self.assertIs(Negate(Negate(value)), value)
+            self.assertIs(Inverse(Inverse(transform)), transform)
+            self.assertIs(Operation('transpose', Operation('transpose', transform)), transform)
+            product = Multiply(Negate(Negate(point)), Multiply(transform, simplify.IDENTITY_MATRIX))
+
+        self.assertEquals(self.standin.scene.nodeTypes().get('multiplyDivide', 0), 0)
+        self.assertEquals(self.standin.scene.nodeTypes().get('inverseMatrix', 0), 0)
+        self.assertEquals(self.standin.scene.nodeTypes().get('transposeMatrix', 0), 0)
+        self.standin.reset()
+
+        with self.build():
+            transform = Constant(matrix)
+            product = Multiply(transform, matrix, matrix, matrix, matrix)
+            with options(simplify=False):
+                Multiply(transform, matrix, matrix)
+
+        self.assertEquals(self.standin.scene.nodeTypes()['multMatrix'], 2)
+        self.assertEquals(self.standin.scene.connectionCount(), 2)
+        with options(fold=True):
+            args = _factories.simplifyOperation(MultiplyMatrix, (transform, matrix, matrix))
+        self.assertEquals(args[1], [-1, 0, 0, 0, 0, -1, 0, 0, 0, 0, 1, 0, -1, 3, 6, 1])
+
+    def test_sweep(self):
+        _factories._ownedNodes.clear()
+
+        with self.build(optimize=False) as backend:
+            untracked = Add(7.0, 8.0)
+
+        with self.build(optimize=False, track=True) as backend:
+            target = backend.createNode('transform', 'target')
+            used = Radians(Add(1.0, 2.0))
+            used.connect(target.rotate.rotateX)
+            unused = Abs(Add(3.0, 4.0))
+            kept = Add(5.0, 6.0)
+
+        self.assertEquals(len(unused.nodes()), 2)
+        self.assertEquals(_factories.getOwners(unused.nodes()[0]), ['Abs'])
+        self.assertEquals(_factories.getOwners(target), [])
+        self.assertEquals(_factories.getOwners(untracked.nodes()[0]), [])
+
+        nodeCount = len(self.standin.scene.nodes)
+        deleted = sweep(keep=kept)
+        self.assertEquals(len(deleted), 3)
+        self.assertEquals(len(self.standin.scene.nodes), nodeCount - 3)
+        self.assertEquals(sweep(), [kept.nodes()[0].name()])
+        self.assertEquals(sweep(), [])
+
+    def test_pooling(self):
+        with self.build(), pooling(share=True) as pool:
+            scale = Constant(5.0)
+            shared = Constant(5.0)
+            offset = Constant(2.0)
+            point = Constant([1.0, 2.0, 3.0])
+            result = Add(scale, offset)
+
+        self.assertEquals(self.standin.scene.nodeTypes()['network'], 2)
+        self.assertEquals(pool.constantCount, 3)
+        self.assertEquals(scale.data(), shared.data())
+        self.assertEquals(offset.data().name(), scale.data().node().name() + '.constant[1]')
+        self.assertEquals(offset.get(), 2.0)
+        self.assertEquals(point.get(), (1.0, 2.0, 3.0))
+        self.assertEquals(self.standin.scene.connectionCount(), 2)
+
+    def test_constant(self):
+        with self.build():
+            single = Constant(2.0)
+            point = Constant([1.0, 2.0, 3.0])
+
+        self.assertEquals(single.get(), 2.0)
+        self.assertEquals(point.get(), (1.0, 2.0, 3.0))
+
+        with self.build(), pooling():
+            pooled = Constant(2.0)
+
+        self.assertEquals(pooled.get(), 2.0)
+
+    def test_plugTypes(self):
+        with self.build() as backend:
+            total = Add(1.0, 2.0)
+            point = Constant([1.0, 2.0, 3.0])
+            transform = Constant([1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1])
+            wrapped = DgData(backend.createNode('transform', 'target').translate)
+
+        for data, type in [(total, Float), (point, Vector), (transform, Matrix)]:
+            self.assertIs(data.data().__dict__['_dgDataType'], type)
+            self.assertIs(_factories.getPlugType(data.data()), type)
+        self.assertNotIn('_dgDataType', wrapped.data().__dict__)
+
+    def test_getValues(self):
+        with self.build() as backend, pooling():
+            scale = Constant(2.0)
+            point = Constant([1.0, 2.0, 3.0])
+            rotation = Constant([0.0, 0.0, 0.0, 1.0])
+            target = backend.createNode('transform', 'target')
+            backend.setAttr(target.translate.translateX, 5.0)
+
+        self.assertEquals(getValues([scale, point, 4.0, rotation]), [2.0, 1.0, 2.0, 3.0, 4.0, 0.0, 0.0, 0.0, 1.0])
+        self.assertEquals(getValues([DgData(target.translate.translateX)]), [5.0])
+        self.assertEquals(target.translate.translateX.get(), 5.0)
+        self.assertEquals(len(point), 3)
+        self.assertIs(point.children(), point.children())
+        self.assertEquals(point[1].get(), 2.0)
+
+    def test_planConnection(self):
+        matrix = [0, 1, 0, 0, -1, 0, 0, 0, 0, 0, 1, 0, 1, 2, 3, 1]
+
+        with self.build() as backend:
+            node = backend.createNode('vectorProduct', 'product')
+            scale = Add(1.0, 2.0)
+            plan = _factories.planConnection([1.0, 2.0, 3.0], node.input1)
+            self.assertEquals(plan, [('set', node.input1, [1.0, 2.0, 3.0])])
+            plan = _factories.planConnection([scale, 2.0, scale], node.input2)
+            self.assertEquals([edit for edit, plug, value in plan], ['connect', 'set', 'connect'])
+            self.assertEquals(len(_factories.planConnection(matrix, node.matrix)), 1)
+            _factories.addConnection(matrix, node.matrix)
+
+        self.assertEquals(node.matrix.get(), tuple(matrix))
+
+    def test_compiler(self):
+        import compiler
+
+        with self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            hand = backend.createNode('transform', 'hand')
+            self.assertIs(type(compiler.compileExpression('arm.translate * 2 + <<1, 0, 0>>')), AddVector)
+            self.assertIs(type(compiler.compileExpression('arm.translate * hand.translate')), Dot)
+            self.assertIs(type(compiler.compileExpression('-(arm.translate ^ hand.translate)')), VectorNegate)
+            results = compiler.compileStatements('hand.translateZ = sin(arm.rotateX) * 2 + arm.translateY;'
+                                                 'hand.translateY = -arm.translateX * 1;')
+
+        self.assertIs(type(results['hand.translateZ']), AddFloat)
+        self.assertIs(type(results['hand.translateY']), NegateFloat)
+        self.assertEquals(hand.translate.translateZ.plug().source().name(), results['hand.translateZ'].data().name())
+        with options(fold=True):
+            self.assertEquals(compiler.compileExpression('2 ** 3 ** 2 - -1').get(), 513.0)
+        self.assertRaises(ValueError, compiler.compileExpression, '1 +')
+        self.assertRaises(ValueError, compiler.compileExpression, 'foo(1)')
+
+    def test_templates(self):
+        import templates
+
+        @templates.dgfunction
+        def blend(first, second, weight=0.5):
+            return Add(Multiply(first, 1 - weight), Multiply(second, weight))
+
+        with self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            hand = backend.createNode('transform', 'hand')
+            first = blend(arm.translate, hand.translate)
+            second = blend(hand.translate, arm.translate, name='second')
+            self.assertEquals(len(blend.templates), 1)
+            blend(arm.translateX, 2.0)
+            self.assertEquals(len(blend.templates), 2)
+
+        self.assertIs(type(first), Vector)
+        self.assertIs(type(second), Vector)
+        self.assertEquals(second.data().name(), 'second_AddVector_plusMinusAverage.output3D')
+        self.assertEquals(len(self.standin.scene.nodes), 11)
+        source = second.data().node().input3D[0].plug().source()
+        self.assertEquals(source.name(), 'second_MultiplyFloatVector_multiplyDivide.output')
+
+        # Functions reading their inputs are called as they are, other errors are raised
+        @templates.dgfunction
+        def scale(value):
+            return Multiply(value, 2.0 if value.get() > 0.5 else 1.0)
+
+        @templates.dgfunction
+        def broken(value):
+            return Add(value, 'x')
+
+        with self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            scale(arm.translateX)
+            self.assertEquals(list(scale.templates.values()), [None])
+            self.assertRaises(TypeError, broken, arm.translateX)
+
+    def test_serialize(self):
+        import serialize
+
+        with self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            hand = backend.createNode('transform', 'hand')
+            with deferred():
+                angle = Radians(Add(arm.translateX, Constant(2.0)))
+                decompose = DecomposeMatrix(Constant([1.0] * 16))
+                outputs = [angle, Add(decompose.translate, hand.translate)]
+                text = serialize.dumps(outputs)
+                packed = serialize.dumps(outputs, binary=True)
+
+            count = len(backend.nodes)
+            results = serialize.loads(packed)
+            self.assertEquals([type(result) for result in results], [Radians, AddVector])
+            self.assertEquals(len(backend.nodes) - count, 6)
+            self.assertEquals(serialize.loads(text)[1].data().name(), 'AddVector_plusMinusAverage2.output3D')
+            self.assertRaises(RecordingError, serialize.dump, results[0])
+            with options(provenance=True):
+                angle = serialize.loads(text, inputs={arm.translateX.name(): hand.translateX})[0]
+            self.assertEquals(serialize.dump(angle)['operations'][1][1][0], hand.translateX.name())
+            with options(provenance=True):
+                self.assertEquals(serialize.dump(angle), serialize.dump(serialize.load(serialize.dump(angle))))
+
+            # Connections made while recording are made again by load()
+            with deferred():
+                offset = Add(arm.translateX, 1.0)
+                offset.connect(hand.translateX)
+                connected = serialize.dump(Radians(arm.translateY))
+            self.assertEquals(len(connected['connections']), 1)
+            self.assertEquals(len(connected['operations']), 2)
+            serialize.load(connected, inputs={hand.translateX.name(): hand.translateZ})
+
+        self.assertIn('AddFloat', hand.translate.translateZ.plug().source().name())
+        self.assertRaises(ValueError, serialize.load, {'version': serialize.FORMAT_VERSION + 1, 'operations': [],
+                                                       'connections': [], 'outputs': []})
+        self.assertIs(serialize.getOperation('Vector'), Vector)
+        self.assertRaises(ValueError, serialize.getOperation, '%s.Vector' % Vector.__module__)
+        self.assertRaises(ValueError, serialize.getOperation, 'Complement')
+
+        # Only registered operations are written
+        class Complement(OneMinus):
+            pass
+
+        import copy
+        previous = copy.deepcopy(__functions__)
+        try:
+            registerOperation('complement', Complement)
+            self.assertEquals(serialize.getOperationName(Complement), 'Complement')
+            self.assertIs(serialize.getOperation('Complement'), Complement)
+        finally:
+            __functions__.clear()
+            __functions__.update(previous)
+            _factories._dispatcher = None
+        self.assertRaises(RecordingError, serialize.getOperationName, Complement)
+
+    def test_cache(self):
+        import os
+        import shutil
+        import tempfile
+        import cache
+
+        @cache.cached
+        def blend(first, second, weight=0.5):
+            return Add(Multiply(first, 1 - weight), Multiply(second, weight))
+
+        @cache.cached
+        def offset(source, target):
+            Add(source, 1.0).connect(target)
+
+        path = tempfile.mkdtemp()
+        previous = cache.getCache()
+        cache.setCache(cache.Cache(path))
+        try:
+            with self.build() as backend:
+                arm = backend.createNode('transform', 'arm')
+                hand = backend.createNode('transform', 'hand')
+                first = blend(arm.translate, hand.translate)
+                second = blend(hand.translate, arm.translate)
+                blend(hand.translate, arm.translate, weight=0.25)
+
+            self.assertIs(type(first), AddVector)
+            self.assertIs(type(second), AddVector)
+            self.assertEquals(len(self.standin.scene.nodes), 11)
+            self.assertEquals(cache.getCache().asDict()['hits'], 1)
+            self.assertEquals(cache.getCache().asDict()['misses'], 2)
+            self.assertEquals(len(cache.getCache().entries()), 2)
+
+            # Only the process holding the lock removes entries
+            cache.getCache().size = 0
+            open(os.path.join(path, 'lock'), 'w').close()
+            self.assertEquals(cache.getCache().evict(), 0)
+            os.utime(os.path.join(path, 'lock'), (0, 0))
+            self.assertEquals(cache.getCache().evict(), 2)
+            self.assertEquals(cache.getCache().entries(), [])
+
+            # Connections made by the function are made again on a hit
+            cache.getCache().size = cache.SIZE
+            with self.build():
+                offset(arm.translateX, hand.translateX)
+                offset(hand.translateY, arm.translateY)
+
+            self.assertEquals(cache.getCache().asDict()['hits'], 2)
+            for plug in [hand.translate.translateX, arm.translate.translateY]:
+                self.assertIn('plusMinusAverage', plug.plug().source().name())
+
+            # Keys include the helpers and literals a function uses, and sources in any encoding
+            def scaled(factor):
+                def scale(value):
+                    return Multiply(value, factor)
+
+                def build(value):
+                    return scale(value)
+                return build
+
+            self.assertNotEquals(cache.getKey(scaled(1.0), [arm.translateX], {}),
+                                 cache.getKey(scaled(2.0), [arm.translateX], {}))
+
+            import sys
+            with open(os.path.join(path, 'encoded.py'), 'wb') as stream:
+                stream.write(u"# -*- coding: utf-8 -*-\ndef build(value):\n    return value  # \u00e9\n".encode('utf-8'))
+            sys.path.insert(0, path)
+            try:
+                import encoded
+                self.assertEquals(len(cache.getKey(encoded.build, [arm.translateX], {})), 40)
+            finally:
+                sys.path.remove(path)
+                sys.modules.pop('encoded', None)
+        finally:
+            cache.setCache(previous)
+            shutil.rmtree(path)
+
+    def test_batch(self):
+        with self.build() as backend:
+            total = Add(1.0, 2.0)
+            angle = Radians(total)
+            self.assertEquals(len(self.standin.scene.nodes), 0)
+
+        self.assertEquals(len(self.standin.scene.nodes), 2)
+        self.assertEquals(self.standin.scene.connectionCount(), 1)
+        self.assertEquals(total.data().node().input1D[1].get(), 2.0)
+        self.assertEquals(total.data().node().name(), 'AddFloat_plusMinusAverage')
+        self.assertIs(_factories.getBackend().__class__, _backends.PyMelBackend)
+
+        # Pending nodes of the same name are numbered, so their plugs resolve to the right node
+        with self.build() as backend:
+            first = Add(1.0, 2.0)
+            second = Add(3.0, 4.0)
+            self.assertEquals(second.data().node().name(), 'AddFloat_plusMinusAverage1')
+            self.assertIs(backend.plug('AddFloat_plusMinusAverage1.output1D').node(), second.data().node())
+
+    def test_unitConversion(self):
+        # Angles are connected to plain numbers through the unitConversion Maya would put between them
+        with self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            node = backend.createNode('multiplyDivide', 'product')
+            backend.connect(arm.rotateX, node.input1X)
+            backend.connect(arm.translateX, node.input2X)
+            backend.connect(arm.rotateY, node.input1Y)
+            self.assertRaises(NotImplementedError, backend.createNode, 'transform', 'leg', parent=arm)
+
+        self.assertEquals(self.standin.scene.nodeTypes()['unitConversion'], 2)
+        self.assertEquals(self.standin.scene.connectionCount(), 5)
+        conversion = backend.nodes[-1]
+        self.assertAlmostEquals(conversion.conversionFactor.get(), 57.2958, places=4)
+
+    def test_optimize(self):
+        import optimizer
+
+        with self.build(), optimizer.report() as report:
+            Abs(Add(1.0, -3.0))
+            with options(optimize=False):
+                Abs(Add(1.0, -3.0))
+
+        self.assertEquals(self.standin.scene.nodeTypes()['distanceBetween'], 1)
+        self.assertEquals(self.standin.scene.nodeTypes()['multiplyDivide'], 2)
+        self.assertEquals(report.rewrites, {'absDistance': 1})
+        self.assertEquals(report.nodesSaved, 1)
+
+    def test_sincos(self):
+        with self.build(cse=True, optimize=False):
+            angle = Add(1.0, 2.0)
+            Sin(angle)
+            Tan(angle)
+            values = SinCos(angle)
+
+        self.assertEquals(self.standin.scene.nodeTypes()['eulerToQuat'], 1)
+        self.assertEquals(self.standin.scene.nodeTypes()['multiplyDivide'], 2)
+        self.assertEquals(values[1], values.cos)
+        with options(fold=True):
+            self.assertAlmostEquals(SinCos(30.0, degrees=True)[0], 0.5)
+
+    def test_profile(self):
+        import json
+        import profiling
+
+        with profile() as result, self.build():
+            Radians(Add(1.0, 2.0))
+
+        self.assertEquals(result.operations, {'AddFloat': 1, 'Radians': 1})
+        self.assertEquals(result.nodeCount(), 2)
+        self.assertEquals(result.connections, 1)
+        self.assertEquals(json.loads(result.toJson())['nodes'], {'plusMinusAverage': 1, 'multiplyDivide': 1})
+        self.assertEquals(profiling._originals, [])
+
+        # Nodes replayed by templates are counted
+        import templates
+
+        @templates.dgfunction
+        def offset(value):
+            return Radians(Add(value, 1.0))
+
+        self.standin.reset()
+        with profile() as result, self.build() as backend:
+            arm = backend.createNode('transform', 'arm')
+            offset(arm.translateX)
+            offset(arm.translateY)
+
+        self.assertEquals(result.nodeCount(), len(self.standin.scene.nodes))
+        self.assertEquals(result.nodes, {'transform': 1, 'plusMinusAverage': 2, 'multiplyDivide': 2})
+
+        # Functions wrapped before one fails to be are restored
+        getDgDataType = _factories.getDgDataType
+        connect = profiling._connect
+        profiling._connect = None
+        try:
+            self.assertRaises(TypeError, profiling.Profile().start)
+        finally:
+            profiling._connect = connect
+        self.assertEquals(profiling._originals, [])
+        self.assertIs(_factories.getDgDataType, getDgDataType)
+
+    def test_decomposeRotateOrder(self):
+        # The node and the kernel decompose with the same rotate order
+        import evaluate
+
+        with self.build():
+            decompose = DecomposeMatrix(Constant([1.0] * 16), rotateOrder=1)
+        self.assertEquals(decompose.rotateOrder.get(), 1)
+
+        if evaluate.numpy is None:
+            self.skipTest('numpy is not available')
+
+        with self.build(), deferred() as graph:
+            matrix = ComposeMatrix(rotate=[30.0, 40.0, 50.0], rotateOrder=1)
+            rotate = evaluate.evaluate(DecomposeMatrix(matrix, rotateOrder=1).rotate)
+            graph.discard()
+
+        for value, expected in zip(evaluate.numpy.asarray(rotate).ravel(), [30.0, 40.0, 50.0]):
+            self.assertAlmostEquals(value, expected, places=4)
+
+    def test_batchOperation(self):
+        with self.build():
+            with options(fold=True):
+                totals = Batch('add', [1.0, 2.0, 3.0], 1.0)
+            offsets = Batch('add', [[0, 0, 0], [1, 0, 0]], DgData([0, 1, 0]))
+            matrices = Batch('compose', translate=[[0, 0, 0], [1, 0, 0]], rotateOrder=1)
+            self.assertRaises(ValueError, Batch, 'add', [1.0], [1.0, 2.0])
+
+        self.assertEquals([total.get() for total in totals], [2.0, 3.0, 4.0])
+        self.assertEquals(self.standin.scene.nodeTypes(), {'plusMinusAverage': 2, 'composeMatrix': 2})
+        self.assertIsInstance(offsets[1], Vector)
+        self.assertIsInstance(matrices[0], Matrix)
+
+        # Input plugs are typed once, from the first item
+        resolved = []
+        resolvePlugType = _factories._resolvePlugType
+        _factories._resolvePlugType = lambda attribute: resolved.append(attribute.name()) or resolvePlugType(attribute)
+        try:
+            with self.build() as backend:
+                nodes = [backend.createNode('transform', 'node%d' % i) for i in range(3)]
+                Batch('add', [node.translateX for node in nodes], 1.0)
+        finally:
+            _factories._resolvePlugType = resolvePlugType
+
+        self.assertEquals([name for name in resolved if name.startswith('node')], ['node0.translate.translateX'])
+
+    def test_fuse(self):
+        with self.build(), deferred():
+            a = Constant(1.0)
+            total = a + 2.0 + a + 3.0
+            partial = a - 1.0
+            difference = partial - 2.0 - 3.0
+            matrix = Constant([1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1])
+            product = matrix * matrix * matrix
+
+        self.assertEquals(self.standin.scene.nodeTypes()['plusMinusAverage'], 3)
+        self.assertEquals(self.standin.scene.nodeTypes()['multMatrix'], 1)
+        self.assertEquals(total.data().node().input1D[3].get(), 3.0)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -19,15 +19,249 @@ Challenges
 '''
 
 from functools import partial
+from contextlib import contextmanager
 
 import pymel.core as pmc
 import _factories
+import _graph
+import profiling
+from _backends import RecordingError
+
+
+@contextmanager
+def options(**kwargs):
+    '''
+    Temporarily overrides build options, for example:
+
+    with options(fold=True):
+        Add(1.0, 2.0)
+    '''
+
+    for key in kwargs:
+        if key not in _factories.OPTIONS:
+            raise ValueError('Unknown option "%s".' % key)
+
+    previous = dict(_factories.OPTIONS)
+    _factories.OPTIONS.update(kwargs)
+    try:
+        yield _factories.OPTIONS
+    finally:
+        _factories.OPTIONS.clear()
+        _factories.OPTIONS.update(previous)
+
+
+@contextmanager
+def memoScope():
+    '''
+    Shares identical operations only within this block, for example:
+
+    with memoScope():
+        Distance(loc1.translate, loc2.translate)
+    '''
+
+    _factories._memoTables.append(_factories.MemoTable())
+    try:
+        yield _factories._memoTables[-1]
+    finally:
+        _factories._memoTables.pop()
+
+
+@contextmanager
+def packing():
+    '''
+    Packs independent scalar operations built in this block onto shared nodes, for example:
+
+    with packing() as allocator:
+        Radians(joint1.rx)
+        Radians(joint2.rx)
+    '''
+
+    previous = _factories._allocator
+    _factories._allocator = _factories.ChannelAllocator()
+    try:
+        yield _factories._allocator
+    finally:
+        _factories._allocator = previous
+
+
+@contextmanager
+def pooling(share=False):
+    '''
+    Stores the constants built in this block on one node per datatype instead of a node each, for example:
+
+    with pooling(share=True):
+        for joint in joints:
+            Multiply(joint.rx, Constant(0.5))
+
+    Every constant is an element of a multi attribute, so each one can still be edited on its own.
+    :param share: Whether constants with equal values share one element.
+    '''
+
+    previous = _factories._constantPool
+    _factories._constantPool = _factories.ConstantPool(share)
+    try:
+        yield _factories._constantPool
+    finally:
+        _factories._constantPool = previous
+
+
+@contextmanager
+def batch(api=None):
+    '''
+    Queues the scene edits of this block on one MDGModifier and runs them when the block ends, for example:
+
+    with batch() as backend:
+        for joint in joints:
+            Radians(joint.rx)
+
+    Plugs built inside the block can only be read once it has ended.
+    :param api: The module providing the modifier api, maya.api.OpenMaya by default.
+    '''
+
+    previous = _factories._backend
+    backend = _factories._backend = _factories._backends.ModifierBackend(api)
+    try:
+        yield backend
+    except:
+        # The queued nodes are never created, so nothing may keep referring to them
+        for node in backend.nodes:
+            _factories.forgetNode(node.__apimfn__().uuid().asString())
+        raise
+    else:
+        backend.commit()
+    finally:
+        _factories._backend = previous
+
+
+@contextmanager
+def deferred():
+    '''
+    Records the operations built in this block and only creates their nodes when it is committed, for example:
+
+    with deferred() as graph:
+        angle = Radians(joint.rx)
+        unused = Degrees(angle)
+        del unused
+        graph.commit()
+
+    Leaving the block commits anything still pending. Operations that are no longer referenced when
+    the graph is committed are never built, and chains such as a + b + c whose intermediate results are
+    no longer referenced are built as one node, unless options(fuse=False) is set.
+    With options(balance=True) chains of associative operations such as a * b * c * d are built as balanced
+    trees, which Maya can evaluate in parallel.
+    '''
+
+    previous = _factories._activeGraph
+    graph = _factories._activeGraph = _graph.Graph()
+    try:
+        yield graph
+    finally:
+        _factories._activeGraph = previous
+
+    graph.commit()
+
+
+@contextmanager
+def profile():
+    '''
+    Measures the operations, nodes, connections and time of the builds in this block, for example:
+
+    with profile() as result:
+        Distance(loc1.translate, loc2.translate)
+    print(result)
+    result.save('build.json')
+    '''
+
+    result = profiling.Profile()
+    result.start()
+    try:
+        yield result
+    finally:
+        result.stop()
+
+
+def clearMemo():
+    ''' Forgets all shared operations, so following requests build new nodes. '''
+    for table in _factories._memoTables:
+        table.clear()
+
+
+def getValues(data):
+    '''
+    Reads the values of many built DgData at once, for example to validate the results of a build:
+
+    values = getValues([Distance(a, b) for a, b in pairs])
+
+    Plugs are read through the api in one pass, instead of a PyMEL query each.
+    :return: One flat list of values, with one for each Float, three for each Vector, four for each Quaternion and
+    sixteen for each Matrix, in the order of the data.
+    '''
+
+    items = []
+    pending = [data]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, DgData):
+            item._assertBuilt()
+            item = item.data()
+
+        if isinstance(item, list) or isinstance(item, tuple):
+            pending.extend(reversed(item))
+        else:
+            items.append(item)
+
+    values = iter(_factories._backends.readValues([item for item in items if _factories.isPlug(item)]))
+
+    result = []
+    for item in items:
+        pending = [next(values) if _factories.isPlug(item) else item]
+        while pending:
+            value = pending.pop()
+            if isinstance(value, tuple):
+                pending.extend(reversed(value))
+            else:
+                result.append(value)
+
+    return result
+
+
+def sweep(keep=None):
+    '''
+    Deletes the nodes built by operations whose outputs are not connected to anything outside of dgMath,
+    such as the nodes left behind by exploratory or failed builds, for example:
+
+    with options(track=True):
+        result = build()
+    result.connect(loc.tx)
+    sweep()
+
+    Only nodes built with options(track=True) are known to sweep(). Nodes in the scene are deleted with
+    pmc.delete(), so a sweep can be undone.
+
+    :param keep: DgData, or a list of DgData, whose nodes are kept even if their outputs are not used yet.
+    :return: The names of the deleted nodes.
+    '''
+
+    keep = keep if isinstance(keep, list) or isinstance(keep, tuple) else [keep] if keep is not None else []
+    return _factories.sweepNodes([node for data in keep for node in data.nodes()])
+
 
 class DgData(object):
     _type = None
     _isArray = False
     _isConstant = False
 
+    # Outputs other than the data that an operation provides, by attribute name and type
+    _outputs = {}
+
+    # Whether deferred() can merge an input built by the same operation into this one, see _graph.fuse().
+    # 'all' merges such inputs in any position, 'first' only the first input, as for subtraction.
+    _fusion = None
+
+    # Whether the operation takes two inputs and is associative, so deferred() can rebalance chains of it
+    # into trees that evaluate in parallel, see _graph.balance()
+    _associative = False
+
     @classmethod
     def type(cls):
         return cls._type
@@ -36,6 +270,14 @@ class DgData(object):
     def isArray(cls):
         return cls._isArray
 
+    @classmethod
+    def dataType(cls):
+        ''' Returns the datatype class this class inherits from (Float, Vector...). '''
+        for base in cls.__mro__:
+            if base.__dict__.get('_type'):
+                return base
+        return None
+
     def __new__(cls, *args, **kwargs):
         '''
         We override __new__ in order to return the correct object type.
@@ -49,6 +291,11 @@ class DgData(object):
                 raise ValueError('%s requires one input argument.' % cls.__name__)
 
             data = args[0]
+
+            # DgData is already wrapped, rebuilding it would duplicate its operation
+            if isinstance(data, DgData):
+                return data
+
             type = _factories.getDgDataType(data)
 
             return type.__new__(type, data, *args, **kwargs)
@@ -58,6 +305,10 @@ class DgData(object):
 
     def __init__(self, *args, **kwargs):
 
+        # __new__ hands back DgData that is already wrapped as it is
+        if '_data' in self.__dict__:
+            return
+
         # Assign the name if one is provided
         if 'name' in kwargs:
             self._name = kwargs.pop('name')
@@ -71,23 +322,71 @@ class DgData(object):
             self._isConstant = True
             kwargs.pop('constant')
 
-        _data = self.create(*args, **kwargs)
+        # Inside deferred() the operation is recorded and built when the graph is committed
+        graph = _factories.getGraph()
+        if graph is not None and (self.isConstant() or _isOperation(type(self))):
+            self._record(graph, args, kwargs)
+            return
+
+        # Track depth while packing, so only independent operations share nodes
+        allocator = _factories.getChannelAllocator()
+        if allocator is not None:
+            inputs = list(args) + list(kwargs.values())
+            self._depth = 1 + max([allocator.getDepth(input) for input in inputs] or [0])
+
+        _data = _factories.getCreate(self, args, kwargs)(*args, **kwargs)
 
         if isinstance(_data, DgData):
             _data = _data.data()
 
+        if allocator is not None:
+            allocator.addOutput(_data, self._depth)
+
+        # Outputs carry the type they were built as, so using them as inputs never queries the scene
+        if ((self.isConstant() or _isOperation(type(self))) and self.dataType() is not None and
+                _factories.isPlug(_data)):
+            _factories.setPlugType(_data, self.dataType())
+
+        # Remember how operations were built, so they can be evaluated without reading the scene
+        if _factories.OPTIONS['provenance'] and (self.isConstant() or _isOperation(type(self))):
+            self._expression = _graph.Expression(type(self), args, kwargs, self._name, self._isConstant)
+
         self.addAttribute('output', _data)
 
         self._data = _data
 
+    def _record(self, graph, args, kwargs):
+        args = [_graph.record(arg) for arg in args]
+        kwargs = dict((key, _graph.record(value)) for key, value in kwargs.items())
+
+        expression = _graph.Expression(type(self), args, kwargs, self._name, self._isConstant)
+        self._data = graph.add(expression, self)
+
+        for attribute, output_type in self._outputs.items():
+            output = object.__new__(output_type)
+            output._name = '%s.%s' % (self._name, attribute)
+            output._data = graph.add(_graph.OutputExpression(expression, attribute, output_type), output)
+            self.__dict__[attribute] = output
+
     def create(self, *args, **kwargs):
 
         if self.isConstant():
-            return self.createConstant()
+            pool = _factories.getConstantPool()
+            if pool is not None:
+                return pool.allocate(self, args[0] if args else None)
+
+            constant = self.createConstant()
+            if args and _factories.isLiteral(args[0]):
+                _factories.getBackend().setAttr(constant, _factories.getLiteral(args[0]))
+            return constant
         else:
             return args[0]
 
-    def createConstant(self):
+    def createConstant(self, multi=False):
+        '''
+        Creates the attribute holding a constant.
+        :param multi: Whether to create a multi attribute, to hold a pool of constants.
+        '''
         raise NotImplementedError('%s does not support constant creation.' % type(self).__name__)
 
     def __str__(self):
@@ -99,16 +398,22 @@ class DgData(object):
     def data(self):
         return self._data
 
+    def isPending(self):
+        ''' Returns whether this was recorded by deferred() and is not built yet. '''
+        return _graph.getExpression(self) is not None
+
     def name(self):
         return self._name
 
     def isAttr(self):
-        return isinstance(self.data(), pmc.general.Attribute)
+        return _factories.isPlug(self.data())
 
     def get(self):
+        self._assertBuilt()
         return self.data().get() if self.isAttr() else self.data()
 
     def set(self, value):
+        self._assertBuilt()
         self._assertSameType(value)
         if self.isAttr():
             self.data().set(value)
@@ -118,6 +423,13 @@ class DgData(object):
     def connect(self, other):
         ''' This provides the ability to easily connect with other attributes. '''
 
+        if self.isPending() or _graph.getExpression(other) is not None:
+            graph = _factories.getGraph()
+            if graph is None:
+                raise RuntimeError('%s was discarded before it was built.' % self.name())
+            graph.connect(self, other)
+            return
+
         _factories.addConnection(self.data(), other)
 
     def addAttribute(self, name, attributes, input=None):
@@ -144,11 +456,44 @@ class DgData(object):
 
 
     def createNode(self, type, **kwargs):
-        node = pmc.createNode(type, **kwargs)
         name = '%s_%s' % (self.name(), type)
-        node.rename(name)
+        node = _factories.getBackend().createNode(type, name, **kwargs)
+        self.ownNode(node)
         return node
 
+    def ownNode(self, node):
+        ''' Records a node this built, so it can be deleted by sweep() once it is not used. '''
+        self.__dict__.setdefault('_nodes', []).append(node)
+        if _factories.OPTIONS['track']:
+            _factories.trackNode(node, type(self).__name__)
+
+    def nodes(self):
+        ''' Returns the nodes this built. '''
+        return list(self.__dict__.get('_nodes', []))
+
+    def createChannelNode(self, type, operation=1, size=None):
+        '''
+        Creates a node for a scalar operation, inside packing() a free channel of a shared node is used instead.
+        :param type: A node type with channels, see _factories.CHANNELS.
+        :param operation: The operation mode of the node.
+        :param size: The number of inputs, if the result depends on it.
+        :return: The node and the name of the channel to use.
+        '''
+
+        allocator = _factories.getChannelAllocator()
+        if allocator is not None:
+            return allocator.allocate(self, type, operation, self._depth, size)
+
+        node = self.createNode(type)
+        if operation != 1:
+            node.operation.set(operation)
+
+        return node, _factories.CHANNELS[type][0]
+
+    def _assertBuilt(self):
+        if self.isPending():
+            raise RecordingError('%s has not been built yet, commit its graph first.' % self.name())
+
     def _assertSameType(self, other):
         other_type = _factories.getDgDataType(other)
         if isinstance(self, other_type):
@@ -163,21 +508,37 @@ class DgData(object):
         return wrapped_function
 
 
+def _isOperation(cls):
+    ''' Returns whether the class builds nodes, rather than wrapping existing data. '''
+    for base in cls.__mro__:
+        if base is DgData:
+            return False
+        if 'create' in base.__dict__:
+            return True
+    return False
+
+
 class DgArray(DgData):
     _isArray = True
 
     def __getitem__(self, item):
         if self.isAttr():
-            return self.data().getChildren()[item]
+            return self.children()[item]
         else:
             return self.data()[item]
 
     def __len__(self):
         if self.isAttr():
-            return self.data().numChildren()
+            return len(self.children())
         else:
             return len(self.data())
 
+    def children(self):
+        ''' Returns the child plugs of the output, they are only queried once. '''
+        if '_children' not in self.__dict__:
+            self._children = self.data().getChildren()
+        return self._children
+
 
 class Constant(object):
 
@@ -0,0 +1,194 @@
+'''
+
+This module rewrites operations into cheaper node patterns while they are built.
+
+Each pattern is an alternative create() for an operation. When an operation is built, the cheapest
+pattern whose node types exist and that accepts the inputs is used instead of the operation's own
+nodes, if it costs less according to COSTS. Rewrites can be turned off with options(optimize=False).
+
+with optimizer.report() as report:
+    Abs(loc.tx)
+print(report.nodesSaved)
+
+New patterns can be added with registerPattern().
+
+'''
+
+import math
+from contextlib import contextmanager
+
+import _factories
+from functions import *
+
+
+# Relative cost of a node type, covering both scene size and evaluation time
+COSTS = {
+    'network': 0.5,
+    'unitConversion': 0.5,
+    'addDoubleLinear': 0.5,
+    'multDoubleLinear': 0.5,
+    'multiplyDivide': 1.0,
+    'plusMinusAverage': 1.0,
+    'distanceBetween': 1.0,
+    'vectorProduct': 1.0,
+    'eulerToQuat': 1.5,
+    'quatToEuler': 1.5,
+    'composeMatrix': 2.0,
+    'decomposeMatrix': 2.0
+}
+DEFAULT_COST = 1.0
+
+
+def getCost(nodes):
+    return sum(COSTS.get(node, DEFAULT_COST) for node in nodes)
+
+
+class Pattern(object):
+    '''
+    An alternative way of building an operation.
+    :param operation: The DgData subclass this pattern builds.
+    :param create: A function like the operation's create method, taking the DgData being built first.
+    :param nodes: The node types the pattern creates.
+    :param replaces: The node types the operation creates itself.
+    :param matches: An optional function taking the inputs, that returns whether the pattern handles them.
+    '''
+
+    def __init__(self, operation, create, nodes, replaces, matches=None, name=None):
+        self.operation = operation
+        self.create = create
+        self.nodes = list(nodes)
+        self.replaces = list(replaces)
+        self.matches = matches
+        self.name = name or create.__name__.lstrip('_')
+
+    def __repr__(self):
+        return '<Pattern %s for %s>' % (self.name, self.operation.__name__)
+
+    def cost(self):
+        return getCost(self.nodes)
+
+    def saving(self):
+        return getCost(self.replaces) - self.cost()
+
+    def accepts(self, backend, args, kwargs):
+        for node in set(self.nodes):
+            if not backend.hasNodeType(node):
+                return False
+        return self.matches is None or self.matches(*args, **kwargs)
+
+    def apply(self, data, args, kwargs):
+        ''' Builds the operation with this pattern, and counts the rewrite. '''
+
+        for report in _reports:
+            report.add(self)
+
+        return self.create(data, *args, **kwargs)
+
+
+def registerPattern(operation, create, nodes, replaces, matches=None, name=None):
+    '''
+    Adds a cheaper pattern for an operation, for example:
+
+    def _absolute(self, input=-1, **kwargs):
+        node = self.createNode('absolute')
+        self.addAttribute('input', node.input, input=input)
+        return node.output
+
+    registerPattern(Abs, _absolute, ['absolute'], ['multiplyDivide', 'multiplyDivide'])
+    '''
+
+    pattern = Pattern(operation, create, nodes, replaces, matches, name)
+    if pattern.saving() <= 0.0:
+        raise ValueError('%s is not cheaper than the nodes it replaces.' % pattern)
+
+    # Registering a pattern again, when reloading for example, replaces it
+    patterns = _factories._patterns.setdefault(operation, [])
+    patterns[:] = [item for item in patterns if item.name != pattern.name]
+    patterns.append(pattern)
+    patterns.sort(key=lambda item: item.cost())
+
+    return pattern
+
+
+#### REPORTS ####
+
+class Report(object):
+    ''' Counts the rewrites made while it is active. '''
+
+    def __init__(self):
+        self.rewrites = {}
+        self.nodesSaved = 0
+        self.costSaved = 0.0
+
+    def add(self, pattern):
+        self.rewrites[pattern.name] = self.rewrites.get(pattern.name, 0) + 1
+        self.nodesSaved += len(pattern.replaces) - len(pattern.nodes)
+        self.costSaved += pattern.saving()
+
+    def __str__(self):
+        lines = ['%d nodes saved, %.1f cost saved' % (self.nodesSaved, self.costSaved)]
+        for name in sorted(self.rewrites):
+            lines.append('    %s: %d' % (name, self.rewrites[name]))
+        return '\n'.join(lines)
+
+
+# Reports being counted, the first one counts every rewrite since the module was loaded
+_reports = [Report()]
+
+
+def getTotals():
+    return _reports[0]
+
+
+@contextmanager
+def report():
+    '''
+    Counts the rewrites made in this block, for example:
+
+    with report() as rewrites:
+        build()
+    print(rewrites)
+    '''
+
+    current = Report()
+    _reports.append(current)
+    try:
+        yield current
+    finally:
+        _reports.remove(current)
+
+
+#### PATTERNS ####
+
+def _absDistance(self, input=-1, **kwargs):
+    # The distance of a point on the x axis from the origin
+    node = self.createNode('distanceBetween')
+    self.addAttribute('input', node.point1X, input=input)
+    return node.distance
+
+
+def _halfAngleConversion(self, input=0.0, degrees=False):
+    '''
+    Rotates an eulerToQuat by twice the input, so its x and w are the sine and cosine of the input.
+    The unit conversion Maya inserts when connecting a float to an angle does the doubling.
+    '''
+
+    conversion = self.createNode('unitConversion')
+    if degrees:
+        conversion.conversionFactor.set(math.radians(2.0))
+    else:
+        conversion.conversionFactor.set(math.radians(2.0 * 57.2958))
+
+    self.connectInput(input, conversion.input)
+    self.addAttribute('input', input)
+
+    quat_node = self.createNode('eulerToQuat')
+    conversion.output.connect(quat_node.inputRotateX)
+    return quat_node.outputQuat
+
+
+# Maya inserts a unitConversion when the doubled input is connected to the rotation
+_HALF_ANGLE_NODES = ['multiplyDivide', 'unitConversion', 'eulerToQuat']
+
+registerPattern(Abs, _absDistance, ['distanceBetween'], ['multiplyDivide', 'multiplyDivide'])
+registerPattern(HalfAngleQuaternion, _halfAngleConversion, ['unitConversion', 'eulerToQuat'], _HALF_ANGLE_NODES)
@@ -0,0 +1,231 @@
+'''
+
+This module measures where build time and nodes go, see general.profile().
+
+While a Profile is running the build choke points are wrapped, so nothing is measured and
+nothing slows down when no profile is active. Nodes and connections are counted by the backends, so
+the ones templates and cached graphs make are counted too. Nodes are counted for the operation building
+them, nodes made outside of any operation only by their type.
+
+with profile() as result:
+    build()
+print(result)
+result.save('build.json')
+
+'''
+
+import json
+from timeit import default_timer
+
+import pymel.core as pmc
+
+import _backends
+import _factories
+
+
+# The functions that are timed, by the name they are reported under
+TIMED = ['createNode', 'addConnection', 'getDgDataType', 'getOperation']
+
+
+class Profile(object):
+    ''' The counts and times collected while it is running. '''
+
+    def __init__(self):
+        self.calls = dict((name, 0) for name in TIMED)
+        self.times = dict((name, 0.0) for name in TIMED)
+        self.operations = {}
+        self.operationTimes = {}
+        self.nodes = {}
+        self.nodesByOperation = {}
+        self.connections = 0
+        self.wallTime = 0.0
+        self._start = None
+
+    def start(self):
+        self._start = default_timer()
+        if not _profiles:
+            _install()
+        _profiles.append(self)
+
+    def stop(self):
+        if self not in _profiles:
+            return
+
+        _profiles.remove(self)
+        if not _profiles:
+            _uninstall()
+        self.wallTime += default_timer() - self._start
+        self._start = None
+
+    def nodeCount(self):
+        return sum(self.nodes.values())
+
+    def asDict(self):
+        return {
+            'wallTime': self.wallTime,
+            'calls': dict(self.calls),
+            'times': dict(self.times),
+            'operations': dict(self.operations),
+            'operationTimes': dict(self.operationTimes),
+            'nodes': dict(self.nodes),
+            'nodesByOperation': dict(self.nodesByOperation),
+            'nodeCount': self.nodeCount(),
+            'connections': self.connections
+        }
+
+    def toJson(self, indent=2):
+        return json.dumps(self.asDict(), indent=indent, sort_keys=True)
+
+    def save(self, path):
+        ''' Writes the results to a json file, to compare builds across releases. '''
+        with open(path, 'w') as stream:
+            stream.write(self.toJson())
+
+    def __str__(self):
+        lines = ['%.4fs, %d nodes, %d connections' % (self.wallTime, self.nodeCount(), self.connections), '']
+
+        lines.append('%-24s %8s %10s' % ('Call', 'Count', 'Seconds'))
+        for name in TIMED:
+            lines.append('%-24s %8d %10.4f' % (name, self.calls[name], self.times[name]))
+
+        lines.append('')
+        lines.append('%-24s %8s %8s %10s' % ('Operation', 'Count', 'Nodes', 'Seconds'))
+        for name in sorted(self.operations, key=lambda item: -self.operationTimes[item]):
+            lines.append('%-24s %8d %8d %10.4f' % (name, self.operations[name], self.nodesByOperation.get(name, 0),
+                                                    self.operationTimes[name]))
+
+        lines.append('')
+        lines.append('%-24s %8s' % ('Node type', 'Count'))
+        for name in sorted(self.nodes, key=lambda item: -self.nodes[item]):
+            lines.append('%-24s %8d' % (name, self.nodes[name]))
+
+        return '\n'.join(lines)
+
+
+# Profiles that are running, every one of them receives the measurements
+_profiles = []
+
+# The original functions that were wrapped, as (owner, name, original) to restore them
+_originals = []
+
+# How deep each timed function is nested, only the outermost call is timed so recursion is not counted twice
+_depths = {}
+
+# The names of the operations that are being created, the last one owns the nodes that are made
+_building = []
+
+
+def _count(table, key, amount=1):
+    for profile in _profiles:
+        getattr(profile, table)[key] = getattr(profile, table).get(key, 0) + amount
+
+
+def _timed(name, function):
+    def wrapper(*args, **kwargs):
+        _count('calls', name)
+
+        depth = _depths.get(name, 0)
+        _depths[name] = depth + 1
+        start = default_timer()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _depths[name] = depth
+            if not depth:
+                _count('times', name, default_timer() - start)
+
+    return wrapper
+
+
+def _createNode(function):
+    def wrapper(self, type, name, **kwargs):
+        # Recorded nodes are never made
+        if not isinstance(self, _backends.RecordingBackend):
+            _count('nodes', type)
+            if _building:
+                _count('nodesByOperation', _building[-1])
+        return function(self, type, name, **kwargs)
+
+    return _timed('createNode', wrapper)
+
+
+def _getCreate(function):
+    from general import _isOperation
+
+    def wrapper(data, args, kwargs):
+        create = function(data, args, kwargs)
+        name = data.__class__.__name__
+
+        # Plain data only wraps its input, it is not an operation
+        if not (data.isConstant() or _isOperation(data.__class__)):
+            return create
+
+        def timedCreate(*args, **kwargs):
+            _count('operations', name)
+
+            depth = _depths.get(name, 0)
+            _depths[name] = depth + 1
+            _building.append(name)
+            start = default_timer()
+            try:
+                return create(*args, **kwargs)
+            finally:
+                _building.pop()
+                _depths[name] = depth
+                if not depth:
+                    _count('operationTimes', name, default_timer() - start)
+
+        return timedCreate
+
+    return wrapper
+
+
+def _connect(function):
+    def wrapper(self, *args, **kwargs):
+        if not isinstance(self, _backends.RecordingBackend):
+            for profile in _profiles:
+                profile.connections += 1
+        return function(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _patch(owner, name, wrap):
+    original = owner.__dict__.get(name)
+
+    function = getattr(owner, name)
+    if isinstance(owner, type):
+        # Unbound methods have to be unwrapped on python 2, so the wrapper can be bound again
+        function = getattr(function, '__func__', function)
+    setattr(owner, name, wrap(function))
+
+    _originals.append((owner, name, original))
+
+
+def _install():
+    try:
+        _patch(_factories, 'getDgDataType', lambda function: _timed('getDgDataType', function))
+        _patch(_factories, 'getOperation', lambda function: _timed('getOperation', function))
+        _patch(_factories, 'addConnection', lambda function: _timed('addConnection', function))
+        _patch(_factories, 'getCreate', _getCreate)
+
+        # Nodes and connections are counted where they are made, queued ones when they are queued
+        _patch(_backends.PyMelBackend, 'createNode', _createNode)
+        _patch(_backends.ModifierBackend, 'createNode', _createNode)
+        _patch(pmc.general.Attribute, 'connect', _connect)
+        _patch(_backends.ModifierBackend, 'connect', _connect)
+    except:
+        # Nothing may stay wrapped when the profile does not start
+        _uninstall()
+        raise
+
+
+def _uninstall():
+    while _originals:
+        owner, name, original = _originals.pop()
+        if original is None:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, original)
+    _depths.clear()
+    del _building[:]
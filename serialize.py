@@ -0,0 +1,273 @@
+'''
+
+This module writes dgMath graphs as data, so they can be diffed, cached and rebuilt without running the
+script that built them:
+
+with deferred():
+    angle = Radians(Add(arm.rx, offset))
+    text = dumps(angle)
+
+with batch():
+    angle = loads(text, inputs={'arm.rx': 'leftArm.rx'})
+
+A graph holds the operations DgData was built by, with inputs before the operations using them:
+
+{'version': 1,
+ 'operations': [[operation, args, kwargs, name, constant], ...],
+ 'connections': [[source, destination], ...],
+ 'outputs': outputs}
+
+Operations are the names of their classes, which are also their types. Only the classes of functions and
+those registered with registerOperation() are written, graphs never name anything else to import.
+Connections are the ones made with connect() while recording in deferred(), and are made again once the
+operations are built. Source and destination are written like inputs. Constants are operations with
+constant set, taking their values as args. Inputs of operations are written as they were given: numbers
+and lists of them, plug names for the plugs at the boundary of the graph, {'$': index} for the result of
+another operation, {'$': index, 'output': attribute} for another of its outputs (the translate of a
+DecomposeMatrix for example) and {'input': name} for the inputs of evaluate.variable().
+
+dumps() writes the graph as json for review, or with binary=True packed with marshal, which loads faster
+but only in the python version that wrote it. loads() reads either form.
+
+Graphs are read from pending (deferred) DgData, or from built DgData that remembers the operations it was
+built by with options(provenance=True). Outputs of built operations other than their data are only known to
+deferred(), elsewhere they are written as plugs.
+
+'''
+
+import json
+import marshal
+
+import _factories
+import _graph
+import functions
+from _backends import RecordingError
+from general import DgData, _isOperation
+
+
+FORMAT_VERSION = 1
+
+# Starts the packed form, which json never starts with
+_MAGIC = b'DGMG'
+
+
+def dump(data, graph=None):
+    '''
+    Returns the graph of the operations that DgData, or a list of DgData, is built from.
+    :param graph: The deferred() graph whose connections are written with the operations they use, the
+    active graph by default.
+    '''
+
+    outputs = data if isinstance(data, list) or isinstance(data, tuple) else [data]
+
+    graph = graph or _factories.getGraph()
+    connections = list(graph.connections) if graph is not None else []
+
+    # Visit inputs before the operations using them, without recursing through long chains
+    order = []
+    visited = set()
+    roots = outputs + [list(connection) for connection in connections]
+    pending = [(source, False) for source in reversed(_getSources(roots))]
+    while pending:
+        expression, ready = pending.pop()
+        if ready:
+            order.append(expression)
+            continue
+        if expression in visited:
+            continue
+
+        visited.add(expression)
+        pending.append((expression, True))
+        pending.extend((source, False) for source in reversed(_getSources(_getArgs(expression)))
+                       if source not in visited)
+
+    indices = {}
+    operations = []
+    for expression in order:
+        if isinstance(expression, _graph.OutputExpression) or isinstance(expression, _graph.InputExpression):
+            continue
+
+        kwargs = dict((key, _encode(value, indices)) for key, value in expression.kwargs.items()
+                      if key not in ['name', 'n'])
+        indices[expression] = len(operations)
+        operations.append([getOperationName(expression.operation), _encode(list(expression.args), indices),
+                           kwargs, expression.name, expression.constant])
+
+    return {'version': FORMAT_VERSION,
+            'operations': operations,
+            'connections': [[_encode(source, indices), _encode(destination, indices)]
+                            for source, destination in connections],
+            'outputs': _encode(data, indices)}
+
+
+def dumps(data, binary=False, graph=None):
+    '''
+    Returns the graph of DgData as json, or packed as bytes when binary is set.
+    '''
+
+    graph = dump(data, graph)
+    if binary:
+        return _MAGIC + marshal.dumps(graph)
+    return json.dumps(graph, separators=(',', ':'), sort_keys=True)
+
+
+def load(graph, inputs=None):
+    '''
+    Builds the operations of a graph in order, see dump().
+    :param inputs: Values for the plugs at the boundary of the graph and for its inputs, by name.
+    Plugs that are not given are connected as they were written.
+    :return: The outputs in the form they were dumped.
+    '''
+
+    if graph.get('version', 0) > FORMAT_VERSION:
+        raise ValueError('Graph version %s is newer than the supported version %d.'
+                         % (graph.get('version'), FORMAT_VERSION))
+
+    inputs = inputs or {}
+    results = []
+    for operation, args, kwargs, name, constant in graph['operations']:
+        args = _decode(args, results, inputs)
+        kwargs = dict((str(key), _decode(value, results, inputs)) for key, value in kwargs.items())
+
+        # The expression builds through the same path as operations that were recorded by deferred()
+        expression = _graph.Expression(getOperation(operation), args, kwargs, name, constant)
+        results.append(expression.build())
+
+    for source, destination in graph['connections']:
+        source = _decode(source, results, inputs)
+        destination = _decode(destination, results, inputs)
+        if isinstance(source, DgData):
+            source.connect(destination)
+        else:
+            _factories.addConnection(source, destination)
+
+    return _decode(graph['outputs'], results, inputs)
+
+
+def loads(text, inputs=None):
+    '''
+    Builds the operations of a graph written by dumps(), in either form.
+    '''
+
+    if isinstance(text, bytes) and text.startswith(_MAGIC):
+        graph = marshal.loads(text[len(_MAGIC):])
+    else:
+        graph = json.loads(text)
+
+    return load(graph, inputs)
+
+
+def getOperation(name):
+    '''
+    Returns the operation or datatype class with the name, looked up in the operations registered with
+    registerOperation() and the classes of functions.
+    '''
+
+    operation = _getRegisteredOperations().get(name)
+    if operation is None:
+        operation = getattr(functions, name, None)
+
+    if not _isDgDataClass(operation):
+        raise ValueError('Unknown operation "%s".' % name)
+    return operation
+
+
+def getOperationName(operation):
+    '''
+    Returns the name an operation is written with, see getOperation().
+    Raises a RecordingError for operations that would not be found by their name.
+    '''
+
+    name = operation.__name__
+    try:
+        if getOperation(name) is operation:
+            return name
+    except ValueError:
+        pass
+    raise RecordingError('%s cannot be written, register it with registerOperation().' % name)
+
+
+def _getRegisteredOperations():
+    ''' Returns the classes of the function directory by name, including those of each signature. '''
+
+    operations = {}
+    for value in functions.__functions__.values():
+        for operation in value.values() if isinstance(value, dict) else [value]:
+            if _isDgDataClass(operation):
+                operations[operation.__name__] = operation
+    return operations
+
+
+def _isDgDataClass(value):
+    return isinstance(value, type) and issubclass(value, DgData)
+
+
+def _getArgs(expression):
+    return list(expression.args) + list(expression.kwargs.values())
+
+
+def _getSources(values):
+    ''' Returns the expressions within values, in order. '''
+
+    sources = []
+    pending = list(reversed(values))
+    while pending:
+        item = pending.pop()
+        source = _graph.getSource(item)
+        if source is not None:
+            if source not in sources:
+                sources.append(source)
+        elif isinstance(item, list) or isinstance(item, tuple):
+            pending.extend(reversed(item))
+    return sources
+
+
+def _encode(value, indices):
+    source = _graph.getSource(value)
+    if source is not None:
+        if isinstance(source, _graph.OutputExpression):
+            return {'$': indices[source.args[0]], 'output': source.attribute}
+        if isinstance(source, _graph.InputExpression):
+            return {'input': source.name}
+        return {'$': indices[source]}
+
+    if isinstance(value, DgData):
+        if value.isConstant() or _isOperation(type(value)):
+            raise RecordingError('%s was built without its operations, build it in deferred() or with '
+                                 'options(provenance=True) to write it.' % value.name())
+        value = value.data()
+
+    if isinstance(value, list) or isinstance(value, tuple):
+        return [_encode(item, indices) for item in value]
+
+    if _factories.isPlug(value):
+        return value.name()
+
+    if value is None or isinstance(value, bool) or isinstance(value, int) or isinstance(value, float):
+        return value
+    if isinstance(value, basestring):
+        return value
+
+    raise RecordingError('Cannot write %s in a graph.' % repr(value))
+
+
+def _decode(value, results, inputs):
+    if isinstance(value, dict):
+        if 'input' in value:
+            if value['input'] not in inputs:
+                raise ValueError('No value was given for the input "%s".' % value['input'])
+            return inputs[value['input']]
+
+        result = results[value['$']]
+        if 'output' in value:
+            output = getattr(result, value['output'])
+            return output if isinstance(output, DgData) else DgData(output)
+        return result
+
+    if isinstance(value, list):
+        return [_decode(item, results, inputs) for item in value]
+
+    if isinstance(value, basestring):
+        return inputs.get(value, value)
+
+    return value
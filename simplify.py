@@ -0,0 +1,187 @@
+'''
+
+This module removes operations that have no effect before they are built.
+
+Each simplification is a function taking the inputs of an operation. It returns None when it does not
+apply, the simplified inputs, or an Identity when the operation results in one of its inputs. They
+are applied until none of them apply, so for example:
+
+Multiply(Inverse(Inverse(matrix)), identity)
+
+builds no nodes and returns matrix. Products of literal matrices are multiplied in python when folding
+is enabled. Simplifications can be turned off with options(simplify=False).
+
+Operations are only cancelled against the operations they were built from, so inside deferred() the
+cancelled operations are never built. Outside of it they are only cancelled with options(provenance=True),
+when the inner operation has already been built and only the outer one is saved.
+
+New simplifications can be added with registerSimplification().
+
+'''
+
+import _factories
+import _graph
+from _factories import Identity
+from functions import *
+from functions import _matrixProduct
+
+
+IDENTITY_MATRIX = (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+IDENTITY_QUATERNION = (0, 0, 0, 1)
+
+
+def registerSimplification(operation, function):
+    '''
+    Adds a simplification for an operation, for example:
+
+    def _multiplyByOne(args):
+        if len(args) == 2 and isValue(args[1], 1.0):
+            return Identity(args[0])
+
+    registerSimplification(MultiplyFloat, _multiplyByOne)
+    '''
+
+    # Registering a simplification again, when reloading for example, replaces it
+    simplifications = _factories._simplifications.setdefault(operation, [])
+    simplifications[:] = [item for item in simplifications if item.__name__ != function.__name__]
+    simplifications.append(function)
+
+    return function
+
+
+def isValue(data, value):
+    ''' Returns whether the data is a literal equal to the value. '''
+
+    if not _factories.isLiteral(data):
+        return False
+
+    literal = _factories.getLiteral(data)
+    if isinstance(value, tuple):
+        return (isinstance(literal, tuple) and len(literal) == len(value) and
+                all(float(item) == other for item, other in zip(literal, value)))
+    return not isinstance(literal, tuple) and float(literal) == value
+
+
+def getInputs(data, operation):
+    ''' Returns the inputs of the operation the data was built by, or None if it was built otherwise. '''
+
+    source = _graph.getSource(data)
+    if source is None or source.constant or source.operation is not operation:
+        return None
+    if [key for key in source.kwargs if key not in ['name', 'n']]:
+        return None
+    return source.args
+
+
+def _isMatrix(data):
+    if not _factories.isLiteral(data):
+        return False
+    literal = _factories.getLiteral(data)
+    return isinstance(literal, tuple) and len(literal) == 16
+
+
+#### SIMPLIFICATIONS ####
+
+def _dropValues(value, start=0):
+    ''' Drops inputs with no effect on the result, the inputs before start are always kept. '''
+
+    def dropValues(args):
+        inputs = list(args[:start]) + [arg for arg in args[start:] if not isValue(arg, value)]
+        if len(inputs) == len(args) or not inputs:
+            return None
+        if len(inputs) == 1:
+            return Identity(inputs[0])
+        return tuple(inputs)
+
+    return dropValues
+
+
+def _cancel(operation):
+    ''' Cancels an operation applied to its own result, such as a double negation. '''
+
+    def cancel(args):
+        if len(args) != 1:
+            return None
+        inputs = getInputs(args[0], operation)
+        if inputs is not None and len(inputs) == 1:
+            return Identity(inputs[0])
+
+    cancel.__name__ = 'cancel%s' % operation.__name__
+    return cancel
+
+
+def _multiplyByOne(args):
+    if len(args) == 2:
+        if isValue(args[1], 1.0):
+            return Identity(args[0])
+        if isValue(args[0], 1.0):
+            return Identity(args[1])
+
+
+def _divideByOne(args):
+    if len(args) == 2 and isValue(args[1], 1.0):
+        return Identity(args[0])
+
+
+def _scaleByOne(args):
+    if len(args) == 2 and isValue(args[0], 1.0):
+        return Identity(args[1])
+
+
+def _multiplyMatrices(args):
+    ''' Multiplies adjacent literal matrices in python. '''
+
+    if not _factories.OPTIONS['fold']:
+        return None
+
+    inputs = []
+    for arg in args:
+        if inputs and _isMatrix(inputs[-1]) and _isMatrix(arg):
+            inputs[-1] = list(_matrixProduct(_factories.getLiteral(inputs[-1]), _factories.getLiteral(arg)))
+        else:
+            inputs.append(arg)
+
+    if len(inputs) == len(args):
+        return None
+    if len(inputs) == 1:
+        return Identity(inputs[0])
+    return tuple(inputs)
+
+
+_dropZeros = _dropValues(0.0)
+_dropZeros.__name__ = 'dropZeros'
+
+_dropZeroVectors = _dropValues((0.0, 0.0, 0.0))
+_dropZeroVectors.__name__ = 'dropZeroVectors'
+
+_dropZeroMatrices = _dropValues((0.0,) * 16)
+_dropZeroMatrices.__name__ = 'dropZeroMatrices'
+
+_dropSubtractedZeros = _dropValues(0.0, start=1)
+_dropSubtractedZeros.__name__ = 'dropSubtractedZeros'
+
+_dropSubtractedZeroVectors = _dropValues((0.0, 0.0, 0.0), start=1)
+_dropSubtractedZeroVectors.__name__ = 'dropSubtractedZeroVectors'
+
+_dropIdentityMatrices = _dropValues(tuple(float(value) for value in IDENTITY_MATRIX))
+_dropIdentityMatrices.__name__ = 'dropIdentityMatrices'
+
+_dropIdentityQuaternions = _dropValues(tuple(float(value) for value in IDENTITY_QUATERNION))
+_dropIdentityQuaternions.__name__ = 'dropIdentityQuaternions'
+
+
+registerSimplification(MultiplyFloat, _multiplyByOne)
+registerSimplification(DivideFloat, _divideByOne)
+registerSimplification(MultiplyFloatVector, _scaleByOne)
+registerSimplification(AddFloat, _dropZeros)
+registerSimplification(AddVector, _dropZeroVectors)
+registerSimplification(AddMatrix, _dropZeroMatrices)
+registerSimplification(SubtractFloat, _dropSubtractedZeros)
+registerSimplification(SubtractVector, _dropSubtractedZeroVectors)
+registerSimplification(MultiplyMatrix, _dropIdentityMatrices)
+registerSimplification(MultiplyMatrix, _multiplyMatrices)
+registerSimplification(MultiplyQuaternion, _dropIdentityQuaternions)
+
+for _operation in [NegateFloat, VectorNegate, QuaternionNegate, InverseMatrix, Transpose, Conjugate,
+                   InverseQuaternion]:
+    registerSimplification(_operation, _cancel(_operation))
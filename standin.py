@@ -0,0 +1,760 @@
+'''
+
+An in-memory stand-in for the parts of maya.api.OpenMaya that dgMath builds graphs with.
+
+It knows the attributes of the node types dgMath creates and records nodes, connections and
+values in a python Scene, so backends can be exercised without a Maya session:
+
+import standin
+with batch(api=standin):
+    ...
+print(len(standin.scene.nodes))
+
+Nothing is evaluated, reading a plug returns the value it was last set to.
+
+'''
+
+import itertools
+
+
+#### NODE TYPES ####
+
+# Attribute kinds: 'double', 'bool', 'byte', 'long', 'enum', 'angle', 'generic', 'matrix',
+# 'double3' (X/Y/Z children), 'double3xyz' (x/y/z children), 'angle3' (X/Y/Z angles) and 'quat' (X/Y/Z/W).
+# Kinds ending with [] are multi attributes.
+NODE_TYPES = {
+    'network': {},
+    'transform': {'translate': 'double3', 'rotate': 'angle3', 'scale': 'double3', 'matrix': 'matrix',
+                  'worldMatrix': 'matrix[]', 'rotateOrder': 'enum', 'visibility': 'bool'},
+    'unitConversion': {'input': 'generic', 'output': 'generic', 'conversionFactor': 'double'},
+    'addDoubleLinear': {'input1': 'double', 'input2': 'double', 'output': 'double'},
+    'rowFromMatrix': {'input': 'long', 'matrix': 'matrix', 'output': 'quat'},
+    'multiplyDivide': {'operation': 'enum', 'input1': 'double3', 'input2': 'double3', 'output': 'double3'},
+    'plusMinusAverage': {'operation': 'enum', 'input1D': 'double[]', 'input3D': 'double3xyz[]',
+                         'output1D': 'double', 'output3D': 'double3xyz'},
+    'vectorProduct': {'operation': 'enum', 'normalizeOutput': 'bool', 'input1': 'double3', 'input2': 'double3',
+                      'matrix': 'matrix', 'output': 'double3'},
+    'distanceBetween': {'point1': 'double3', 'point2': 'double3', 'inMatrix1': 'matrix', 'inMatrix2': 'matrix',
+                        'distance': 'double'},
+    'composeMatrix': {'useEulerRotation': 'bool', 'inputTranslate': 'double3', 'inputRotate': 'angle3',
+                      'inputScale': 'double3', 'inputQuat': 'quat', 'inputShear': 'double3',
+                      'inputRotateOrder': 'enum', 'outputMatrix': 'matrix'},
+    'decomposeMatrix': {'inputMatrix': 'matrix', 'inputRotateOrder': 'enum', 'outputTranslate': 'double3',
+                        'outputRotate': 'angle3', 'outputScale': 'double3', 'outputQuat': 'quat',
+                        'outputShear': 'double3'},
+    'multMatrix': {'matrixIn': 'matrix[]', 'matrixSum': 'matrix'},
+    'addMatrix': {'matrixIn': 'matrix[]', 'matrixSum': 'matrix'},
+    'inverseMatrix': {'inputMatrix': 'matrix', 'outputMatrix': 'matrix'},
+    'transposeMatrix': {'inputMatrix': 'matrix', 'outputMatrix': 'matrix'},
+    'fourByFourMatrix': dict([('in%s%s' % (i, j), 'double') for i in range(4) for j in range(4)] +
+                             [('output', 'matrix')]),
+    'quatAdd': {'input1Quat': 'quat', 'input2Quat': 'quat', 'outputQuat': 'quat'},
+    'quatProd': {'input1Quat': 'quat', 'input2Quat': 'quat', 'outputQuat': 'quat'},
+    'quatInvert': {'inputQuat': 'quat', 'outputQuat': 'quat'},
+    'quatConjugate': {'inputQuat': 'quat', 'outputQuat': 'quat'},
+    'quatNegate': {'inputQuat': 'quat', 'outputQuat': 'quat'},
+    'quatNormalize': {'inputQuat': 'quat', 'outputQuat': 'quat'},
+    'eulerToQuat': {'inputRotate': 'angle3', 'inputRotateOrder': 'enum', 'outputQuat': 'quat'},
+    'quatToEuler': {'inputQuat': 'quat', 'inputRotateOrder': 'enum', 'outputRotate': 'angle3'},
+}
+
+_CHILD_SUFFIXES = {
+    'double3': ('X', 'Y', 'Z'),
+    'double3xyz': ('x', 'y', 'z'),
+    'angle3': ('X', 'Y', 'Z'),
+    'quat': ('X', 'Y', 'Z', 'W'),
+}
+
+
+#### SCENE ####
+
+class Scene(object):
+    ''' The nodes and connections that have been committed by a modifier. '''
+
+    def __init__(self):
+        self.nodes = []
+        self.connections = {}
+        self.destinations = {}
+
+    def reset(self):
+        del self.nodes[:]
+        self.connections.clear()
+        self.destinations.clear()
+
+    def connectionCount(self):
+        return len(self.connections)
+
+    def nodeTypes(self):
+        ''' Returns the number of nodes of each type. '''
+        counts = {}
+        for node in self.nodes:
+            counts[node.type] = counts.get(node.type, 0) + 1
+        return counts
+
+
+scene = Scene()
+
+
+def reset():
+    scene.reset()
+
+
+_uuids = itertools.count(1)
+
+
+class _Node(object):
+
+    def __init__(self, type):
+        if type not in NODE_TYPES:
+            raise RuntimeError('(kInvalidParameter): Unknown node type "%s"' % type)
+
+        self.type = type
+        self.name = '%s%d' % (type, next(_uuids))
+        self.uuid = '00000000-0000-0000-0000-%012d' % next(_uuids)
+        self.attributes = {}
+        self.values = {}
+
+        for name, kind in NODE_TYPES[type].items():
+            self.attributes[name] = _Attribute.fromKind(name, kind)
+
+
+class _Attribute(object):
+
+    def __init__(self, name, kind, children=None, multi=False, default=0.0):
+        self.name = name
+        self.kind = kind
+        self.children = []
+        self.parent = None
+        self.multi = multi
+        self.default = default
+
+        for child in children or []:
+            self.addChild(child)
+
+    def addChild(self, child):
+        child.parent = self
+        self.children.append(child)
+
+    @classmethod
+    def fromKind(cls, name, kind):
+        multi = kind.endswith('[]')
+        kind = kind.rstrip('[]')
+
+        children = []
+        if kind in _CHILD_SUFFIXES:
+            child_kind = 'angle' if kind == 'angle3' else 'double'
+            children = [cls(name + suffix, child_kind) for suffix in _CHILD_SUFFIXES[kind]]
+
+        return cls(name, kind, children, multi)
+
+    def find(self, name):
+        if self.name == name:
+            return self
+        for child in self.children:
+            found = child.find(name)
+            if found is not None:
+                return found
+        return None
+
+
+#### API ####
+
+class MFn(object):
+    kDependencyNode = 4
+    kAttribute = 554
+    kNumericAttribute = 556
+    kUnitAttribute = 557
+    kEnumAttribute = 558
+    kMatrixAttribute = 559
+    kCompoundAttribute = 560
+    kGenericAttribute = 561
+    kTypedAttribute = 562
+
+
+class MFnData(object):
+    kNumeric = 1
+    kMatrix = 5
+    kDoubleArray = 7
+    kFloatArray = 8
+
+
+class MFnNumericData(object):
+    kBoolean = 1
+    kByte = 2
+    kShort = 4
+    kInt = 7
+    kLong = 7
+    kFloat = 10
+    kDouble = 13
+    k3Float = 12
+    k3Double = 16
+
+
+_ATTRIBUTE_FNS = {
+    'double': MFn.kNumericAttribute,
+    'bool': MFn.kNumericAttribute,
+    'byte': MFn.kNumericAttribute,
+    'long': MFn.kNumericAttribute,
+    'double3': MFn.kNumericAttribute,
+    'double3xyz': MFn.kNumericAttribute,
+    'angle': MFn.kUnitAttribute,
+    'angle3': MFn.kNumericAttribute,
+    'enum': MFn.kEnumAttribute,
+    'matrix': MFn.kMatrixAttribute,
+    'quat': MFn.kCompoundAttribute,
+    'compound': MFn.kCompoundAttribute,
+    'generic': MFn.kGenericAttribute,
+}
+
+_NUMERIC_TYPES = {
+    'double': MFnNumericData.kDouble,
+    'bool': MFnNumericData.kBoolean,
+    'byte': MFnNumericData.kByte,
+    'long': MFnNumericData.kInt,
+    'double3': MFnNumericData.k3Double,
+    'double3xyz': MFnNumericData.k3Double,
+    'angle3': MFnNumericData.k3Double,
+}
+
+
+class MObject(object):
+    ''' Wraps a stand-in node or attribute. '''
+
+    def __init__(self, item=None):
+        self._item = item
+
+    def __eq__(self, other):
+        return isinstance(other, MObject) and other._item is self._item
+
+    def __ne__(self, other):
+        return not self == other
+
+    def isNull(self):
+        return self._item is None
+
+    def hasFn(self, fn):
+        if isinstance(self._item, _Node):
+            return fn == MFn.kDependencyNode
+        if isinstance(self._item, _Attribute):
+            if fn == MFn.kCompoundAttribute and self._item.children:
+                return True
+            return fn in (MFn.kAttribute, _ATTRIBUTE_FNS[self._item.kind])
+        return False
+
+    def apiType(self):
+        if isinstance(self._item, _Node):
+            return MFn.kDependencyNode
+        return _ATTRIBUTE_FNS[self._item.kind]
+
+MObject.kNullObj = MObject()
+
+
+class MObjectHandle(object):
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def hashCode(self):
+        return id(self._obj._item)
+
+    def isValid(self):
+        return self._obj._item in scene.nodes
+
+
+class MUuid(object):
+
+    def __init__(self, value):
+        self._value = value
+
+    def asString(self):
+        return self._value
+
+
+class MFnDependencyNode(object):
+
+    def __init__(self, obj=None):
+        self._node = obj._item if obj is not None else None
+
+    def name(self):
+        return self._node.name
+
+    @property
+    def typeName(self):
+        return self._node.type
+
+    def uuid(self):
+        return MUuid(self._node.uuid)
+
+    def hasAttribute(self, name):
+        return self._find(name) is not None
+
+    def attribute(self, name):
+        attribute = self._find(name)
+        if attribute is None:
+            raise RuntimeError('(kInvalidParameter): No attribute "%s" on %s' % (name, self._node.name))
+        return MObject(attribute)
+
+    def getConnections(self):
+        ''' Returns the plugs of the node that are connected, as sources or destinations. '''
+        plugs = []
+        for key, source in scene.connections.items():
+            if key[0] == id(self._node):
+                plugs.append(scene.destinations[key])
+            if source._node is self._node and source.key() not in [plug.key() for plug in plugs]:
+                plugs.append(source)
+        return plugs
+
+    def findPlug(self, attribute, wantNetworkedPlug=False):
+        if not isinstance(attribute, MObject):
+            attribute = self.attribute(attribute)
+        return MPlug(MObject(self._node), attribute)
+
+    def _find(self, name):
+        for attribute in self._node.attributes.values():
+            found = attribute.find(name)
+            if found is not None:
+                return found
+        return None
+
+
+class MFnAttribute(object):
+
+    def __init__(self, obj=None):
+        self._attribute = obj._item if obj is not None else None
+
+    @property
+    def name(self):
+        return self._attribute.name
+
+    @property
+    def parent(self):
+        return MObject(self._attribute.parent)
+
+    @property
+    def array(self):
+        return self._attribute.multi
+
+    @array.setter
+    def array(self, value):
+        self._attribute.multi = value
+
+    def accepts(self, dataType):
+        if self._attribute.kind != 'generic':
+            return False
+        return dataType in (MFnData.kNumeric, MFnData.kMatrix)
+
+    def object(self):
+        return MObject(self._attribute)
+
+
+class MFnNumericAttribute(MFnAttribute):
+
+    _KINDS = dict((value, key) for key, value in _NUMERIC_TYPES.items() if key in ('double', 'bool', 'byte', 'long'))
+
+    def numericType(self):
+        return _NUMERIC_TYPES[self._attribute.kind]
+
+    def create(self, longName, shortName, *args):
+        if len(args) >= 2 and isinstance(args[0], MObject) and isinstance(args[1], MObject):
+            children = [arg._item for arg in args if isinstance(arg, MObject) and not arg.isNull()]
+            self._attribute = _Attribute(longName, 'double3', children)
+        else:
+            kind = self._KINDS.get(args[0], 'double')
+            default = args[1] if len(args) > 1 else 0.0
+            self._attribute = _Attribute(longName, kind, default=default)
+        return MObject(self._attribute)
+
+
+class MFnUnitAttribute(MFnAttribute):
+    kAngle = 1
+    kDistance = 2
+
+    def unitType(self):
+        return MFnUnitAttribute.kAngle if self._attribute.kind == 'angle' else MFnUnitAttribute.kDistance
+
+    def create(self, longName, shortName, unitType, default=0.0):
+        self._attribute = _Attribute(longName, 'angle', default=default)
+        return MObject(self._attribute)
+
+
+class MFnEnumAttribute(MFnAttribute):
+    pass
+
+
+class MFnMatrixAttribute(MFnAttribute):
+    kDouble = 1
+
+    def create(self, longName, shortName, type=1):
+        self._attribute = _Attribute(longName, 'matrix')
+        return MObject(self._attribute)
+
+
+class MFnCompoundAttribute(MFnAttribute):
+
+    def create(self, longName, shortName):
+        self._attribute = _Attribute(longName, 'compound')
+        return MObject(self._attribute)
+
+    def addChild(self, child):
+        self._attribute.addChild(child._item)
+
+    def numChildren(self):
+        return len(self._attribute.children)
+
+    def child(self, index):
+        return MObject(self._attribute.children[index])
+
+
+class MFnTypedAttribute(MFnAttribute):
+
+    def attrType(self):
+        return MFnData.kMatrix if self._attribute.kind == 'matrix' else MFnData.kNumeric
+
+
+class MMatrix(object):
+
+    def __init__(self, values=None):
+        self.values = tuple(float(value) for value in (values or [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]))
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+class MFnMatrixData(object):
+
+    def __init__(self, obj=None):
+        self._matrix = obj._item if obj is not None else None
+
+    def create(self, matrix=None):
+        self._matrix = matrix or MMatrix()
+        return MObject(self._matrix)
+
+    def matrix(self):
+        return self._matrix
+
+
+class MAngle(object):
+    kRadians = 1
+    kDegrees = 2
+
+    def __init__(self, value=0.0, unit=1):
+        self._radians = value * 0.017453292519943295 if unit == MAngle.kDegrees else value
+
+    @staticmethod
+    def uiUnit():
+        return MAngle.kDegrees
+
+    def asRadians(self):
+        return self._radians
+
+    def asDegrees(self):
+        return self._radians / 0.017453292519943295
+
+    def asUnits(self, unit):
+        return self.asDegrees() if unit == MAngle.kDegrees else self._radians
+
+
+class MDistance(object):
+    kCentimeters = 6
+
+    def __init__(self, value=0.0, unit=6):
+        self._value = value
+
+    @staticmethod
+    def uiUnit():
+        return MDistance.kCentimeters
+
+    def asCentimeters(self):
+        return self._value
+
+    def asUnits(self, unit):
+        return self._value
+
+
+class MPlug(object):
+    ''' A plug is a node and a path of (attribute, logical index) pairs. '''
+
+    def __init__(self, node=None, attribute=None, path=None):
+        self._node = node._item if node is not None else None
+        if path is not None:
+            self._path = path
+        elif attribute is not None:
+            # Children of compounds are addressed through their parents, as Maya names them
+            chain = [attribute._item]
+            while chain[0].parent is not None and not chain[0].parent.multi:
+                chain.insert(0, chain[0].parent)
+            self._path = tuple((item, None) for item in chain)
+        else:
+            self._path = ()
+
+    @property
+    def isNull(self):
+        return not self._path
+
+    @property
+    def isArray(self):
+        attribute, index = self._path[-1]
+        return attribute.multi and index is None
+
+    @property
+    def isElement(self):
+        return self._path[-1][1] is not None
+
+    @property
+    def isCompound(self):
+        return bool(self._path[-1][0].children)
+
+    def node(self):
+        return MObject(self._node)
+
+    def attribute(self):
+        return MObject(self._path[-1][0])
+
+    def key(self):
+        return (id(self._node), self.partialName())
+
+    def elementByLogicalIndex(self, index):
+        attribute, _ = self._path[-1]
+        return MPlug(MObject(self._node), path=self._path[:-1] + ((attribute, index),))
+
+    def logicalIndex(self):
+        return self._path[-1][1]
+
+    def numChildren(self):
+        return len(self._path[-1][0].children)
+
+    def child(self, attribute):
+        children = self._path[-1][0].children
+        attribute = children[attribute] if isinstance(attribute, int) else attribute._item
+        if attribute not in children:
+            raise RuntimeError('(kInvalidParameter): %s is not a child of %s' % (attribute.name, self.name()))
+        return MPlug(MObject(self._node), path=self._path + ((attribute, None),))
+
+    def partialName(self, *args, **kwargs):
+        names = []
+        for attribute, index in self._path:
+            names.append(attribute.name if index is None else '%s[%d]' % (attribute.name, index))
+        return '.'.join(names)
+
+    def name(self):
+        return '%s.%s' % (self._node.name, self.partialName())
+
+    def source(self):
+        source = scene.connections.get(self.key())
+        return source if source is not None else MPlug()
+
+    @property
+    def isSource(self):
+        return bool(self.destinations())
+
+    def destinations(self):
+        return [scene.destinations[key] for key, source in scene.connections.items() if source.key() == self.key()]
+
+    def _value(self):
+        return self._node.values.get(self.partialName(), self._path[-1][0].default)
+
+    def asDouble(self):
+        return float(self._value())
+
+    def asInt(self):
+        return int(self._value())
+
+    def asBool(self):
+        return bool(self._value())
+
+    def asMAngle(self):
+        return MAngle(self.asDouble())
+
+    def asMDistance(self):
+        return MDistance(self.asDouble())
+
+    def asMObject(self):
+        value = self._node.values.get(self.partialName())
+        return MFnMatrixData().create(value if isinstance(value, MMatrix) else MMatrix())
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, name):
+        node_name, _, path = name.partition('.')
+        for node in scene.nodes:
+            if node.name == node_name:
+                break
+        else:
+            raise RuntimeError('(kInvalidParameter): Object does not exist "%s"' % name)
+
+        self._items.append((node, path))
+        return self
+
+    def length(self):
+        return len(self._items)
+
+    def getDependNode(self, index):
+        return MObject(self._items[index][0])
+
+    def getPlug(self, index):
+        node, path = self._items[index]
+        return _findPlug(node, path)
+
+
+def _findPlug(node, path):
+    ''' Resolves an attribute path like "input3D[0].input3Dx" on a stand-in node. '''
+
+    fn = MFnDependencyNode(MObject(node))
+    plug = None
+
+    for segment in path.split('.'):
+        name, _, index = segment.partition('[')
+        attribute = fn.attribute(name)
+        plug = fn.findPlug(attribute) if plug is None else plug.child(attribute)
+        if index:
+            plug = plug.elementByLogicalIndex(int(index.rstrip(']')))
+
+    return plug
+
+
+class MDGModifier(object):
+    ''' Queues edits to the stand-in scene until doIt() is called. '''
+
+    def __init__(self):
+        self._queue = []
+        self._done = []
+
+    def _add(self, do, undo):
+        self._queue.append((do, undo))
+
+    def createNode(self, type):
+        node = _Node(type)
+
+        def undo():
+            scene.nodes.remove(node)
+
+        self._add(lambda: scene.nodes.append(node), undo)
+        return MObject(node)
+
+    def deleteNode(self, obj):
+        node = obj._item
+
+        def do():
+            scene.nodes.remove(node)
+            for key, source in list(scene.connections.items()):
+                if key[0] == id(node) or source._node is node:
+                    del scene.connections[key]
+                    del scene.destinations[key]
+
+        self._add(do, lambda: scene.nodes.append(node))
+
+    def renameNode(self, obj, name):
+        node = obj._item
+        previous = node.name
+
+        def do():
+            node.name = name
+
+        def undo():
+            node.name = previous
+
+        self._add(do, undo)
+
+    def addAttribute(self, obj, attribute):
+        node = obj._item
+        attribute = attribute._item
+
+        def do():
+            node.attributes[attribute.name] = attribute
+
+        self._add(do, lambda: node.attributes.pop(attribute.name))
+
+    def connect(self, source, destination):
+        key = destination.key()
+
+        def do():
+            scene.connections[key] = source
+            scene.destinations[key] = destination
+
+        def undo():
+            scene.connections.pop(key, None)
+            scene.destinations.pop(key, None)
+
+        self._add(do, undo)
+
+    def disconnect(self, source, destination):
+        key = destination.key()
+        def do():
+            scene.connections.pop(key, None)
+            scene.destinations.pop(key, None)
+
+        def undo():
+            scene.connections[key] = source
+            scene.destinations[key] = destination
+
+        self._add(do, undo)
+
+    def _setValue(self, plug, value):
+        node = plug._node
+        name = plug.partialName()
+        previous = node.values.get(name)
+
+        def do():
+            node.values[name] = value
+
+        self._add(do, lambda: node.values.__setitem__(name, previous))
+
+    def newPlugValueDouble(self, plug, value):
+        self._setValue(plug, float(value))
+
+    def newPlugValueInt(self, plug, value):
+        self._setValue(plug, int(value))
+
+    def newPlugValueBool(self, plug, value):
+        self._setValue(plug, bool(value))
+
+    def newPlugValueMAngle(self, plug, value):
+        self._setValue(plug, value.asRadians())
+
+    def newPlugValueMDistance(self, plug, value):
+        self._setValue(plug, value.asCentimeters())
+
+    def newPlugValue(self, plug, data):
+        self._setValue(plug, data._item)
+
+    def doIt(self):
+        queue, self._queue = self._queue, []
+        for do, undo in queue:
+            do()
+            self._done.append(undo)
+
+    def undoIt(self):
+        while self._done:
+            self._done.pop()()
+
+
+#### MESSAGES ####
+
+class MMessage(object):
+    ''' Callbacks are accepted and never called, the standin scene only changes through reset(). '''
+
+    _ids = itertools.count(1)
+
+    @staticmethod
+    def removeCallbacks(ids):
+        pass
+
+
+class MDGMessage(MMessage):
+
+    @staticmethod
+    def addNodeRemovedCallback(function, type=None):
+        return next(MMessage._ids)
+
+
+class MSceneMessage(MMessage):
+    kBeforeNew = 1
+    kBeforeOpen = 2
+
+    @staticmethod
+    def addCallback(message, function):
+        return next(MMessage._ids)
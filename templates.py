@@ -0,0 +1,264 @@
+'''
+
+This module turns functions of dgMath operations into templates, that are traced once and then stamped
+out without going through the operations again:
+
+@dgfunction
+def twist(matrix, axis):
+    ...
+    return angle
+
+for joint in joints:
+    twist(joint.worldMatrix[0], [1, 0, 0])
+
+The first call for a combination of input types builds the function on a recording backend, and records
+the nodes it creates, the attributes it adds, the values it sets and the connections it makes. Later calls
+replay those edits on the current backend, only resolving the inputs and outputs, so they cost little more
+than creating the nodes. Templates are traced again for different input types or keyword arguments.
+
+Inputs are the positional arguments of the function, keyword arguments are settings that are part of the
+template. Results are returned as their datatype (Float, Vector...), with the same nesting as the function
+returns them. Functions are called as they are inside deferred(), packing() and pooling(), and whenever
+they cannot be traced, for example because they read values of their inputs.
+
+'''
+
+from functools import wraps
+
+import _factories
+from _backends import ModifierBackend, RecordingBackend, RecordingError, Plug
+from general import DgData
+from datatypes import Float, Vector, Matrix, Quaternion
+
+
+class Output(object):
+    ''' An output of a template, the source it is read from and the datatype it is returned as. '''
+
+    def __init__(self, type, source):
+        self.type = type
+        self.source = source
+
+
+class Template(object):
+    '''
+    The edits a function makes, recorded with placeholder nodes for its inputs.
+    :param nodes: The type, name and added attributes of every node, as (type, name, [(args, kwargs)]).
+    :param edits: The attribute values and connections, as ('set', target, value) or ('connect', target, source).
+    Targets and sources are ('node', index, path), ('input', index, path) or ('external', plug).
+    :param outputs: The outputs in the form the function returns them, with an Output for each DgData.
+    '''
+
+    def __init__(self, nodes, edits, outputs):
+        self.nodes = nodes
+        self.edits = edits
+        self.outputs = outputs
+
+    def __repr__(self):
+        return '<Template %d nodes, %d edits>' % (len(self.nodes), len(self.edits))
+
+    def instance(self, inputs, name):
+        ''' Creates the nodes of the template for the inputs, and returns its outputs. '''
+
+        backend = _factories.getBackend()
+
+        nodes = []
+        for type, suffix, attributes in self.nodes:
+            node = backend.createNode(type, '%s_%s' % (name, suffix))
+            for args, kwargs in attributes:
+                node.addAttr(*args, **kwargs)
+            nodes.append(node)
+
+        for edit, target, value in self.edits:
+            target = self._resolve(target, nodes, inputs)
+            if edit == 'set':
+                backend.setAttr(target, value)
+            elif value[0] == 'node':
+                backend.connect(self._resolve(value, nodes, inputs), target)
+            else:
+                # Only the inputs can be of any form, so only they go through addConnection()
+                _factories.addConnection(self._resolve(value, nodes, inputs), target)
+
+        outputs = []
+        result = self._output(self.outputs, nodes, inputs, outputs)
+
+        # The nodes belong to the first output, so they are swept together
+        if outputs:
+            for node in nodes:
+                outputs[0].ownNode(node)
+
+        return result
+
+    def _output(self, output, nodes, inputs, outputs):
+        if isinstance(output, Output):
+            data = self._resolve(output.source, nodes, inputs)
+            if not isinstance(data, DgData):
+                data = output.type(data)
+                outputs.append(data)
+            return data
+
+        if isinstance(output, list) or isinstance(output, tuple):
+            return type(output)(self._output(item, nodes, inputs, outputs) for item in output)
+
+        return output
+
+    @staticmethod
+    def _resolve(reference, nodes, inputs):
+        kind, item = reference[0], reference[1]
+        if kind == 'node':
+            return nodes[item].attr(reference[2]) if reference[2] else nodes[item]
+        if kind == 'input':
+            value = inputs[item]
+            for index in reference[2]:
+                value = DgData(value)[index]
+            return value
+        if kind == 'list':
+            return [Template._resolve(child, nodes, inputs) for child in item]
+        return item
+
+
+def _placeholder(datatype):
+    ''' Returns the constant standing in for an input of a datatype while tracing, or None. '''
+
+    from general import Constant
+
+    if datatype not in [Float, Vector, Matrix, Quaternion]:
+        return None
+
+    defaults = datatype._defaultInputs
+    return Constant(defaults[0] if isinstance(defaults, list) else defaults)
+
+
+def trace(function, args, kwargs):
+    '''
+    Builds the function with placeholders for its inputs on a modifier that is never run, and records its edits.
+    :return: The Template, or None if the function cannot be traced.
+    '''
+
+    from general import memoScope
+
+    previous = (_factories._backend, _factories._activeGraph, _factories._allocator, _factories._constantPool)
+
+    # Traces use the api of the batch() they are made in, so stand-in builds never touch Maya
+    api = previous[0].api if isinstance(previous[0], ModifierBackend) else None
+    backend = _factories._backend = RecordingBackend(api)
+    _factories._activeGraph = _factories._allocator = _factories._constantPool = None
+    try:
+        with memoScope():
+            placeholders = [_placeholder(_factories.getDgDataType(arg)) for arg in args]
+            if None in placeholders:
+                return None
+
+            # Functions that read their inputs are called as they are, any other error is raised
+            try:
+                result = function(*placeholders, **kwargs)
+            except RecordingError:
+                return None
+
+        return _getTemplate(backend, placeholders, result)
+
+    finally:
+        # The traced nodes never exist, so nothing may keep referring to them
+        for node in backend.nodes:
+            _factories.forgetNode(node.__apimfn__().uuid().asString())
+        _factories._backend, _factories._activeGraph, _factories._allocator, _factories._constantPool = previous
+
+
+def _getTemplate(backend, placeholders, result):
+    ''' Returns the edits recorded by a backend as a Template, the nodes of the placeholders become inputs. '''
+
+    inputs = {}
+    for index, placeholder in enumerate(placeholders):
+        inputs[placeholder.data().node()] = (index, placeholder.data())
+
+    indices = {}
+    nodes = []
+    for node in backend.nodes:
+        if node in inputs:
+            continue
+        indices[node] = len(nodes)
+        nodes.append((node.nodeType, node._name, node.addedAttributes))
+
+    def reference(value):
+        if isinstance(value, list) or isinstance(value, tuple):
+            return ('list', [reference(item) for item in value])
+        if isinstance(value, basestring) and backend.hasNode(value.partition('.')[0]):
+            value = backend.plug(value)
+        if not isinstance(value, Plug) or value.backend is not backend:
+            return ('external', value)
+
+        node = value.node()
+        if node in inputs:
+            index, plug = inputs[node]
+            return ('input', index, _childIndices(plug, value))
+        return ('node', indices[node], value.name(includeNode=False, fullAttrPath=True))
+
+    edits = []
+    for edit, target, value in backend.edits():
+        if edit == 'connect':
+            edits.append(('connect', reference(target), reference(value)))
+            continue
+
+        # The values of the placeholders are only defaults, the inputs keep their own
+        target = reference(target)
+        if target[0] != 'input':
+            edits.append(('set', target, value))
+
+    def output(value):
+        if isinstance(value, DgData):
+            return Output(value.dataType() or type(value), reference(value.data()))
+        if isinstance(value, list) or isinstance(value, tuple):
+            return type(value)(output(item) for item in value)
+        return value
+
+    return Template(nodes, edits, output(result))
+
+
+def _childIndices(root, plug):
+    ''' Returns the child indices leading from the root plug to a plug under it. '''
+
+    indices = []
+    path = plug.name(includeNode=False, fullAttrPath=True).split('.')
+    rootPath = root.name(includeNode=False, fullAttrPath=True).split('.')
+    current = root
+    for name in path[len(rootPath):]:
+        names = [child.name(includeNode=False, fullAttrPath=True).split('.')[-1] for child in current.getChildren()]
+        indices.append(names.index(name))
+        current = current.getChildren()[indices[-1]]
+    return indices
+
+
+def dgfunction(function):
+    '''
+    Makes a function of dgMath operations a template, that is traced once for each combination of input
+    types and keyword arguments and replayed for every later call, see the module documentation.
+    The nodes of each call are named after the function, or the name keyword argument.
+    '''
+
+    templates = {}
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        name = kwargs.pop('name', function.__name__)
+
+        # Recording, packing and pooling need the operations themselves
+        if (_factories.getGraph() is not None or _factories.getChannelAllocator() is not None or
+                _factories.getConstantPool() is not None):
+            return function(*args, **kwargs)
+
+        try:
+            key = (tuple(_factories.getDgDataType(arg) for arg in args), tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return function(*args, **kwargs)
+
+        if key not in templates:
+            templates[key] = trace(function, args, kwargs)
+
+        template = templates[key]
+        if template is None:
+            return function(*args, **kwargs)
+
+        return template.instance(args, name)
+
+    wrapper.templates = templates
+    return wrapper